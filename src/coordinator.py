@@ -2,14 +2,85 @@ import hydra
 import os
 import h5py
 import numpy as np
-from omegaconf import DictConfig
+from hydra.utils import to_absolute_path
+from omegaconf import DictConfig, OmegaConf
 from dataset import get_standard_dataset, get_test_data, get_validation_data
+from dataset.shards import ShardedDataset
 import torch
 from torch.utils.data import DataLoader
 from deep_image_prior import DeepImagePriorReconstructor
+from evaluation.history_store import HistoryStore
+from util.reco_cache import get_reconstruction_cache
+from util.process_pool import make_paths_absolute
+from util.parallel_reconstruction import (
+        reconstruct_samples, reconstruct_samples_parallel)
 from pre_training import Trainer
 from copy import deepcopy
 
+def gamma_sweep_run_path(gamma):
+    return os.path.join('gamma_sweep', 'gamma_{:g}'.format(gamma))
+
+def get_history_store(cfg):
+    if cfg.get('save_histories_store_filename') is None:
+        return None
+    return HistoryStore(to_absolute_path(cfg.save_histories_store_filename))
+
+def reconstruct_gamma_sweep(cfg, reconstructor, dataloader, im_shape):
+    """
+    Reconstruct with all values of ``cfg.mdl.optim.gamma_sweep`` in a single
+    batched run and store the results of each value like a separate run in
+    ``gamma_sweep_run_path(gamma)`` (including ``.hydra/config.yaml`` with
+    the value of ``mdl.optim.gamma``), as expected by
+    ``validation_select_gamma.py``.
+    """
+    if (cfg.save_iterates_path is not None or
+            cfg.save_iterates_params_path is not None):
+        raise ValueError('Saving iterates is not supported by the gamma sweep')
+
+    gammas = list(cfg.mdl.optim.gamma_sweep)
+    history_store = get_history_store(cfg)
+    files = []
+    recos_datasets = []
+    for gamma in gammas:
+        run_path = gamma_sweep_run_path(gamma)
+        cfg_gamma = deepcopy(cfg)
+        cfg_gamma.mdl.optim.gamma = gamma
+        cfg_gamma.mdl.optim.gamma_sweep = None
+        os.makedirs(os.path.join(run_path, '.hydra'), exist_ok=True)
+        OmegaConf.save(cfg_gamma, os.path.join(run_path, '.hydra', 'config.yaml'))
+        os.makedirs(os.path.join(run_path, cfg.save_reconstruction_path), exist_ok=True)
+        if cfg.save_histories_path is not None:
+            os.makedirs(os.path.join(run_path, cfg.save_histories_path), exist_ok=True)
+        file = h5py.File(os.path.join(
+                run_path, cfg.save_reconstruction_path, 'recos.hdf5'), 'w')
+        files.append(file)
+        recos_datasets.append(file.create_dataset('recos',
+                shape=(1,) + im_shape, maxshape=(1,) + im_shape,
+                dtype=np.float32, chunks=True))
+
+    for i, (noisy_obs, fbp, *gt) in enumerate(dataloader):
+        gt = gt[0] if gt else None
+        recos, *optional_out = reconstructor.reconstruct_gamma_sweep(
+                noisy_obs.float(), fbp, gt, gammas=gammas,
+                return_histories=(cfg.save_histories_path is not None or
+                                  history_store is not None))
+        for reco, recos_dataset in zip(recos, recos_datasets):
+            recos_dataset[i] = reco
+        for gamma, histories in zip(gammas, optional_out[0] if optional_out else []):
+            histories = {k: np.array(v, dtype=np.float32)
+                         for k, v in histories.items()}
+            if cfg.save_histories_path is not None:
+                np.savez(os.path.join(gamma_sweep_run_path(gamma),
+                                      cfg.save_histories_path, 'histories.npz'),
+                         **histories)
+            if history_store is not None:
+                history_store.append(
+                        os.path.abspath(gamma_sweep_run_path(gamma)),
+                        histories, sample=i)
+
+    for file in files:
+        file.close()
+
 @hydra.main(config_path='cfgs', config_name='config')
 def coordinator(cfg : DictConfig) -> None:
 
@@ -43,15 +114,40 @@ def coordinator(cfg : DictConfig) -> None:
     if cfg.torch_manual_seed_pretrain_init_model:
         torch.random.manual_seed(cfg.torch_manual_seed_pretrain_init_model)
 
-    reconstructor = DeepImagePriorReconstructor(**ray_trafo, cfg=cfg.mdl)
+    # copy of the config, since the seed is set per sample
+    reconstructor = DeepImagePriorReconstructor(**ray_trafo, cfg=deepcopy(cfg.mdl))
     model = deepcopy(reconstructor.model)
     if cfg.pretraining:
-        trn_ray_trafos = ({'smooth_pinv_ray_trafo_module':
-                               ray_trafos['smooth_pinv_ray_trafo_module']}
+        trn_ray_trafos = ({k: ray_trafos[k] for k in [
+                               'smooth_pinv_ray_trafo_module',
+                               'torch_smooth_pinv_ray_trafo_module']
+                           if k in ray_trafos}
                           if cfg.trn.use_adversarial_attacks else {})
-        Trainer(model=model,
-                ray_trafos=trn_ray_trafos,
-                cfg=cfg.trn).train(dataset)
+        if cfg.trn.get('batched_pair_generation', False):
+            for k in ['ray_trafo_module', 'smooth_pinv_ray_trafo_module',
+                      'torch_smooth_pinv_ray_trafo_module']:
+                if k in ray_trafos:
+                    trn_ray_trafos.setdefault(k, ray_trafos[k])
+        if cfg.trn.get('shards_path') is not None:
+            # pre-generated with examples/export_shards.py
+            dataset_train = ShardedDataset(
+                    cfg.trn.shards_path, seed=cfg.data.seed,
+                    shuffle_buffer_size=cfg.trn.get('shuffle_buffer_size', 1024))
+        else:
+            dataset_train = dataset
+        trainer = Trainer(model=model,
+                          ray_trafos=trn_ray_trafos,
+                          cfg=cfg.trn)
+        trainer.train(dataset_train)
+        if not trainer.is_main_process:
+            # distributed pre-training, reconstruct only in the main process
+            return
+
+    if cfg.mdl.optim.get('gamma_sweep'):
+        dataloader = DataLoader(dataset_test, batch_size=1, num_workers=0,
+                                shuffle=True, pin_memory=True)
+        reconstruct_gamma_sweep(cfg, reconstructor, dataloader, im_shape)
+        return
 
     os.makedirs(cfg.save_reconstruction_path, exist_ok=True)
     if cfg.save_histories_path is not None:
@@ -61,43 +157,42 @@ def coordinator(cfg : DictConfig) -> None:
     if cfg.save_iterates_params_path is not None:
         os.makedirs(cfg.save_iterates_params_path, exist_ok=True)
 
+    make_paths_absolute(cfg, ['save_histories_store_filename',
+                              'reconstruction_cache_path'])
+
+    num_workers = cfg.get('reconstruction_num_workers', 0)
+    warm_start = (cfg.mdl.optim.get('warm_start') or {}).get('enabled', False)
+    if warm_start and num_workers > 0:
+        raise ValueError('Warm starts are not supported with '
+                         'reconstruction_num_workers > 0')
+    num_samples = len(dataset_test) if num_workers > 0 or warm_start else 1
+
     filename = os.path.join(cfg.save_reconstruction_path,'recos.hdf5')
     file = h5py.File(filename, 'w')
     recos_dataset = file.create_dataset('recos',
-            shape=(1,) + im_shape, maxshape=(1,) + im_shape, dtype=np.float32,
-            chunks=True)
+            shape=(num_samples,) + im_shape, maxshape=(num_samples,) + im_shape,
+            dtype=np.float32, chunks=True)
+
+    if num_workers > 0:
+        # one slot per sample in recos.hdf5, the other results are saved in
+        # sample_<i> sub directories
+        reconstruct_samples_parallel(
+                cfg, dataset_test, recos_dataset, num_workers=num_workers,
+                num_threads_per_worker=cfg.get(
+                        'reconstruction_num_threads_per_worker'))
+        file.close()
+        return
 
+    # with warm starts, each sample is initialized from the previous one
+    # (e.g. the neighboring slice), so the dataset order is kept, and the
+    # results are saved in sample_<i> sub directories
     dataloader = DataLoader(dataset_test, batch_size=1, num_workers=0,
-                            shuffle=True, pin_memory=True)
+                            shuffle=not warm_start, pin_memory=True)
 
-    for i, (noisy_obs, fbp, *gt) in enumerate(dataloader):
-        gt = gt[0] if gt else None
-        reco, *optional_out = reconstructor.reconstruct(
-                noisy_obs.float(), fbp, gt,
-                return_histories=cfg.save_histories_path is not None,
-                return_iterates=cfg.save_iterates_path is not None,
-                return_iterates_params=cfg.save_iterates_params_path is not None)
-        recos_dataset[i] = reco
-        if cfg.save_histories_path is not None:
-            histories = optional_out.pop(0)
-            histories = {k: np.array(v, dtype=np.float32)
-                         for k, v in histories.items()}
-            np.savez(os.path.join(cfg.save_histories_path, 'histories.npz'),
-                     **histories)
-        if cfg.save_iterates_path is not None:
-            iterates = optional_out.pop(0)
-            iterates_iters = optional_out.pop(0)
-            np.savez_compressed(
-                    os.path.join(cfg.save_iterates_path, 'iterates.npz'),
-                    iterates=np.asarray(iterates),
-                    iterates_iters=iterates_iters)
-        if cfg.save_iterates_params_path is not None:
-            iterates_params = optional_out.pop(0)
-            iterates_params_iters = optional_out.pop(0)
-            for params, iters in zip(iterates_params, iterates_params_iters):
-                torch.save(params,
-                           os.path.join(cfg.save_iterates_params_path,
-                                        'params_iters{:d}.pt'.format(iters)))
+    reconstruct_samples(cfg, reconstructor, dataloader, recos_dataset,
+                        reco_cache=get_reconstruction_cache(cfg),
+                        history_store=get_history_store(cfg),
+                        warm_start=warm_start)
 
 if __name__ == '__main__':
     coordinator()
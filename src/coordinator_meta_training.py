@@ -3,6 +3,7 @@ import os
 import numpy as np
 from omegaconf import DictConfig, OmegaConf
 from dataset import get_standard_dataset
+from dataset.shards import ShardedDataset
 import torch
 from deep_image_prior import DeepImagePriorReconstructor
 from pre_training import MetaTrainer
@@ -15,8 +16,12 @@ def get_maml_datasets(datasets_cfg_list):
         data_cfg = OmegaConf.load(os.path.join(hydra.utils.get_original_cwd(), cfg.base_cfg_filepath))
         for k, v in cfg.overrides.items():
             OmegaConf.update(data_cfg, k, v, merge=True)
-        image_dataset_kwargs = OmegaConf.to_object(cfg.image_dataset_kwargs)
-        dataset, _ = get_standard_dataset(data_cfg.name, data_cfg, **image_dataset_kwargs)
+        if cfg.get('shards_path') is not None:
+            # pre-generated with examples/export_shards.py
+            dataset = ShardedDataset(cfg.shards_path, seed=data_cfg.seed)
+        else:
+            image_dataset_kwargs = OmegaConf.to_object(cfg.image_dataset_kwargs)
+            dataset, _ = get_standard_dataset(data_cfg.name, data_cfg, **image_dataset_kwargs)
         datasets.append(dataset)
     return datasets
 
@@ -1,3 +1,4 @@
 from .dataset import Dataset
 from .ellipses import EllipsesDataset
 from .standard import get_standard_dataset, get_test_data, get_validation_data, get_shepp_logan_data
+from .torch_pair_generation import TorchPairGenerator
@@ -6,12 +6,141 @@ import json
 import odl
 import numpy as np
 from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 from odl import uniform_discr
 from odl.phantom import ellipsoid_phantom
 from pydicom.filereader import dcmread
 from scipy.ndimage import affine_transform, rotate
+from tqdm import tqdm
 from .dataset import GroundTruthDataset
 
+DICOM_CACHE_PIXELS_FILENAME = 'pixels.npy'
+DICOM_CACHE_META_FILENAME = 'meta.json'
+
+
+def _read_dcm_shape(path):
+    dcm_dataset = dcmread(path, stop_before_pixels=True)
+    return (int(dcm_dataset.Rows), int(dcm_dataset.Columns))
+
+
+def _decode_dcm_files_to_cache(pixels_path, paths, offsets):
+    pixels = np.load(pixels_path, mmap_mode='r+')
+    info = np.iinfo(pixels.dtype) if pixels.dtype.kind in 'iu' else None
+    for path, offset in zip(paths, offsets):
+        pixel_array = dcmread(path).pixel_array
+        if info is not None and (pixel_array.min() < info.min or
+                                 pixel_array.max() > info.max):
+            raise ValueError(
+                    'values of \'{}\' do not fit into dtype {}'.format(
+                            path, pixels.dtype))
+        pixels[offset:offset+pixel_array.size] = pixel_array.ravel()
+    pixels.flush()
+    return len(paths)
+
+
+def build_dicom_cache(data_path, cache_path,
+                      dcm_file_list_path='acrin_fmiso_brain_file_list.json',
+                      dtype='uint16', num_workers=None, chunk_size=256):
+    """
+    Decode all dicom files listed for :class:`ACRINFMISOBrainDataset` once and
+    store the pixel data in a single memory-mapped array.
+
+    The raw pixel arrays (without any normalization) of all slices are
+    concatenated in flattened form to the array stored in
+    ``os.path.join(cache_path, DICOM_CACHE_PIXELS_FILENAME)``.  Per-slice
+    metadata (file, offset into the flat array and shape) is stored for each
+    fold in ``os.path.join(cache_path, DICOM_CACHE_META_FILENAME)``.
+
+    Parameters
+    ----------
+    data_path : str
+        Path of the ACRIN-FMISO-Brain dataset.
+    cache_path : str
+        Output directory.
+    dcm_file_list_path : str, optional
+        Dcm file list (file name in ``data/brain/``), see
+        :class:`ACRINFMISOBrainDataset`.
+    dtype : str, optional
+        Data type of the cache, either an integer type able to hold the raw
+        pixel values (the default is ``'uint16'``) or ``'float32'``.
+    num_workers : int, optional
+        Number of worker processes decoding the files.
+        The default is ``os.cpu_count()``.
+    chunk_size : int, optional
+        Number of files decoded per job. The default is ``256``.
+    """
+    with open(os.path.join(
+            os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            'data', 'brain', dcm_file_list_path), 'r') as f:
+        dcm_file_list = json.load(f)
+
+    files = [dcm_file for fold in ['train', 'validation', 'test']
+             for dcm_file in dcm_file_list[fold]]
+    # file lists may overlap between folds only by mistake, but store each
+    # file once anyways
+    files = list(dict.fromkeys(files))
+    paths = [os.path.join(data_path, dcm_file) for dcm_file in files]
+
+    os.makedirs(cache_path, exist_ok=True)
+    pixels_path = os.path.join(cache_path, DICOM_CACHE_PIXELS_FILENAME)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        shapes = list(tqdm(executor.map(_read_dcm_shape, paths,
+                                        chunksize=chunk_size),
+                           total=len(paths), desc='reading dicom headers'))
+        sizes = [shape[0] * shape[1] for shape in shapes]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).tolist()
+        pixels = np.lib.format.open_memmap(
+                pixels_path, mode='w+', dtype=dtype, shape=(offsets[-1],))
+        del pixels
+
+        futures = [
+                executor.submit(_decode_dcm_files_to_cache, pixels_path,
+                                paths[i:i+chunk_size],
+                                offsets[i:i+chunk_size])
+                for i in range(0, len(paths), chunk_size)]
+        with tqdm(total=len(paths), desc='decoding dicom files') as pbar:
+            for future in futures:
+                pbar.update(future.result())
+
+    slices = {dcm_file: {'offset': offset, 'shape': shape}
+              for dcm_file, offset, shape in zip(files, offsets, shapes)}
+    meta = {'dtype': np.dtype(dtype).name,
+            'dcm_file_list_path': dcm_file_list_path,
+            'folds': {fold: [dict(file=dcm_file, **slices[dcm_file])
+                             for dcm_file in dcm_file_list[fold]]
+                      for fold in ['train', 'validation', 'test']}}
+    with open(os.path.join(cache_path, DICOM_CACHE_META_FILENAME), 'w') as f:
+        json.dump(meta, f, indent=1)
+
+
+class DicomCache:
+    """
+    Read access to a cache created by :func:`build_dicom_cache`.
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        with open(os.path.join(cache_path, DICOM_CACHE_META_FILENAME),
+                  'r') as f:
+            self.meta = json.load(f)
+        self.pixels = np.load(
+                os.path.join(cache_path, DICOM_CACHE_PIXELS_FILENAME),
+                mmap_mode='r')
+        self.slices = {s['file']: (s['offset'], tuple(s['shape']))
+                       for fold_slices in self.meta['folds'].values()
+                       for s in fold_slices}
+
+    def __contains__(self, dcm_file):
+        return dcm_file in self.slices
+
+    def get_pixel_array(self, dcm_file):
+        """
+        Return the raw pixel array of a dicom file (like
+        ``dcmread(...).pixel_array``, but with the dtype of the cache).
+        """
+        offset, shape = self.slices[dcm_file]
+        return self.pixels[offset:offset+shape[0]*shape[1]].reshape(shape)
+
 class ACRINFMISOBrainDataset(GroundTruthDataset):
     """
     Dataset with images of the human brain from the ACRIN-FMISO-Brain dataset.
@@ -21,6 +150,8 @@ class ACRINFMISOBrainDataset(GroundTruthDataset):
     https://doi.org/10.1007/s10278-013-9622-7
 
     To create the dcm file list, see ``examples/create_brain_file_list.py``.
+    Decoding the dicom files can be done once in advance, see
+    :func:`build_dicom_cache` and ``examples/create_brain_dicom_cache.py``.
 
     The images are normalized to have a values within the range ``[0., 1.]``.
     """
@@ -29,9 +160,25 @@ class ACRINFMISOBrainDataset(GroundTruthDataset):
             zoom=1., zoom_fit=True,
             random_rotation=True, fixed_seeds=True,
             dcm_file_list_path='acrin_fmiso_brain_file_list.json',
-            min_pt=None, max_pt=None):
+            min_pt=None, max_pt=None, cache_path=None,
+            affine_batch_size=None):
+        """
+        cache_path : str, optional
+            Path of a cache created by :func:`build_dicom_cache`. If
+            specified, the pixel data is read from the cache instead of
+            decoding the dicom files.
+        affine_batch_size : int, optional
+            If specified, the zoom and rotation is applied to batches of this
+            many images at once by bicubic interpolation with torch (combined
+            with cropping and padding), instead of applying
+            :func:`scipy.ndimage.affine_transform` (cubic spline interpolation)
+            to each image. The random draws are the same, but the interpolated
+            values differ slightly.
+        """
 
         self.data_path = data_path
+        self.cache = DicomCache(cache_path) if cache_path is not None else None
+        self.affine_batch_size = affine_batch_size
 
         self.shape = (501, 501)
         # defining discretization space ODL
@@ -76,68 +223,149 @@ class ACRINFMISOBrainDataset(GroundTruthDataset):
 
         super().__init__(space=space)
 
+    def _load_image(self, dcm_file):
+        if self.cache is not None:
+            return self.cache.get_pixel_array(dcm_file).astype(np.float32).T
+        dcm_dataset = dcmread(os.path.join(self.data_path, dcm_file))
+        return dcm_dataset.pixel_array.astype(np.float32).T
+
+    def _preprocess(self, image, fold, r):
+        """
+        Add uniform noise, normalize and draw the affine transformation.
+
+        Returns
+        -------
+        image : :class:`numpy.ndarray`
+            Normalized image.
+        affine_mat : :class:`numpy.ndarray`
+            Matrix mapping output to input coordinates (centered).
+        """
+        # add noise to get continuous values from discrete ones
+        image += r.uniform(0., 1., size=image.shape)
+
+        # no need to rescale by dicom meta info (if present) because we are
+        # going to normalize to range [0., 1.] anyways
+        # image *= dcm_dataset.get('RescaleSlope', 1.)
+        # image += dcm_dataset.get('RescaleIntercept', 0.)
+
+        # normalize to [0., 1.]
+        image -= np.min(image)
+        image /= np.max(image)
+
+        # combine zoom and rotation
+        affine_mat = np.eye(2)
+        zoom_factor = float(self.zoom)
+        if self.zoom_fit:
+            zoom_factor *= min(self.shape[0] / image.shape[0],
+                               self.shape[1] / image.shape[1])
+        affine_mat /= zoom_factor
+        if self.random_rotation[fold]:
+            theta = r.uniform(0., 2*np.pi)
+            rot_mat = np.array([[np.cos(theta), -np.sin(theta)],
+                                [np.sin(theta), np.cos(theta)]])
+            affine_mat = rot_mat @ affine_mat
+        return image, affine_mat
+
+    def _crop_offsets(self, in_shape):
+        # offsets of the output frame in the (transformed) input frame:
+        # positive for cropping to the central part, negative for zero-padding
+        return tuple(
+                (n_in - n_out) // 2 if n_in > n_out else
+                -((n_out - n_in) // 2)
+                for n_in, n_out in zip(in_shape, self.shape))
+
+    def _transform(self, image, affine_mat):
+        # apply zoom and rotation, combined if both are requested
+        if np.any(affine_mat != np.eye(2)):
+            in_center = np.array([(image.shape[0] - 1) / 2,
+                                (image.shape[1] - 1) / 2])
+            out_center = affine_mat @ in_center
+            offset = in_center - out_center
+            if affine_mat[0, 1] == 0. and affine_mat[1, 0] == 0.:
+                # inform affine_transform that the matrix is diagonal
+                affine_mat = (affine_mat[0, 0], affine_mat[1, 1])
+            image = affine_transform(image, affine_mat, offset=offset)
+
+        # crop to central part if image is too large, zero-pad if too small
+        pad_width0 = None
+        if image.shape[0] > self.shape[0]:
+            i0 = (image.shape[0]-self.shape[0])//2
+            image = image[i0:i0+self.shape[0], :]
+        elif image.shape[0] < self.shape[0]:
+            before0 = (self.shape[0] - image.shape[0]) // 2
+            pad_width0 = (before0, self.shape[0] - image.shape[0] - before0)
+        pad_width1 = None
+        if image.shape[1] > self.shape[1]:
+            j0 = (image.shape[1]-self.shape[1])//2
+            image = image[:, j0:j0+self.shape[1]]
+        elif image.shape[1] < self.shape[1]:
+            before1 = (self.shape[1] - image.shape[1]) // 2
+            pad_width1 = (before1, self.shape[1] - image.shape[1] - before1)
+        if pad_width0 is not None or pad_width1 is not None:
+            image = np.pad(image, pad_width=(
+                    pad_width0 if pad_width0 is not None else (0, 0),
+                    pad_width1 if pad_width1 is not None else (0, 0)))
+
+        return image
+
+    def _transform_batch(self, images, affine_mats):
+        """
+        Batched version of :meth:`_transform` using
+        :func:`torch.nn.functional.grid_sample`, sampling the output frame
+        (after cropping and padding) directly.
+        """
+        import torch
+        import torch.nn.functional as F
+
+        max_shape = tuple(max(image.shape[k] for image in images)
+                          for k in range(2))
+        inputs = np.zeros((len(images), 1) + max_shape, dtype=np.float32)
+        for k, image in enumerate(images):
+            inputs[k, 0, :image.shape[0], :image.shape[1]] = image
+
+        out_coords = np.stack(np.meshgrid(
+                np.arange(self.shape[0]), np.arange(self.shape[1]),
+                indexing='ij'), axis=-1).reshape(-1, 2).astype(np.float64)
+        grid = np.empty((len(images),) + self.shape + (2,), dtype=np.float32)
+        masks = np.empty((len(images), 1) + self.shape, dtype=np.float32)
+        for k, (image, affine_mat) in enumerate(zip(images, affine_mats)):
+            crop_offsets = np.array(self._crop_offsets(image.shape))
+            coords = out_coords + crop_offsets
+            # pixels outside of the frame of the transformed image are zero
+            # (zero-padding), like in the non-batched version
+            mask = np.all((coords >= 0) & (coords < np.array(image.shape)),
+                          axis=-1)
+            in_center = (np.array(image.shape) - 1) / 2
+            in_coords = (coords - in_center) @ affine_mat.T + in_center
+            # normalize to [-1, 1] (align_corners=True), order (x, y)
+            in_coords_normalized = (
+                    2. * in_coords / (np.array(max_shape) - 1) - 1.)
+            grid[k] = in_coords_normalized[:, ::-1].reshape(self.shape + (2,))
+            masks[k, 0] = mask.reshape(self.shape)
+
+        outputs = F.grid_sample(
+                torch.from_numpy(inputs), torch.from_numpy(grid),
+                mode='bicubic', padding_mode='zeros', align_corners=True)
+        outputs = (outputs.numpy() * masks)[:, 0]
+        return list(outputs)
+
     def generator(self, fold='train'):
         seed = self.fixed_seeds.get(fold)
         r = np.random.default_rng(seed)
         dcm_files = self.dcm_file_list[fold].copy()
         if self.shuffle[fold]:
             r.shuffle(dcm_files)
-        for dcm_file in dcm_files:
-            dcm_dataset = dcmread(os.path.join(self.data_path, dcm_file))
-            image = dcm_dataset.pixel_array.astype(np.float32).T
-
-            # add noise to get continuous values from discrete ones
-            image += r.uniform(0., 1., size=image.shape)
-
-            # no need to rescale by dicom meta info (if present) because we are
-            # going to normalize to range [0., 1.] anyways
-            # image *= dcm_dataset.get('RescaleSlope', 1.)
-            # image += dcm_dataset.get('RescaleIntercept', 0.)
-
-            # normalize to [0., 1.]
-            image -= np.min(image)
-            image /= np.max(image)
-
-            # apply zoom and rotation, combined if both are requested
-            affine_mat = np.eye(2)
-            zoom_factor = float(self.zoom)
-            if self.zoom_fit:
-                zoom_factor *= min(self.shape[0] / image.shape[0],
-                                   self.shape[1] / image.shape[1])
-            affine_mat /= zoom_factor
-            if self.random_rotation[fold]:
-                theta = r.uniform(0., 2*np.pi)
-                rot_mat = np.array([[np.cos(theta), -np.sin(theta)],
-                                    [np.sin(theta), np.cos(theta)]])
-                affine_mat = rot_mat @ affine_mat
-            if np.any(affine_mat != np.eye(2)):
-                in_center = np.array([(image.shape[0] - 1) / 2,
-                                    (image.shape[1] - 1) / 2])
-                out_center = affine_mat @ in_center
-                offset = in_center - out_center
-                if affine_mat[0, 1] == 0. and affine_mat[1, 0] == 0.:
-                    # inform affine_transform that the matrix is diagonal
-                    affine_mat = (affine_mat[0, 0], affine_mat[1, 1])
-                image = affine_transform(image, affine_mat, offset=offset)
-
-            # crop to central part if image is too large, zero-pad if too small
-            pad_width0 = None
-            if image.shape[0] > self.shape[0]:
-                i0 = (image.shape[0]-self.shape[0])//2
-                image = image[i0:i0+self.shape[0], :]
-            elif image.shape[0] < self.shape[0]:
-                before0 = (self.shape[0] - image.shape[0]) // 2
-                pad_width0 = (before0, self.shape[0] - image.shape[0] - before0)
-            pad_width1 = None
-            if image.shape[1] > self.shape[1]:
-                j0 = (image.shape[1]-self.shape[1])//2
-                image = image[:, j0:j0+self.shape[1]]
-            elif image.shape[1] < self.shape[1]:
-                before1 = (self.shape[1] - image.shape[1]) // 2
-                pad_width1 = (before1, self.shape[1] - image.shape[1] - before1)
-            if pad_width0 is not None or pad_width1 is not None:
-                image = np.pad(image, pad_width=(
-                        pad_width0 if pad_width0 is not None else (0, 0),
-                        pad_width1 if pad_width1 is not None else (0, 0)))
-
-            yield image
+        if self.affine_batch_size is None:
+            for dcm_file in dcm_files:
+                image = self._load_image(dcm_file)
+                image, affine_mat = self._preprocess(image, fold, r)
+                yield self._transform(image, affine_mat)
+        else:
+            for i in range(0, len(dcm_files), self.affine_batch_size):
+                images, affine_mats = [], []
+                for dcm_file in dcm_files[i:i+self.affine_batch_size]:
+                    image = self._load_image(dcm_file)
+                    image, affine_mat = self._preprocess(image, fold, r)
+                    images.append(image)
+                    affine_mats.append(affine_mat)
+                yield from self._transform_batch(images, affine_mats)
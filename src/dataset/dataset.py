@@ -3,6 +3,7 @@
 Provides the dataset base classes.
 """
 from functools import partial
+from itertools import islice
 import numpy as np
 
 class Dataset():
@@ -20,6 +21,18 @@ class Dataset():
         """
         raise NotImplementedError
 
+    def sharded_generator(self, fold='train', num_shards=1, shard_index=0):
+        """
+        Yield every `num_shards`-th element, starting with the element
+        `shard_index`, e.g. for distributed data-parallel training.
+        Subclasses may override this to avoid computing skipped elements.
+        """
+        if num_shards == 1:
+            yield from self.generator(fold=fold)
+        else:
+            yield from islice(self.generator(fold=fold),
+                              shard_index, None, num_shards)
+
     def get_train_generator(self):
         return self.generator(fold='train')
 
@@ -94,21 +107,37 @@ class Dataset():
                 return len(self.space) if isinstance(self.space, tuple) else 1
             raise NotImplementedError
 
-    def create_torch_dataset(self, fold='train', reshape=None):
+    def create_torch_dataset(self, fold='train', reshape=None, num_shards=1,
+                             shard_index=0):
         """
         Create a torch dataset wrapper for one fold of this dataset.
+
+        If `num_shards` is greater than one, only the shard `shard_index`
+        of the fold is used (see :meth:`sharded_generator`). All shards have
+        the same length ``self.get_len(fold) // num_shards``, so that
+        distributed processes perform the same number of steps.
         """
         from torch.utils.data import Dataset as TorchDataset
         import torch
         class GeneratorTorchDataset(TorchDataset):
-            def __init__(self, dataset, fold, reshape=None):
+            def __init__(self, dataset, fold, reshape=None, num_shards=1,
+                         shard_index=0):
                 self.fold = fold
                 self.dataset = dataset
-                self.generator = self.dataset.generator(self.fold)
-                self.length = self.dataset.get_len(self.fold)
+                self.num_shards = num_shards
+                self.shard_index = shard_index
+                self.length = self.dataset.get_len(self.fold) // num_shards
+                self.generator = self._create_generator()
                 self.reshape = reshape or (
                     (None,) * dataset.get_num_elements_per_sample())
 
+            def _create_generator(self):
+                if self.num_shards == 1:
+                    return self.dataset.generator(self.fold)
+                return islice(self.dataset.sharded_generator(
+                        self.fold, num_shards=self.num_shards,
+                        shard_index=self.shard_index), self.length)
+
             def __len__(self):
                 return self.length
 
@@ -116,7 +145,7 @@ class Dataset():
                 try:
                     arrays = next(self.generator)
                 except StopIteration:
-                    self.generator = self.dataset.generator(self.fold)
+                    self.generator = self._create_generator()
                     arrays = next(self.generator)
                 mult_elem = isinstance(arrays, tuple)
                 if not mult_elem:
@@ -129,7 +158,9 @@ class Dataset():
                     tensors.append(t)
                 return tuple(tensors) if mult_elem else tensors[0]
 
-        dataset = GeneratorTorchDataset(self, fold, reshape=reshape)
+        dataset = GeneratorTorchDataset(self, fold, reshape=reshape,
+                                        num_shards=num_shards,
+                                        shard_index=shard_index)
         return dataset
 
 class ObservationGroundTruthPairDataset(Dataset):
@@ -205,6 +236,21 @@ class ObservationGroundTruthPairDataset(Dataset):
 
         return forward_func(ground_truth)
 
+    def get_ground_truth_dataset(self):
+        """
+        Return a dataset yielding only the ground truth images, e.g. for
+        generating the pairs batch-wise with
+        :class:`dataset.torch_pair_generation.TorchPairGenerator`.
+        """
+        lens = {}
+        for fold in ['train', 'validation', 'test']:
+            try:
+                lens[fold + '_len'] = self.get_len(fold)
+            except NotImplementedError:
+                pass
+        return GeneratorGroundTruthDataset(
+                self.ground_truth_gen, space=self.space[1], **lens)
+
     def generator(self, fold='train'):
         # construct noise
         random_gen = np.random.default_rng(self.noise_seeds.get(fold))
@@ -214,6 +260,27 @@ class ObservationGroundTruthPairDataset(Dataset):
             fbp_reco = self.pinv_ray_trafo(noisy_obs)
             yield (noisy_obs, fbp_reco, ground_truth)
 
+    def sharded_generator(self, fold='train', num_shards=1, shard_index=0):
+        """
+        Yield the pairs for every `num_shards`-th ground truth, starting with
+        `shard_index`. The skipped ground truth images are not passed through
+        the forward operator. For ``num_shards > 1``, the noise is seeded by
+        ``[self.noise_seeds[fold], shard_index]``, i.e. differs from the noise
+        in :meth:`generator`.
+        """
+        if num_shards == 1:
+            yield from self.generator(fold=fold)
+            return
+        seed = self.noise_seeds.get(fold)
+        random_gen = np.random.default_rng(
+                None if seed is None else [seed, shard_index])
+        gt_gen_instance = islice(self.ground_truth_gen(fold=fold),
+                                 shard_index, None, num_shards)
+        for ground_truth in gt_gen_instance:
+            noisy_obs = self.ground_truth_to_obs(ground_truth, random_gen)
+            fbp_reco = self.pinv_ray_trafo(noisy_obs)
+            yield (noisy_obs, fbp_reco, ground_truth)
+
 class GroundTruthDataset(Dataset):
     """
     Ground truth dataset base class.
@@ -244,3 +311,25 @@ class GroundTruthDataset(Dataset):
                 noise_type=noise_type, specs_kwargs=specs_kwargs,
                 noise_seeds=noise_seeds)
         return dataset
+
+
+class GeneratorGroundTruthDataset(GroundTruthDataset):
+    """
+    Ground truth dataset wrapping a generator function, e.g. the ground truth
+    generator of an :class:`ObservationGroundTruthPairDataset`.
+    """
+    def __init__(self, ground_truth_gen, space=None,
+                 train_len=None, validation_len=None, test_len=None):
+
+        self.ground_truth_gen = ground_truth_gen
+        if train_len is not None:
+            self.train_len = train_len
+        if validation_len is not None:
+            self.validation_len = validation_len
+        if test_len is not None:
+            self.test_len = test_len
+        super().__init__(space=space)
+        self.shape = self.space.shape
+
+    def generator(self, fold='train'):
+        yield from self.ground_truth_gen(fold=fold)
@@ -2,13 +2,109 @@
 Provides the PascalVOCDataset.
 """
 
+import os
+import json
 import numpy as np
 from odl import uniform_discr
+from PIL import Image
+from tqdm import tqdm
 import torch
 from torchvision.datasets import VOCSegmentation
 from torchvision.transforms import Grayscale, RandomCrop, PILToTensor, Lambda, Compose
 from .dataset import GroundTruthDataset
 
+GRAYSCALE_CACHE_PIXELS_FILENAME = 'pixels.npy'
+GRAYSCALE_CACHE_META_FILENAME = 'meta.json'
+IMAGE_SETS = {'train': 'train', 'validation': 'val'}
+
+
+def build_grayscale_cache(data_path, cache_path, year='2012'):
+    """
+    Decode the train and validation images of Pascal VOC once, convert them
+    to grayscale and store them as ``uint8`` in a single memory-mapped array.
+
+    The flattened images of all folds are concatenated to the array stored in
+    ``os.path.join(cache_path, GRAYSCALE_CACHE_PIXELS_FILENAME)``.  Offsets
+    into the flat array and shapes are stored for each fold in
+    ``os.path.join(cache_path, GRAYSCALE_CACHE_META_FILENAME)``.
+
+    Parameters
+    ----------
+    data_path : str
+        Path of the folder containing the ``VOCdevkit`` folder.
+    cache_path : str
+        Output directory.
+    year : str, optional
+        Dataset year. The default is ``'2012'``.
+    """
+    images = {fold: VOCSegmentation(
+                      root=data_path, year=year, image_set=image_set).images
+              for fold, image_set in IMAGE_SETS.items()}
+
+    shapes = {}
+    for fold, filenames in images.items():
+        shapes[fold] = []
+        for filename in tqdm(filenames,
+                             desc='reading image sizes ({})'.format(fold)):
+            with Image.open(filename) as image:
+                shapes[fold].append((image.height, image.width))
+
+    offsets = {}
+    total = 0
+    for fold in IMAGE_SETS:
+        offsets[fold] = []
+        for shape in shapes[fold]:
+            offsets[fold].append(total)
+            total += shape[0] * shape[1]
+
+    os.makedirs(cache_path, exist_ok=True)
+    pixels = np.lib.format.open_memmap(
+            os.path.join(cache_path, GRAYSCALE_CACHE_PIXELS_FILENAME),
+            mode='w+', dtype=np.uint8, shape=(total,))
+    for fold, filenames in images.items():
+        for filename, offset in tqdm(zip(filenames, offsets[fold]),
+                                     total=len(filenames),
+                                     desc='decoding images ({})'.format(fold)):
+            with Image.open(filename) as image:
+                # same conversion as torchvision's Grayscale()
+                image = np.asarray(image.convert('L'))
+            pixels[offset:offset+image.size] = image.ravel()
+    pixels.flush()
+    del pixels
+
+    meta = {'year': year,
+            'folds': {fold: {'offsets': offsets[fold], 'shapes': shapes[fold]}
+                      for fold in IMAGE_SETS}}
+    with open(os.path.join(cache_path, GRAYSCALE_CACHE_META_FILENAME),
+              'w') as f:
+        json.dump(meta, f)
+
+
+class GrayscaleCache:
+    """
+    Read access to a cache created by :func:`build_grayscale_cache`.
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        with open(os.path.join(cache_path, GRAYSCALE_CACHE_META_FILENAME),
+                  'r') as f:
+            meta = json.load(f)
+        self.offsets = {fold: np.asarray(fold_meta['offsets'])
+                        for fold, fold_meta in meta['folds'].items()}
+        self.shapes = {fold: np.asarray(fold_meta['shapes'])
+                       for fold, fold_meta in meta['folds'].items()}
+        self.pixels = np.load(
+                os.path.join(cache_path, GRAYSCALE_CACHE_PIXELS_FILENAME),
+                mmap_mode='r')
+
+    def get_len(self, fold):
+        return len(self.offsets[fold])
+
+    def get_image(self, fold, idx):
+        offset = self.offsets[fold][idx]
+        shape = tuple(self.shapes[fold][idx])
+        return self.pixels[offset:offset+shape[0]*shape[1]].reshape(shape)
+
 
 class PascalVOCDataset(GroundTruthDataset):
     """
@@ -19,7 +115,7 @@ class PascalVOCDataset(GroundTruthDataset):
             data_path, year='2012', shuffle=True,
             image_size=128, min_pt=None, max_pt=None,
             train_len=32000, validation_len=3200, test_len=0,
-            fixed_seeds=True):
+            fixed_seeds=True, cache_path=None):
         """
         shuffle : bool, optional
             Whether to shuffle the images.
@@ -36,6 +132,13 @@ class PascalVOCDataset(GroundTruthDataset):
             If ``True``, use the fixed random seeds ``{'train': 1, 'validation': 2}``.
             A custom dict can also be specified.
             The default is ``True``.
+        cache_path : str, optional
+            Path of a cache created by :func:`build_grayscale_cache`. If
+            specified, the grayscale images are read from the cache and the
+            random crops are taken by array slicing using the numpy random
+            generator (instead of decoding the JPEG files and using the
+            torchvision transforms). This results in different, but also
+            reproducible random crops.
         """
 
         self.shape = (image_size, image_size)
@@ -52,9 +155,15 @@ class PascalVOCDataset(GroundTruthDataset):
                  PILToTensor(),
                  Lambda(lambda x: ((x.to(torch.float32) + torch.rand(*x.shape)) / 256).numpy()),
                 ])
-        self.datasets = {
-            'train': VOCSegmentation(root=data_path, year=year, image_set='train'),
-            'validation': VOCSegmentation(root=data_path, year=year, image_set='val')}
+        self.image_size = image_size
+        if cache_path is not None:
+            self.cache = GrayscaleCache(cache_path)
+            self.datasets = None
+        else:
+            self.cache = None
+            self.datasets = {
+                'train': VOCSegmentation(root=data_path, year=year, image_set='train'),
+                'validation': VOCSegmentation(root=data_path, year=year, image_set='val')}
         self.train_len = train_len
         self.validation_len = validation_len
         assert test_len == 0, 'PascalVOCDataset does not support the test fold, must pass test_len=0'
@@ -73,7 +182,32 @@ class PascalVOCDataset(GroundTruthDataset):
             self.fixed_seeds = fixed_seeds.copy()
         super().__init__(space=space)
 
+    def _get_num_images(self, fold):
+        if self.cache is not None:
+            return self.cache.get_len(fold)
+        return len(self.datasets[fold])
+
+    def _generate_item_from_cache(self, fold, idx, rng):
+        image = self.cache.get_image(fold, idx)
+        # like RandomCrop(padding=True, pad_if_needed=True,
+        # padding_mode='reflect'), i.e. pad by 1 pixel, then pad to the crop
+        # size if needed, then crop
+        pad0 = max(self.image_size - (image.shape[0] + 2), 0)
+        pad1 = max(self.image_size - (image.shape[1] + 2), 0)
+        image = np.pad(image, ((1 + pad0, 1 + pad0), (1 + pad1, 1 + pad1)),
+                       mode='reflect')
+        i = rng.randint(image.shape[0] - self.image_size + 1)
+        j = rng.randint(image.shape[1] - self.image_size + 1)
+        image = image[i:i+self.image_size, j:j+self.image_size]
+        image = ((image.astype(np.float32) +
+                  rng.random_sample(image.shape).astype(np.float32)) / 256)
+        image -= image.min()
+        image /= image.max()
+        return image
+
     def _generate_item(self, fold, idx, rng):
+        if self.cache is not None:
+            return self._generate_item_from_cache(fold, idx, rng)
         image = self.datasets[fold][idx][0]
         seed = rng.randint(np.iinfo(np.int64).max)
         with torch.random.fork_rng():
@@ -85,7 +219,7 @@ class PascalVOCDataset(GroundTruthDataset):
 
     def generator(self, fold='train'):
         rng = np.random.RandomState(self.fixed_seeds.get(fold, None))
-        idx_list = rng.randint(len(self.datasets[fold]), size=self.get_len(fold))
+        idx_list = rng.randint(self._get_num_images(fold), size=self.get_len(fold))
         if self.shuffle[fold]:
             rng.shuffle(idx_list)
         for idx in idx_list:
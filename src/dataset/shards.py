@@ -0,0 +1,381 @@
+"""
+Provides a sharded on-disk format for (pre-)generated datasets and the
+ShardedDataset reading it as a stream.
+
+Each fold is stored in a sub-directory containing shards
+``shard_00000.npz, shard_00001.npz, ...`` (uncompressed npz files with one
+stacked array per sample element) and an ``index.json`` file. Reading whole
+shards sequentially avoids generating or seeking single samples, which is
+much faster on shared file systems.
+"""
+import os
+import json
+import random
+import threading
+import queue
+from itertools import islice
+import numpy as np
+import odl
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+from tqdm import tqdm
+from .dataset import Dataset
+
+SHARDS_INDEX_FILENAME = 'index.json'
+
+
+def _get_shard_filename(i):
+    return 'shard_{:05d}.npz'.format(i)
+
+
+def export_shards(dataset, path, fold='train', shard_size=256,
+                  max_samples=None, show_pbar=True):
+    """
+    Export a fold of a dataset to shards.
+
+    Parameters
+    ----------
+    dataset : :class:`dataset.Dataset`
+        Dataset, e.g. as returned by :func:`dataset.get_standard_dataset`.
+    path : str
+        Base path of the sharded dataset. The fold is stored in
+        ``os.path.join(path, fold)``.
+    fold : str, optional
+        Fold to export. The default is ``'train'``.
+    shard_size : int, optional
+        Number of samples per shard. The default is ``256``.
+    max_samples : int, optional
+        Maximum number of samples to export. By default, the whole fold is
+        exported.
+    show_pbar : bool, optional
+        Whether to show a progress bar. The default is `True`.
+    """
+    fold_path = os.path.join(path, fold)
+    os.makedirs(fold_path, exist_ok=True)
+
+    n = dataset.get_len(fold)
+    if max_samples is not None:
+        n = min(n, max_samples)
+    num_elements = dataset.get_num_elements_per_sample()
+
+    shards = []
+    buffer = []
+
+    def write_shard():
+        filename = _get_shard_filename(len(shards))
+        arrays = {'elem_{:d}'.format(k): np.stack(
+                          [np.asarray(sample[k]) for sample in buffer])
+                  for k in range(num_elements)}
+        # uncompressed, allowing for fast sequential reading
+        np.savez(os.path.join(fold_path, filename), **arrays)
+        shards.append({'filename': filename, 'num_samples': len(buffer)})
+        buffer.clear()
+
+    shapes = None
+    dtypes = None
+    for sample in tqdm(islice(dataset.generator(fold), n), total=n,
+                       desc='exporting {} shards'.format(fold),
+                       disable=not show_pbar):
+        if num_elements == 1:
+            sample = (sample,)
+        if shapes is None:
+            shapes = [list(np.shape(s)) for s in sample]
+            dtypes = [np.asarray(s).dtype.name for s in sample]
+        buffer.append(sample)
+        if len(buffer) == shard_size:
+            write_shard()
+    if buffer:
+        write_shard()
+
+    index = {'len': sum(shard['num_samples'] for shard in shards),
+             'num_elements_per_sample': num_elements,
+             'shapes': shapes,
+             'dtypes': dtypes,
+             'shard_size': shard_size,
+             'shards': shards}
+    with open(os.path.join(fold_path, SHARDS_INDEX_FILENAME), 'w') as f:
+        json.dump(index, f, indent=1)
+
+
+def _get_dist_rank_and_world_size():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+class ShardedDataset(Dataset):
+    """
+    Dataset reading samples from shards written by :func:`export_shards`.
+
+    The torch dataset returned by :meth:`create_torch_dataset` is an iterable
+    dataset shuffling at shard and buffer level, splitting the shards across
+    distributed ranks and data loader workers, and prefetching shards in a
+    background thread. It can be passed to :meth:`pre_training.Trainer.train`
+    and :meth:`pre_training.MetaTrainer.metatrain` in place of a generated
+    dataset.
+    """
+    def __init__(self, path, shuffle=True, shuffle_buffer_size=1024,
+                 prefetch_shards=2, seed=1):
+        """
+        Parameters
+        ----------
+        path : str
+            Base path of the sharded dataset, containing one sub-directory
+            per fold.
+        shuffle : bool or dict, optional
+            Whether to shuffle the shards and samples (within a buffer).
+            The default is ``True``.
+        shuffle_buffer_size : int, optional
+            Number of samples in the shuffle buffer. The default is ``1024``.
+        prefetch_shards : int, optional
+            Number of shards to read ahead. The default is ``2``.
+        seed : int, optional
+            Seed for shuffling; in each epoch ``seed + epoch`` is used.
+            The default is ``1``.
+        """
+        self.path = path
+        self.indices = {}
+        for fold in ['train', 'validation', 'test']:
+            index_path = os.path.join(path, fold, SHARDS_INDEX_FILENAME)
+            if os.path.isfile(index_path):
+                with open(index_path, 'r') as f:
+                    self.indices[fold] = json.load(f)
+        if not self.indices:
+            raise ValueError('no shards found in \'{}\''.format(path))
+        for fold, index in self.indices.items():
+            setattr(self, fold + '_len', index['len'])
+        if isinstance(shuffle, bool):
+            self.shuffle = {fold: shuffle for fold in self.indices}
+        else:
+            self.shuffle = shuffle.copy()
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.prefetch_shards = prefetch_shards
+        self.seed = seed
+
+        index = next(iter(self.indices.values()))
+        self.num_elements_per_sample = index['num_elements_per_sample']
+        space = tuple(odl.tensor_space(shape, dtype=dtype)
+                      for shape, dtype in zip(index['shapes'], index['dtypes']))
+        if self.num_elements_per_sample == 1:
+            space = space[0]
+        super().__init__(space=space)
+
+    def get_shard_paths(self, fold):
+        return [os.path.join(self.path, fold, shard['filename'])
+                for shard in self.indices[fold]['shards']]
+
+    def generator(self, fold='train'):
+        """
+        Yield the samples of a fold in stored order.
+        """
+        for shard_path in self.get_shard_paths(fold):
+            with np.load(shard_path) as shard:
+                arrays = [shard['elem_{:d}'.format(k)] for k in range(
+                        self.num_elements_per_sample)]
+            for sample in zip(*arrays):
+                yield sample if len(sample) > 1 else sample[0]
+
+    def create_torch_dataset(self, fold='train', reshape=None,
+                             num_shards=None, shard_index=None):
+        """
+        Create a torch iterable dataset streaming one fold of this dataset.
+
+        Parameters
+        ----------
+        fold : str, optional
+            Fold. The default is ``'train'``.
+        reshape : sequence of (tuple or `None`), optional
+            Shapes to which the sample elements are reshaped.
+        num_shards, shard_index : int, optional
+            Number of parts the fold is split into and the part to use,
+            usually the distributed world size and rank. By default, they are
+            determined from :mod:`torch.distributed` if initialized (when
+            iterating).
+        """
+        return ShardedIterableDataset(
+                self, fold, reshape=reshape, rank=shard_index,
+                world_size=num_shards)
+
+
+def load_shard(shard_path, num_elements, start=None, stop=None):
+    """
+    Load the samples ``start:stop`` of a shard written by
+    :func:`export_shards`.
+
+    Parameters
+    ----------
+    shard_path : str
+        Path of the shard file, see :meth:`ShardedDataset.get_shard_paths`.
+    num_elements : int
+        Number of elements per sample.
+    start, stop : int, optional
+        Range of the samples to load. By default, all samples are loaded.
+
+    Returns
+    -------
+    arrays : list of :class:`numpy.ndarray`
+        One stacked array per sample element.
+    """
+    with np.load(shard_path) as shard:
+        return [shard['elem_{:d}'.format(k)][start:stop]
+                for k in range(num_elements)]
+
+
+def _iter_prefetched(shard_slices, num_elements, prefetch_shards):
+    """
+    Yield the loaded shards, reading ahead in a background thread.
+
+    `shard_slices` is a sequence of tuples ``(shard_path, start, stop)``.
+    """
+    if prefetch_shards <= 0:
+        for shard_path, start, stop in shard_slices:
+            yield load_shard(shard_path, num_elements, start, stop)
+        return
+
+    q = queue.Queue(maxsize=prefetch_shards)
+    stop_event = threading.Event()
+    end = object()
+
+    def producer():
+        try:
+            for shard_path, start, stop in shard_slices:
+                if stop_event.is_set():
+                    return
+                q.put(load_shard(shard_path, num_elements, start, stop))
+        except Exception as e:  # forward to consumer
+            q.put(e)
+        q.put(end)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is end:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop_event.set()
+        # unblock the producer if it waits on a full queue
+        while thread.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                thread.join(timeout=0.01)
+
+
+class ShardedIterableDataset(IterableDataset):
+    """
+    Torch iterable dataset streaming a fold of a :class:`ShardedDataset`, see
+    :meth:`ShardedDataset.create_torch_dataset`.
+    """
+    def __init__(self, dataset, fold, reshape=None, rank=None,
+                 world_size=None):
+        super().__init__()
+        self.dataset = dataset
+        self.fold = fold
+        self.reshape = reshape or (
+                (None,) * dataset.get_num_elements_per_sample())
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = None
+        self._auto_epoch = 0
+
+    def set_epoch(self, epoch):
+        """
+        Set the epoch, determining the shuffling seed
+        ``dataset.seed + epoch``. Should be called before each epoch if
+        data loader workers are used, since the automatic epoch counter
+        is not shared between worker processes.
+        """
+        self.epoch = epoch
+
+    def _get_rank_and_world_size(self):
+        if self.rank is not None and self.world_size is not None:
+            return self.rank, self.world_size
+        return _get_dist_rank_and_world_size()
+
+    def _get_rank_len(self, world_size):
+        # all ranks yield the same number of samples per epoch
+        return self.dataset.get_len(self.fold) // world_size
+
+    def __len__(self):
+        _, world_size = self._get_rank_and_world_size()
+        return self._get_rank_len(world_size)
+
+    def __iter__(self):
+        epoch = self.epoch
+        if epoch is None:
+            epoch = self._auto_epoch
+            self._auto_epoch += 1
+        shuffle = self.dataset.shuffle.get(self.fold, False)
+        rng = random.Random(self.dataset.seed + epoch)
+
+        shards = list(zip(
+                self.dataset.get_shard_paths(self.fold),
+                (s['num_samples'] for s in
+                 self.dataset.indices[self.fold]['shards'])))
+        if shuffle:
+            rng.shuffle(shards)
+
+        # assign a contiguous range of the (shuffled) concatenation of all
+        # shards to this rank and worker, so that each reads only few shards
+        # (sequentially) and all ranks yield the same number of samples
+        rank, world_size = self._get_rank_and_world_size()
+        num_samples = self._get_rank_len(world_size)
+        start = rank * num_samples
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            num_workers, worker_id = worker_info.num_workers, worker_info.id
+            start += (worker_id * (num_samples // num_workers) +
+                      min(worker_id, num_samples % num_workers))
+            num_samples = (num_samples // num_workers +
+                           int(worker_id < num_samples % num_workers))
+            # different buffer shuffling in each worker
+            rng = random.Random(
+                    (self.dataset.seed + epoch) * 1000003 + worker_id)
+        stop = start + num_samples
+
+        shard_slices = []
+        offset = 0
+        for shard_path, shard_len in shards:
+            if offset < stop and offset + shard_len > start:
+                shard_slices.append((shard_path,
+                                     max(start - offset, 0),
+                                     min(stop - offset, shard_len)))
+            offset += shard_len
+
+        for sample in self._iter_samples(shard_slices, shuffle, rng):
+            yield self._to_tensors(sample)
+
+    def _iter_samples(self, shard_slices, shuffle, rng):
+        num_elements = self.dataset.get_num_elements_per_sample()
+        shard_iter = _iter_prefetched(
+                shard_slices, num_elements, self.dataset.prefetch_shards)
+        if not shuffle:
+            for arrays in shard_iter:
+                yield from zip(*arrays)
+            return
+        buffer = []
+        for arrays in shard_iter:
+            for sample in zip(*arrays):
+                if len(buffer) < self.dataset.shuffle_buffer_size:
+                    buffer.append(sample)
+                else:
+                    i = rng.randrange(len(buffer))
+                    yield buffer[i]
+                    buffer[i] = sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _to_tensors(self, sample):
+        tensors = []
+        for arr, s in zip(sample, self.reshape):
+            t = torch.from_numpy(np.array(arr))
+            if s is not None:
+                t = t.view(*s)
+            tensors.append(t)
+        return tuple(tensors) if len(tensors) > 1 else tensors[0]
@@ -65,7 +65,9 @@ def get_ray_trafos(name, cfg, return_torch_module=True):
     -------
     ray_trafos : dict
         Dictionary with the entries `'ray_trafo'`, `'smooth_pinv_ray_trafo'`,
-        and optionally `'ray_trafo_module'`.
+        and optionally `'ray_trafo_module'`, `'smooth_pinv_ray_trafo_module'`
+        and `'torch_smooth_pinv_ray_trafo_module'` (the latter only for the
+        matrix implementation).
     """
 
     ray_trafos = {}
@@ -103,6 +105,16 @@ def get_ray_trafos(name, cfg, return_torch_module=True):
                     scaling_factor=cfg.fbp_scaling_factor,
                     filter_type=cfg.fbp_filter_type,
                     frequency_scaling=cfg.fbp_frequency_scaling)
+            # same filter, but evaluated by torch ops (usable batch-wise on
+            # the device, e.g. by :class:`dataset.TorchPairGenerator`)
+            ray_trafos['torch_smooth_pinv_ray_trafo_module'] = get_matrix_fbp_module(
+                    get_matrix_ray_trafo_module(
+                    matrix, (cfg.im_shape, cfg.im_shape), proj_shape,
+                    sparse=True, adjoint=True), proj_shape,
+                    torch_filter=True,
+                    scaling_factor=cfg.fbp_scaling_factor,
+                    filter_type=cfg.fbp_filter_type,
+                    frequency_scaling=cfg.fbp_frequency_scaling)
 
     elif cfg.geometry_specs.impl == 'custom':
         custom_cfg = cfg.geometry_specs.ray_trafo_custom
@@ -263,7 +275,9 @@ def get_standard_dataset(name, cfg, return_ray_trafo_torch_module=True, **image_
             image_dataset = RectanglesDataset(**dataset_specs, **image_dataset_kwargs)
         elif name in ['pascal_voc_lotus_20']:
             image_dataset = PascalVOCDataset(
-                    data_path=cfg.data_path, **dataset_specs, **image_dataset_kwargs)
+                    data_path=cfg.data_path,
+                    cache_path=cfg.get('cache_path', None),
+                    **dataset_specs, **image_dataset_kwargs)
         else:
             raise NotImplementedError
         space = lotus.get_domain128()
@@ -286,7 +300,9 @@ def get_standard_dataset(name, cfg, return_ray_trafo_torch_module=True, **image_
     elif name == 'brain_walnut_120':
         dataset_specs = {'data_path': cfg.data_path, 'shuffle': cfg.shuffle,
                          'zoom': cfg.zoom, 'zoom_fit': cfg.zoom_fit,
-                         'random_rotation': cfg.random_rotation}
+                         'random_rotation': cfg.random_rotation,
+                         'cache_path': cfg.get('cache_path', None),
+                         'affine_batch_size': cfg.get('affine_batch_size', None)}
         brain_dataset = ACRINFMISOBrainDataset(**dataset_specs, **image_dataset_kwargs)
         space = brain_dataset.space
         proj_numel = cfg.geometry_specs.num_angles * cfg.geometry_specs.num_det_pixels
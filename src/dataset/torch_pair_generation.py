@@ -0,0 +1,159 @@
+"""
+Provides the TorchPairGenerator for generating observation/FBP pairs from
+batches of ground truth images using torch operations.
+"""
+import numpy as np
+import torch
+
+
+class TorchPairGenerator(torch.nn.Module):
+    """
+    Batched counterpart of :meth:`ObservationGroundTruthPairDataset.generator`.
+
+    A whole batch of ground truth images is passed through the forward
+    operator, the noise model and the smooth pseudo-inverse (e.g. FBP) as
+    torch operations, which is much faster than the per-sample numpy/ODL
+    evaluation if the operators are torch-native (e.g. the sparse matrix ray
+    transform module and the FBP module with precomputed filter, see
+    ``ray_trafos['torch_smooth_pinv_ray_trafo_module']`` returned by
+    :func:`dataset.standard.get_ray_trafos`).
+
+    The noise is drawn from one :class:`torch.Generator` per fold, seeded by
+    `noise_seeds`, so results are reproducible. Note that the noise
+    realizations differ from the ones of the numpy implementation.
+    """
+    def __init__(self, ray_trafo_module, smooth_pinv_ray_trafo_module,
+                 noise_type, specs_kwargs, noise_seeds=None, device='cpu',
+                 shard_index=0):
+        """
+        Parameters
+        ----------
+        ray_trafo_module : :class:`torch.nn.Module`
+            Forward operator, receives images of shape ``B x 1 x ...`` and
+            returns projections of shape ``B x 1 x ...``.
+        smooth_pinv_ray_trafo_module : :class:`torch.nn.Module`
+            Smooth pseudo-inverse, receives projections and returns images.
+        noise_type : {``'white'``, ``'poisson'``}
+            Noise model, see
+            :meth:`ObservationGroundTruthPairDataset.ground_truth_to_obs`.
+        specs_kwargs : dict
+            Noise parameters, i.e. ``{'stddev': ...}`` for white noise or
+            ``{'photons_per_pixel': ..., 'mu_max': ...}`` for Poisson noise.
+        noise_seeds : dict, optional
+            Seeds for the folds, e.g. ``{'train': 1, 'validation': 2}``.
+            Folds without a seed use a non-deterministic seed.
+        device : str or :class:`torch.device`, optional
+            Device on which the noise generators are created, must match the
+            device of the ground truth batches passed to :meth:`forward`.
+            The default is ``'cpu'``.
+        shard_index : int, optional
+            Index of the data shard (e.g. the distributed rank). For a
+            non-zero index, the seeds are derived from
+            ``[noise_seeds[fold], shard_index]``, so that different shards
+            use independent noise. The default is ``0``.
+        """
+        super().__init__()
+        if noise_type not in ['white', 'poisson']:
+            raise NotImplementedError
+        self.ray_trafo_module = ray_trafo_module
+        self.smooth_pinv_ray_trafo_module = smooth_pinv_ray_trafo_module
+        self.noise_type = noise_type
+        self.specs_kwargs = specs_kwargs
+        self.noise_seeds = dict(noise_seeds or {})
+        self.device = torch.device(device)
+        self.shard_index = shard_index
+        self.random_gens = {}
+
+    @classmethod
+    def from_dataset(cls, dataset, ray_trafos, device='cpu', shard_index=0):
+        """
+        Create a generator matching an :class:`ObservationGroundTruthPairDataset`.
+
+        Parameters
+        ----------
+        dataset : :class:`ObservationGroundTruthPairDataset`
+            Dataset providing `noise_type`, `specs_kwargs` and `noise_seeds`.
+        ray_trafos : dict
+            Dictionary with the entry `'ray_trafo_module'` and one of the
+            entries `'torch_smooth_pinv_ray_trafo_module'` (preferred) or
+            `'smooth_pinv_ray_trafo_module'`.
+        """
+        smooth_pinv_ray_trafo_module = ray_trafos.get(
+                'torch_smooth_pinv_ray_trafo_module',
+                ray_trafos.get('smooth_pinv_ray_trafo_module'))
+        if (ray_trafos.get('ray_trafo_module') is None or
+                smooth_pinv_ray_trafo_module is None):
+            raise ValueError(
+                    'batched pair generation requires a ray transform module '
+                    'and a smooth pseudo-inverse module')
+        return cls(ray_trafo_module=ray_trafos['ray_trafo_module'],
+                   smooth_pinv_ray_trafo_module=smooth_pinv_ray_trafo_module,
+                   noise_type=dataset.noise_type,
+                   specs_kwargs=dataset.specs_kwargs,
+                   noise_seeds=dataset.noise_seeds, device=device,
+                   shard_index=shard_index)
+
+    def reset(self, fold='train'):
+        """
+        (Re-)seed the noise generator of a fold.
+        """
+        random_gen = torch.Generator(device=self.device)
+        seed = self.noise_seeds.get(fold)
+        if seed is not None and self.shard_index != 0:
+            seed = int(np.random.SeedSequence(
+                    [seed, self.shard_index]).generate_state(1, np.uint64)[0])
+        if seed is not None:
+            random_gen.manual_seed(seed)
+        else:
+            random_gen.seed()
+        self.random_gens[fold] = random_gen
+
+    def _get_random_gen(self, fold):
+        if fold not in self.random_gens:
+            self.reset(fold)
+        return self.random_gens[fold]
+
+    def add_noise(self, obs, random_gen):
+        """
+        Apply the noise model to a batch of noise-free projections.
+        """
+        if self.noise_type == 'white':
+            batch_dims = tuple(range(1, obs.ndim))
+            relative_stddev = torch.mean(
+                    torch.abs(obs), dim=batch_dims, keepdim=True)
+            noise = torch.randn(obs.shape, generator=random_gen,
+                                device=obs.device, dtype=obs.dtype)
+            noisy_obs = (
+                    obs + noise * relative_stddev * self.specs_kwargs['stddev'])
+        elif self.noise_type == 'poisson':
+            photons_per_pixel = self.specs_kwargs['photons_per_pixel']
+            mu_max = self.specs_kwargs['mu_max']
+            rate = torch.exp(-mu_max * obs) * photons_per_pixel
+            noisy_obs = torch.poisson(rate, generator=random_gen)
+            noisy_obs = torch.clamp(noisy_obs, min=1.) / photons_per_pixel
+            noisy_obs = torch.log(noisy_obs) * (-1. / mu_max)
+        return noisy_obs
+
+    @torch.no_grad()
+    def forward(self, ground_truth, fold='train'):
+        """
+        Generate a batch of pairs.
+
+        Parameters
+        ----------
+        ground_truth : :class:`torch.Tensor`
+            Batch of ground truth images of shape ``B x 1 x ...``.
+        fold : str, optional
+            Fold, selecting the noise generator. The default is ``'train'``.
+
+        Returns
+        -------
+        noisy_obs, fbp, ground_truth : :class:`torch.Tensor`
+            Batches like yielded by the torch dataset returned by
+            :meth:`ObservationGroundTruthPairDataset.create_torch_dataset`.
+        """
+        random_gen = self._get_random_gen(fold)
+        obs = self.ray_trafo_module(ground_truth)
+        noisy_obs = self.add_noise(obs, random_gen)
+        fbp = self.smooth_pinv_ray_trafo_module(noisy_obs)
+        return noisy_obs, fbp, ground_truth
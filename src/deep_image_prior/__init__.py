@@ -1,2 +1,3 @@
 from .deep_image_prior import DeepImagePriorReconstructor
+from .rise_time import RiseTimeTracker
 from .utils import *
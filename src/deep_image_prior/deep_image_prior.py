@@ -4,7 +4,6 @@ import datetime
 import contextlib
 import torch
 import numpy as np
-import tensorboardX
 from torch.optim import Adam
 from torch.nn import MSELoss
 from torch.cuda.amp import autocast, GradScaler
@@ -12,9 +11,11 @@ from warnings import warn
 from functools import partial
 from copy import deepcopy
 from tqdm import tqdm
+import functorch as ftch
+from util.async_logging import LoggingService
 
 from .network import UNet, UNet3D
-from .utils import poisson_loss, tv_loss, tv_loss_3d, PSNR, normalize, extract_learnable_params
+from .utils import poisson_loss, tv_loss, tv_loss_3d, PSNR, normalize, extract_learnable_params, is_name_in_set
 
 
 class LRPolicy():
@@ -30,20 +31,25 @@ class LRPolicy():
         self.lambda_fct = np.ones(self.num_iterations + 1)
         self.restart(0, init_lr, lr, preserve_initial_warmup=False)
 
-    def restart(self, epoch, init_lr, lr, preserve_initial_warmup=True):
+    def restart(self, epoch, init_lr, lr, preserve_initial_warmup=True,
+                num_warmup_iter=None):
         """
         Add a linear warmup phase starting at `epoch`, linearly increasing
         from `init_lr` to `lr`. After the warmup, `lr` is used. Optionally, the
         initial warmup phase is respected by taking the pointwise minimum of
         both rates.
+        The length of the warmup phase is `num_warmup_iter` (by default, the
+        length of the initial warmup phase).
         Note: `epoch` specifies the iteration.
         """
-        n = min(self.num_warmup_iter, max(0, self.num_iterations + 1 - epoch))
+        if num_warmup_iter is None:
+            num_warmup_iter = self.num_warmup_iter
+        n = min(num_warmup_iter, max(0, self.num_iterations + 1 - epoch))
 
         self.lambda_fct[epoch:epoch+n] = np.linspace(
                 init_lr/self.lr if self.lr != 0. else 1.,
                 lr/self.lr if self.lr != 0. else 1.,
-                self.num_warmup_iter)[:n]
+                num_warmup_iter)[:n]
 
         self.lambda_fct[epoch+n:] = lr/self.lr if self.lr != 0. else 1.
 
@@ -104,6 +110,7 @@ class DeepImagePriorReconstructor():
         self.device = torch.device(('cuda:0' if torch.cuda.is_available() else 'cpu'))
         self.ray_trafo_module = ray_trafo_module.to(self.device)
         self.init_model()
+        self.warm_start_state = None
 
     def init_model(self):
 
@@ -156,9 +163,11 @@ class DeepImagePriorReconstructor():
         logdir = os.path.join(
             self.cfg.log_path,
             current_time + '_' + socket.gethostname() + comment)
-        self.writer = tensorboardX.SummaryWriter(logdir=logdir)
+        self.writer = LoggingService(
+                logdir=logdir, asynchronous=self.cfg.get('async_logging', True))
 
-    def apply_model_on_test_data(self, net_input):
+    def apply_model_on_test_data(self, net_input, model=None):
+        model = self.model if model is None else model
         test_scaling = self.cfg.get('implicit_scaling_except_for_test_data')
         if test_scaling is not None and test_scaling != 1.:
             if self.cfg.recon_from_randn:
@@ -168,16 +177,17 @@ class DeepImagePriorReconstructor():
                              net_input[:, 1].unsqueeze(dim=1)), dim=1)
             else:
                 net_input = test_scaling * net_input
-            output = self.model(net_input)
+            output = model(net_input)
             output = output / test_scaling
         else:
-            output = self.model(net_input)
+            output = model(net_input)
 
         return output
 
     def reconstruct(self, noisy_observation, fbp=None, ground_truth=None,
                     return_histories=False, return_iterates=False,
-                    return_iterates_params=False):
+                    return_iterates_params=False, rise_time_tracker=None,
+                    warm_start=False):
         """
         Parameters
         ----------
@@ -198,6 +208,16 @@ class DeepImagePriorReconstructor():
             Whether to return the parameters for a selection of iterates,
             configured via ``self.cfg.return_iterates_params_selection``.
             The default is `False`.
+        rise_time_tracker : :class:`deep_image_prior.RiseTimeTracker`, optional
+            Tracker updated with the output PSNR in each iteration (requires
+            `ground_truth`). If its :attr:`should_stop` becomes `True`, the
+            reconstruction stops early, i.e. the histories are shorter than
+            ``self.cfg.optim.iterations``.
+        warm_start : bool, optional
+            Whether to initialize from the final state of the previous call
+            (:attr:`warm_start_state`) instead of the initial (or pretrained)
+            weights, see :meth:`_warm_start`. Without a previous call, the
+            usual initialization is used. The default is `False`.
 
         Returns
         -------
@@ -222,45 +242,20 @@ class DeepImagePriorReconstructor():
             Only provided if ``return_iterates_params=True``.
         """
 
-        if self.cfg.torch_manual_seed:
-            torch.random.manual_seed(self.cfg.torch_manual_seed)
+        self._init_reconstruction(fbp)
 
-        self.init_model()
-        if self.cfg.load_pretrain_model:
-            path = \
-                self.cfg.learned_params_path if self.cfg.learned_params_path.endswith('.pt') \
-                    else self.cfg.learned_params_path + '.pt'
-            self.model.load_state_dict(torch.load(path, map_location=self.device))
+        iterations = self.cfg.optim.iterations
+        if warm_start and self.warm_start_state is not None:
+            iterations = self._warm_start()
         else:
-            self.model.to(self.device)
-
-        self.model.train()
-
-        if self.cfg.recon_from_randn:
-            self.net_input = 0.1 * \
-                torch.randn(1, *self.reco_space.shape)[None].to(self.device)
-            if self.cfg.add_init_reco:
-                self.net_input = \
-                    torch.cat([fbp.to(self.device), self.net_input], dim=1)
-        else:
-            self.net_input = fbp.to(self.device)
-
-        self.init_optimizer()
-        self.init_scheduler()
+            self.init_optimizer()
+            self.init_scheduler()
         y_delta = noisy_observation.to(self.device)
 
         if self.cfg.use_mixed:
             scaler = GradScaler()
 
-        if self.cfg.optim.loss_function == 'mse':
-            criterion = MSELoss()
-        elif self.cfg.optim.loss_function == 'poisson':
-            criterion = partial(poisson_loss,
-                                photons_per_pixel=self.cfg.optim.photons_per_pixel,
-                                mu_max=self.cfg.optim.mu_max)
-        else:
-            warn('Unknown loss function, falling back to MSE')
-            criterion = MSELoss()
+        criterion = self._get_criterion()
 
         tv_loss_fun = tv_loss if len(self.reco_space.shape) == 2 else tv_loss_3d
 
@@ -268,12 +263,12 @@ class DeepImagePriorReconstructor():
         if return_iterates:
             iterates_iters = get_iterates_iters(
                 self.cfg.return_iterates_selection,
-                self.cfg.optim.iterations)
+                iterations)
         iterates_params_iters = []
         if return_iterates_params:
             iterates_params_iters = get_iterates_iters(
                 self.cfg.return_iterates_params_selection,
-                self.cfg.optim.iterations)
+                iterations)
 
         iterates = []
         iterates_params = []
@@ -290,7 +285,7 @@ class DeepImagePriorReconstructor():
         loss_avg_history = []
         last_lr_adaptation_iter = 0
 
-        with tqdm(range(self.cfg.optim.iterations), desc='DIP', disable= not self.cfg.show_pbar) as pbar:
+        with tqdm(range(iterations), desc='DIP', disable= not self.cfg.show_pbar) as pbar:
             for i in pbar:
                 self.optimizer.zero_grad()
                 with autocast() if self.cfg.use_mixed else contextlib.nullcontext():
@@ -355,6 +350,8 @@ class DeepImagePriorReconstructor():
                     pbar.set_postfix({'output_psnr': output_psnr})
                     self.writer.add_scalar('best_output_psnr', best_output_psnr, i)
                     self.writer.add_scalar('output_psnr', output_psnr, i)
+                    if rise_time_tracker is not None:
+                        rise_time_tracker.update(output_psnr)
 
                 self.writer.add_scalar('loss', loss.item(),  i)
                 if i in iterates_iters:
@@ -366,8 +363,16 @@ class DeepImagePriorReconstructor():
                         self.writer.add_image('reco_mid_slice',
                                 normalize(best_output[0, :, best_output.shape[2] // 2, ...]).cpu().numpy(), i)
 
+                if rise_time_tracker is not None and rise_time_tracker.should_stop:
+                    break
+
         self.writer.close()
 
+        self.warm_start_state = {'model': deepcopy(self.model.state_dict())}
+        if self._get_warm_start_cfg().get('restore_optimizer_state', False):
+            self.warm_start_state['optimizer'] = deepcopy(
+                    self.optimizer.state_dict())
+
         out = best_output[0, 0, ...].cpu().numpy()
 
         optional_out = []
@@ -386,6 +391,251 @@ class DeepImagePriorReconstructor():
 
         return (out, *optional_out) if optional_out else out
 
+    def _init_reconstruction(self, fbp):
+        """
+        Seed, initialize (or load) the model and set the network input.
+        """
+        if self.cfg.torch_manual_seed:
+            torch.random.manual_seed(self.cfg.torch_manual_seed)
+
+        self.init_model()
+        if self.cfg.load_pretrain_model:
+            path = \
+                self.cfg.learned_params_path if self.cfg.learned_params_path.endswith('.pt') \
+                    else self.cfg.learned_params_path + '.pt'
+            self.model.load_state_dict(torch.load(path, map_location=self.device))
+        else:
+            self.model.to(self.device)
+
+        self.model.train()
+
+        if self.cfg.recon_from_randn:
+            self.net_input = 0.1 * \
+                torch.randn(1, *self.reco_space.shape)[None].to(self.device)
+            if self.cfg.add_init_reco:
+                self.net_input = \
+                    torch.cat([fbp.to(self.device), self.net_input], dim=1)
+        else:
+            self.net_input = fbp.to(self.device)
+
+    def _get_warm_start_cfg(self):
+        return self.cfg.optim.get('warm_start') or {}
+
+    def _warm_start(self):
+        """
+        Load the model weights (and the optimizer state if
+        ``self.cfg.optim.warm_start.restore_optimizer_state``) from
+        :attr:`warm_start_state` and initialize the optimizer and the
+        scheduler, restarting the learning rates with a warmup phase from
+        ``self.cfg.optim.warm_start.init_lr`` of length
+        ``self.cfg.optim.warm_start.num_warmup_iter``.
+
+        Returns
+        -------
+        iterations : int
+            Number of iterations, ``self.cfg.optim.warm_start.iterations`` if
+            specified (at most ``self.cfg.optim.iterations``), else
+            ``self.cfg.optim.iterations``.
+        """
+        warm_start_cfg = self._get_warm_start_cfg()
+        self.model.load_state_dict(self.warm_start_state['model'])
+        self.init_optimizer()
+        if 'optimizer' in self.warm_start_state:
+            self.optimizer.load_state_dict(self.warm_start_state['optimizer'])
+        self.init_scheduler()
+        num_warmup_iter = warm_start_cfg.get('num_warmup_iter', 0) or 0
+        lr_policies = [self._lr_policy_encoder, self._lr_policy_decoder]
+        for lr_policy, group_cfg in zip(
+                lr_policies, [self.cfg.optim.encoder, self.cfg.optim.decoder]):
+            init_lr = warm_start_cfg.get('init_lr')
+            lr_policy.restart(
+                    0, init_lr if init_lr is not None else group_cfg.lr,
+                    group_cfg.lr, preserve_initial_warmup=False,
+                    num_warmup_iter=num_warmup_iter)
+        # the learning rates for iteration 0 were set by the scheduler before
+        # the restart
+        for param_group, base_lr, lr_policy in zip(
+                self.optimizer.param_groups, self.scheduler.base_lrs,
+                lr_policies):
+            param_group['lr'] = base_lr * lr_policy(0)
+        iterations = (warm_start_cfg.get('iterations') or
+                      self.cfg.optim.iterations)
+        if iterations > self.cfg.optim.iterations:
+            raise ValueError('warm_start.iterations must not exceed '
+                             'optim.iterations')
+        return iterations
+
+    def _get_criterion(self):
+        if self.cfg.optim.loss_function == 'mse':
+            criterion = MSELoss()
+        elif self.cfg.optim.loss_function == 'poisson':
+            criterion = partial(poisson_loss,
+                                photons_per_pixel=self.cfg.optim.photons_per_pixel,
+                                mu_max=self.cfg.optim.mu_max)
+        else:
+            warn('Unknown loss function, falling back to MSE')
+            criterion = MSELoss()
+        return criterion
+
+    def reconstruct_gamma_sweep(self, noisy_observation, fbp=None,
+                                ground_truth=None, gammas=None,
+                                return_histories=False):
+        """
+        Run the reconstructions for multiple values of the TV weight
+        ``gamma`` in a single batched optimization.
+
+        One replica of the model is optimized per value in `gammas`. All
+        replicas start from the initialization (and network input) that
+        :meth:`reconstruct` would use. They are evaluated by a
+        :func:`functorch.vmap`-batched call, and the ray transform is applied
+        once to the stacked outputs. Since the Adam update is element-wise and
+        the gradient norm is clipped per replica, each replica follows the
+        optimization of :meth:`reconstruct` with ``cfg.optim.gamma`` set to
+        its value (up to floating point differences).
+
+        Adaptive learning rates, mixed precision and models with batch
+        normalization are not supported.
+
+        Parameters
+        ----------
+        noisy_observation : :class:`torch.Tensor`
+            Noisy observation.
+        fbp : :class:`torch.Tensor`, optional
+            Input reconstruction (e.g. filtered backprojection).
+        ground_truth : :class:`torch.Tensor`, optional
+            Ground truth image.
+        gammas : sequence of float, optional
+            Values of ``gamma``. The default is ``self.cfg.optim.gamma_sweep``.
+        return_histories : bool, optional
+            Whether to return histories of loss, PSNR and learning rates.
+            The default is `False`.
+
+        Returns
+        -------
+        outs : list of :class:`numpy.ndarray`
+            The reconstructions with minimum loss value reached, one per
+            value in `gammas`.
+        histories : list of dict, optional
+            Histories (see :meth:`reconstruct`), one per value in `gammas`.
+            Only provided if ``return_histories=True``.
+        """
+        if gammas is None:
+            gammas = self.cfg.optim.gamma_sweep
+        gammas = list(gammas)
+        if self.cfg.optim.use_adaptive_lr or self.cfg.use_mixed:
+            raise ValueError('Adaptive learning rates and mixed precision are '
+                             'not supported by the gamma sweep')
+
+        self._init_reconstruction(fbp)
+        if any(isinstance(m, torch.nn.modules.batchnorm._BatchNorm)
+               for m in self.model.modules()):
+            raise ValueError('Batch normalization is not supported by the '
+                             'gamma sweep')
+
+        num_replicas = len(gammas)
+        func_model, params, buffers = ftch.make_functional_with_buffers(
+                self.model)
+        params = tuple(
+                p.detach().unsqueeze(0).repeat(num_replicas, *[1] * p.dim())
+                .requires_grad_(True) for p in params)
+        buffers = tuple(
+                b.unsqueeze(0).repeat(num_replicas, *[1] * b.dim())
+                for b in buffers)
+        names = [name for name, _ in self.model.named_parameters()]
+
+        def model(x):
+            # (num_replicas, 1, ...) output of each replica for the input x of
+            # batch size 1 -> (num_replicas, ...)
+            return ftch.vmap(func_model, in_dims=(0, 0, None))(
+                    params, buffers, x)[:, 0]
+
+        self._optimizer = torch.optim.Adam(
+                [{'params': [p for name, p in zip(names, params)
+                             if is_name_in_set(name, ['down', 'inc'])],
+                  'lr': self.cfg.optim.encoder.lr},
+                 {'params': [p for name, p in zip(names, params)
+                             if is_name_in_set(name, ['up', 'scale', 'outc'])],
+                  'lr': self.cfg.optim.decoder.lr}])
+        self.init_scheduler()
+        y_delta = noisy_observation.to(self.device)
+
+        criterion = self._get_criterion()
+
+        tv_loss_fun = tv_loss if len(self.reco_space.shape) == 2 else tv_loss_3d
+
+        def post(output):
+            if self.cfg.arch.use_relu_out == 'post':
+                output = torch.nn.functional.relu(output)
+            return output
+
+        best_loss = np.full(num_replicas, np.inf)
+        best_outputs = post(self.apply_model_on_test_data(
+                self.net_input, model=model).detach())
+
+        histories = [{'loss': [], 'psnr': [], 'lr_encoder': [],
+                      'lr_decoder': []} for _ in gammas]
+
+        with tqdm(range(self.cfg.optim.iterations), desc='DIP gamma sweep', disable= not self.cfg.show_pbar) as pbar:
+            for i in pbar:
+                self.optimizer.zero_grad()
+                outputs = self.apply_model_on_test_data(
+                        self.net_input, model=model)
+                # single ray transform call for all replicas
+                projections = self.ray_trafo_module(outputs)
+                losses = torch.stack([
+                        criterion(projections[j:j+1], y_delta) +
+                        gamma * tv_loss_fun(outputs[j:j+1])
+                        for j, gamma in enumerate(gammas)])
+                losses.sum().backward()
+
+                # clip the gradient norm of each replica to 1
+                grad_norms = torch.sqrt(sum(
+                        torch.sum(p.grad.reshape(num_replicas, -1)**2, dim=1)
+                        for p in params))
+                clip_coefs = torch.clamp(1. / (grad_norms + 1e-6), max=1.)
+                for p in params:
+                    p.grad.mul_(clip_coefs.view(-1, *[1] * (p.dim() - 1)))
+                self.optimizer.step()
+
+                if return_histories:
+                    for h in histories:
+                        h['lr_encoder'].append(self.optimizer.param_groups[0]['lr'])
+                        h['lr_decoder'].append(self.optimizer.param_groups[1]['lr'])
+                self.writer.add_scalar('lr_encoder', self.optimizer.param_groups[0]['lr'], i)
+                self.writer.add_scalar('lr_decoder', self.optimizer.param_groups[1]['lr'], i)
+
+                self.scheduler.step()
+                for p in params:
+                    p.data.clamp_(-1000, 1000) # MIN,MAX
+
+                losses = losses.detach().cpu().numpy()
+                outputs = post(outputs.detach())
+                for j, gamma in enumerate(gammas):
+                    if losses[j] < best_loss[j]:
+                        best_loss[j] = losses[j]
+                        best_outputs[j] = outputs[j]
+                    if return_histories:
+                        histories[j]['loss'].append(float(losses[j]))
+                    if ground_truth is not None:
+                        output_psnr = PSNR(outputs[j:j+1].cpu(), ground_truth.cpu())
+                        if return_histories:
+                            histories[j]['psnr'].append(output_psnr)
+                        self.writer.add_scalar('output_psnr_gamma_{:g}'.format(gamma), output_psnr, i)
+                    self.writer.add_scalar('loss_gamma_{:g}'.format(gamma), losses[j], i)
+                if i % 1000 == 0:
+                    for j, gamma in enumerate(gammas):
+                        if len(self.reco_space.shape) == 2:
+                            self.writer.add_image('reco_gamma_{:g}'.format(gamma), normalize(best_outputs[j]).cpu().numpy(), i)
+                        else:  # 3d
+                            self.writer.add_image('reco_mid_slice_gamma_{:g}'.format(gamma),
+                                    normalize(best_outputs[j, :, best_outputs.shape[2] // 2, ...]).cpu().numpy(), i)
+
+        self.writer.close()
+
+        outs = [best_output[0, ...].cpu().numpy() for best_output in best_outputs]
+
+        return (outs, histories) if return_histories else outs
+
     def init_optimizer(self):
         """
         Initialize the optimizer.
@@ -0,0 +1,90 @@
+from collections import deque
+import numpy as np
+
+class RiseTimeTracker():
+    """
+    Online tracker of the rise time of a PSNR history, for use with
+    :meth:`deep_image_prior.DeepImagePriorReconstructor.reconstruct`.
+
+    Tracks the rise time to the baseline, i.e. the first iteration in which
+    the PSNR exceeds ``baseline_psnr_steady - remaining_psnr``, and running
+    estimates of the steady PSNR (median of the last `steady_window` values)
+    and of the rise time w.r.t. this estimate.
+
+    The PSNR has *risen* once it stayed above the baseline threshold for
+    `window` consecutive iterations. With ``early_stop=True``, the
+    reconstruction is stopped at this point (see :attr:`should_stop`).
+    """
+    def __init__(self, baseline_psnr_steady, remaining_psnr=0.1, window=500,
+                 steady_window=5000, rise_time_remaining_psnr=0.1,
+                 early_stop=False):
+        """
+        Parameters
+        ----------
+        baseline_psnr_steady : float
+            Steady PSNR of the baseline.
+        remaining_psnr : float, optional
+            Tolerance below `baseline_psnr_steady`.
+        window : int, optional
+            Number of consecutive iterations above the threshold required to
+            have risen.
+        steady_window : int, optional
+            Number of last iterations for the steady PSNR estimate.
+        rise_time_remaining_psnr : float, optional
+            Tolerance below the steady PSNR estimate for the rise time
+            estimate.
+        early_stop : bool, optional
+            Whether the reconstruction should stop once the PSNR has risen.
+        """
+        self.threshold = baseline_psnr_steady - remaining_psnr
+        self.window = window
+        self.rise_time_remaining_psnr = rise_time_remaining_psnr
+        self.early_stop = early_stop
+        self.rise_time_to_baseline = None
+        self.num_iterations_above = 0
+        self.psnr_history = []
+        self._recent = deque(maxlen=steady_window)
+
+    def update(self, psnr):
+        """
+        Add the PSNR of the next iteration.
+        """
+        if psnr > self.threshold:
+            if self.rise_time_to_baseline is None:
+                self.rise_time_to_baseline = len(self.psnr_history)
+            self.num_iterations_above += 1
+        else:
+            self.num_iterations_above = 0
+        self.psnr_history.append(psnr)
+        self._recent.append(psnr)
+
+    @property
+    def psnr_steady(self):
+        """
+        Running estimate of the steady PSNR, or `None` before the first
+        update.
+        """
+        return float(np.median(self._recent)) if self._recent else None
+
+    @property
+    def rise_time(self):
+        """
+        Running estimate of the rise time w.r.t. :attr:`psnr_steady`, or `None`
+        before the first update.
+        """
+        if not self.psnr_history:
+            return None
+        return int(np.argmax(np.asarray(self.psnr_history) >
+                             self.psnr_steady - self.rise_time_remaining_psnr))
+
+    @property
+    def risen(self):
+        """
+        Whether the PSNR stayed above the baseline threshold for the last
+        `window` iterations.
+        """
+        return self.num_iterations_above >= self.window
+
+    @property
+    def should_stop(self):
+        return self.early_stop and self.risen
@@ -1,19 +1,25 @@
 # -*- coding: utf-8 -*-
 import numpy as np
+from .history_store import HistorySelection
 
 def get_median_psnr_history(psnr_histories):
     """
     Parameters
     ----------
-    psnr_histories : array-like
+    psnr_histories : array-like or :class:`evaluation.history_store.HistorySelection`
         PSNR history or histories.  The last dimension is iterations, all other
-        dimensions are reduced using ``np.median``.
+        dimensions are reduced using ``np.median``.  A selection from a
+        :class:`evaluation.history_store.HistoryStore` is reduced block-wise
+        (ignoring the NaN padding of shorter histories).
 
     Returns
     -------
     median_psnr_history : :class:`numpy.ndarray`
         Median PSNR history.
     """
+    if isinstance(psnr_histories, HistorySelection):
+        return psnr_histories.median()
+
     psnr_histories = np.asarray(psnr_histories)
     median_psnr_history = np.median(psnr_histories,
                                     axis=range(psnr_histories.ndim - 1))
@@ -27,9 +33,11 @@ def get_psnr_steady(psnr_histories, start, stop):
 
     Parameters
     ----------
-    psnr_histories : array-like
+    psnr_histories : array-like or :class:`evaluation.history_store.HistorySelection`
         PSNR history or histories.  The last dimension is iterations, all other
-        dimensions are reduced using ``np.median``.
+        dimensions are reduced using ``np.median``.  A selection from a
+        :class:`evaluation.history_store.HistoryStore` is reduced block-wise
+        (ignoring the NaN padding of shorter histories).
     start : int or None
         Start of the interval (`start` argument to :class:`slice`).
     stop : int or None
@@ -40,6 +48,11 @@ def get_psnr_steady(psnr_histories, start, stop):
     psnr_steady : float
         Steady PSNR.
     """
+    if isinstance(psnr_histories, HistorySelection):
+        # only read the interval
+        psnr_steady = np.median(psnr_histories.median(start, stop))
+        return float(psnr_steady)
+
     median_psnr_history = get_median_psnr_history(psnr_histories)
     psnr_steady = np.median(median_psnr_history[start:stop])
 
@@ -54,9 +67,11 @@ def get_rise_time_to_baseline(psnr_histories,
 
     Parameters
     ----------
-    psnr_histories : array-like
+    psnr_histories : array-like or :class:`evaluation.history_store.HistorySelection`
         PSNR history or histories.  The last dimension is iterations, all other
-        dimensions are reduced using ``np.median``.
+        dimensions are reduced using ``np.median``.  A selection from a
+        :class:`evaluation.history_store.HistoryStore` is reduced block-wise
+        (ignoring the NaN padding of shorter histories).
     baseline_psnr_steady : scalar
         Steady PSNR of a baseline.
     remaining_psnr : float, optional
@@ -69,6 +84,16 @@ def get_rise_time_to_baseline(psnr_histories,
     rise_time_to_baseline : int
         Rise time (number of iterations).
     """
+    if isinstance(psnr_histories, HistorySelection):
+        # only read until the rise time
+        for offset, median_psnr_block in psnr_histories.iter_median_blocks():
+            argwhere_risen = np.argwhere(
+                    median_psnr_block > baseline_psnr_steady - remaining_psnr)
+            if len(argwhere_risen) > 0:
+                return offset + int(argwhere_risen[0][0])
+        raise IndexError('The median PSNR history does not reach the '
+                         'baseline steady PSNR')
+
     median_psnr_history = get_median_psnr_history(psnr_histories)
     rise_time = int(np.argwhere(
             median_psnr_history > baseline_psnr_steady - remaining_psnr)[0][0])
@@ -0,0 +1,249 @@
+"""
+Provides :class:`HistoryStore`, a consolidated HDF5 store of the histories
+(loss, PSNR, learning rates) of many runs, and :class:`HistorySelection`,
+which computes statistics over selected histories block-wise along the
+iterations.
+"""
+import os
+import fcntl
+from contextlib import contextmanager
+import numpy as np
+import h5py
+
+class HistoryStore():
+    """
+    Store of the histories of multiple runs in a single HDF5 file.
+
+    Each entry is identified by ``(run_id, repeat, sample)``. Each history
+    (e.g. `'psnr'`) is stored in a 2D dataset ``'histories/<key>'`` of shape
+    ``(num_entries, num_iterations)``, chunked along the iterations, where
+    shorter histories are padded with NaN.
+
+    Appending from multiple processes is serialized by a lock file
+    (``filename + '.lock'``).
+    """
+    def __init__(self, filename, chunk_size=1024):
+        """
+        Parameters
+        ----------
+        filename : str
+            HDF5 file, which is created by the first :meth:`append`.
+        chunk_size : int, optional
+            Chunk size along the iterations (and block size of the
+            computations in :class:`HistorySelection`).
+            The default is ``1024``.
+        """
+        self.filename = filename
+        self.chunk_size = chunk_size
+
+    @contextmanager
+    def open(self, mode='r'):
+        """
+        Open the HDF5 file while holding the lock (exclusive unless
+        ``mode='r'``).
+        """
+        if mode != 'r':
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)),
+                        exist_ok=True)
+        with open(self.filename + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file,
+                        fcntl.LOCK_SH if mode == 'r' else fcntl.LOCK_EX)
+            try:
+                with h5py.File(self.filename, mode) as f:
+                    yield f
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_index(f):
+        if 'run_ids' not in f:
+            return [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        run_ids = [r.decode() if isinstance(r, bytes) else r
+                   for r in f['run_ids'][()]]
+        return run_ids, f['repeats'][()], f['samples'][()]
+
+    @staticmethod
+    def _find_rows(index, run_ids=None, repeats=None, samples=None):
+        index_run_ids, index_repeats, index_samples = index
+        if isinstance(run_ids, str):
+            run_ids = [run_ids]
+        if np.isscalar(repeats):
+            repeats = [repeats]
+        if np.isscalar(samples):
+            samples = [samples]
+        run_ids = set(run_ids) if run_ids is not None else None
+        rows = [row for row, (run_id, repeat, sample) in enumerate(zip(
+                        index_run_ids, index_repeats, index_samples))
+                if (run_ids is None or run_id in run_ids) and
+                   (repeats is None or repeat in repeats) and
+                   (samples is None or sample in samples)]
+        return rows
+
+    def append(self, run_id, histories, repeat=0, sample=0):
+        """
+        Add (or replace) the histories of an entry.
+
+        Parameters
+        ----------
+        run_id : str
+            Identifier of the run, e.g. its path.
+        histories : dict
+            Histories, e.g. as returned by
+            :meth:`deep_image_prior.DeepImagePriorReconstructor.reconstruct`.
+        repeat : int, optional
+            Repetition. The default is ``0``.
+        sample : int, optional
+            Sample. The default is ``0``.
+        """
+        with self.open('a') as f:
+            index = self._read_index(f)
+            rows = self._find_rows(index, run_id, repeat, sample)
+            if rows:
+                row = rows[0]
+            else:
+                row = len(index[0])
+                if 'run_ids' not in f:
+                    f.create_dataset('run_ids', shape=(0,), maxshape=(None,),
+                                     dtype=h5py.string_dtype())
+                    for name in ['repeats', 'samples', 'lengths']:
+                        f.create_dataset(name, shape=(0,), maxshape=(None,),
+                                         dtype=np.int64)
+                for name, value in [('run_ids', run_id), ('repeats', repeat),
+                                    ('samples', sample), ('lengths', 0)]:
+                    f[name].resize((row + 1,))
+                    f[name][row] = value
+            length = max((len(h) for h in histories.values()), default=0)
+            f['lengths'][row] = length
+            group = f.require_group('histories')
+            for key, dataset in group.items():
+                if dataset.shape[0] <= row:
+                    dataset.resize((row + 1, dataset.shape[1]))
+                elif key not in histories:
+                    dataset[row] = np.nan  # replaced entry without `key`
+            for key, history in histories.items():
+                history = np.asarray(history, dtype=np.float32)
+                if key not in group:
+                    group.create_dataset(
+                            key, shape=(0, 0), maxshape=(None, None),
+                            dtype=np.float32, fillvalue=np.nan,
+                            chunks=(1, self.chunk_size))
+                dataset = group[key]
+                dataset.resize((max(len(f['run_ids']), dataset.shape[0]),
+                                max(dataset.shape[1], len(history))))
+                padded = np.full(dataset.shape[1], np.nan, dtype=np.float32)
+                padded[:len(history)] = history
+                dataset[row] = padded
+
+    def has(self, run_id, repeat=0, sample=0):
+        """
+        Return whether the store contains an entry.
+        """
+        if not os.path.isfile(self.filename):
+            return False
+        with self.open() as f:
+            return bool(self._find_rows(self._read_index(f),
+                                        run_id, repeat, sample))
+
+    def get_histories(self, run_id, repeat=0, sample=0):
+        """
+        Return the histories of an entry as a dict of
+        :class:`numpy.ndarray`.
+        """
+        with self.open() as f:
+            rows = self._find_rows(self._read_index(f), run_id, repeat, sample)
+            if not rows:
+                raise KeyError((run_id, repeat, sample))
+            row = rows[0]
+            length = f['lengths'][row]
+            return {key: dataset[row, :length]
+                    for key, dataset in f['histories'].items()
+                    if dataset.shape[0] > row}
+
+    def select(self, key, run_ids=None, repeats=None, samples=None):
+        """
+        Select the histories `key` of the entries matching the specified run
+        ids, repetitions and samples (`None` matches all).
+
+        Returns
+        -------
+        selection : :class:`HistorySelection`
+            The selection, which can be passed to the functions in
+            :mod:`evaluation.evaluation`.
+        """
+        with self.open() as f:
+            rows = self._find_rows(self._read_index(f),
+                                   run_ids, repeats, samples)
+        return HistorySelection(self, key, rows)
+
+class HistorySelection():
+    """
+    Selection of histories in a :class:`HistoryStore`.
+
+    The statistics are computed over blocks of ``store.chunk_size``
+    iterations, so only one block of all selected histories is in memory at a
+    time.
+    """
+    def __init__(self, store, key, rows):
+        self.store = store
+        self.key = key
+        self.rows = sorted(rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def num_iterations(self):
+        """
+        Maximum number of iterations of the selected histories.
+        """
+        if not self.rows:
+            return 0
+        with self.store.open() as f:
+            return int(np.max(f['lengths'][self.rows]))
+
+    def iter_blocks(self, start=None, stop=None):
+        """
+        Iterate over the blocks of the selected histories in the iteration
+        range ``start:stop`` (`slice` semantics).
+
+        Yields
+        ------
+        offset : int
+            First iteration of the block.
+        block : :class:`numpy.ndarray`
+            Histories, shape ``(len(self), block_size)``, padded with NaN.
+        """
+        start, stop, _ = slice(start, stop).indices(self.num_iterations)
+        if not self.rows:
+            return
+        with self.store.open() as f:
+            dataset = f['histories'][self.key]
+            for offset in range(start, stop, self.store.chunk_size):
+                yield offset, dataset[
+                        self.rows,
+                        offset:min(offset + self.store.chunk_size, stop)]
+
+    def iter_median_blocks(self, start=None, stop=None):
+        """
+        Like :meth:`iter_blocks`, but yields the point-wise median (ignoring
+        NaN) of each block.
+        """
+        for offset, block in self.iter_blocks(start, stop):
+            yield offset, np.nanmedian(block, axis=0)
+
+    def median(self, start=None, stop=None):
+        """
+        Return the point-wise median history in the iteration range
+        ``start:stop``.
+        """
+        blocks = [b for _, b in self.iter_median_blocks(start, stop)]
+        return np.concatenate(blocks) if blocks else np.zeros(0)
+
+    def to_array(self):
+        """
+        Return all selected histories, shape
+        ``(len(self), self.num_iterations)``.
+        """
+        blocks = [b for _, b in self.iter_blocks()]
+        return (np.concatenate(blocks, axis=1) if blocks
+                else np.zeros((len(self), 0)))
@@ -0,0 +1,301 @@
+"""
+Provides :class:`RunIndex`, an SQLite-backed index of hydra runs, storing
+their configs, overrides and artifact paths, which avoids walking the run
+directories and parsing the ``.hydra`` files each time a script starts.
+"""
+import os
+import re
+import json
+import sqlite3
+import yaml
+from omegaconf import OmegaConf
+
+# artifact name -> (config entry of the directory, filename)
+ARTIFACTS = {
+    'recos': ('save_reconstruction_path', 'recos.hdf5'),
+    'histories': ('save_histories_path', 'histories.npz'),
+    'iterates': ('save_iterates_path', 'iterates.npz'),
+}
+
+# default database file of `get_run_index` (outside of the source tree)
+DEFAULT_RUN_INDEX_FILENAME = os.path.join(
+        os.path.expanduser('~'), '.cache', 'deep_image_prior_extension',
+        'run_index.sqlite')
+
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+class RunIndex():
+    """
+    Index of hydra runs (directories containing ``.hydra/config.yaml``).
+
+    The index stores for each run the config and the overrides (as json) and
+    the paths of the artifacts (see :meth:`get_artifacts`). It is updated
+    incrementally:
+
+        * :meth:`refresh` walks directory trees, but only lists the
+          directories whose modification time changed since the last
+          refresh (otherwise the stored listing is used).
+        * The ``.hydra`` files of a run are only parsed again if their
+          modification times changed, which is checked on each access to
+          the run.
+
+    The listings of the directories are also used for finding checkpoints
+    (``.pt`` files), see :meth:`get_checkpoints`.
+    """
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename : str
+            SQLite database file, which is created if it does not exist.
+        """
+        self.filename = filename
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.connection = sqlite3.connect(filename)
+        with self.connection:
+            self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS dirs ('
+                    'path TEXT PRIMARY KEY, mtime REAL, subdirs TEXT, '
+                    'files TEXT)')
+            self.connection.execute(
+                    'CREATE TABLE IF NOT EXISTS runs ('
+                    'path TEXT PRIMARY KEY, cfg_mtime REAL, '
+                    'overrides_mtime REAL, cfg TEXT, overrides TEXT, '
+                    'artifacts TEXT)')
+
+    def close(self):
+        self.connection.close()
+
+    def _list_dir(self, path):
+        mtime = _get_mtime(path)
+        if mtime is None or not os.path.isdir(path):
+            return None
+        row = self.connection.execute(
+                'SELECT mtime, subdirs, files FROM dirs WHERE path = ?',
+                (path,)).fetchone()
+        if row is not None and row[0] == mtime:
+            return json.loads(row[1]), json.loads(row[2])
+        subdirs, files = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                (subdirs if entry.is_dir() else files).append(entry.name)
+        subdirs.sort()
+        files.sort()
+        self.connection.execute(
+                'INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                (path, mtime, json.dumps(subdirs), json.dumps(files)))
+        return subdirs, files
+
+    def _update_run(self, path):
+        cfg_filename = os.path.join(path, '.hydra', 'config.yaml')
+        overrides_filename = os.path.join(path, '.hydra', 'overrides.yaml')
+        cfg_mtime = _get_mtime(cfg_filename)
+        overrides_mtime = _get_mtime(overrides_filename)
+        if cfg_mtime is None:
+            self.connection.execute('DELETE FROM runs WHERE path = ?', (path,))
+            return
+        row = self.connection.execute(
+                'SELECT cfg_mtime, overrides_mtime FROM runs WHERE path = ?',
+                (path,)).fetchone()
+        if row is not None and tuple(row) == (cfg_mtime, overrides_mtime):
+            return
+        cfg = OmegaConf.load(cfg_filename)
+        overrides = None
+        if overrides_mtime is not None:
+            with open(overrides_filename, 'r') as f:
+                overrides = yaml.load(f, Loader=yaml.FullLoader)
+        artifacts = {name: os.path.join(path, cfg[key], filename)
+                     for name, (key, filename) in ARTIFACTS.items()
+                     if cfg.get(key) is not None}
+        self.connection.execute(
+                'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)',
+                (path, cfg_mtime, overrides_mtime,
+                 json.dumps(OmegaConf.to_container(cfg, resolve=False)),
+                 json.dumps(overrides), json.dumps(artifacts)))
+
+    def _get_run(self, run_path):
+        run_path = os.path.abspath(run_path)
+        with self.connection:
+            self._update_run(run_path)
+        row = self.connection.execute(
+                'SELECT cfg, overrides, artifacts FROM runs WHERE path = ?',
+                (run_path,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(
+                    'No hydra run at path "{}"'.format(run_path))
+        return row
+
+    def _select_below(self, table, columns, base_paths):
+        rows = []
+        for base_path in base_paths:
+            base_path = os.path.abspath(base_path)
+            prefix = os.path.join(base_path, '')
+            rows += self.connection.execute(
+                    'SELECT {} FROM {} WHERE path = ? OR '
+                    'substr(path, 1, ?) = ?'.format(', '.join(columns), table),
+                    (base_path, len(prefix), prefix)).fetchall()
+        return rows
+
+    def refresh(self, base_paths):
+        """
+        Update the index for all runs and directories below `base_paths`
+        (including entries for runs and directories that were removed).
+
+        Parameters
+        ----------
+        base_paths : str or list of str
+            Base path(s).
+        """
+        if isinstance(base_paths, str):
+            base_paths = [base_paths]
+        base_paths = [os.path.abspath(base_path) for base_path in base_paths]
+        with self.connection:
+            found = set()
+            stack = list(base_paths)
+            while stack:
+                path = stack.pop()
+                listing = self._list_dir(path)
+                if listing is None:
+                    continue
+                found.add(path)
+                subdirs, _ = listing
+                if '.hydra' in subdirs:
+                    self._update_run(path)
+                stack += [os.path.join(path, d) for d in subdirs]
+            for (path,) in self._select_below('dirs', ['path'], base_paths):
+                if path not in found:
+                    self.connection.execute(
+                            'DELETE FROM dirs WHERE path = ?', (path,))
+                    self.connection.execute(
+                            'DELETE FROM runs WHERE path = ?', (path,))
+            for (path,) in self._select_below('runs', ['path'], base_paths):
+                if not os.path.join(path, '.hydra') in found:
+                    self.connection.execute(
+                            'DELETE FROM runs WHERE path = ?', (path,))
+
+    def find_runs(self, base_paths, filters=None):
+        """
+        Return the indexed runs below `base_paths`, see :meth:`refresh`.
+
+        Parameters
+        ----------
+        base_paths : str or list of str
+            Base path(s).
+        filters : dict, optional
+            Config values the runs must have, with dot-separated keys, e.g.
+            ``{'mdl.optim.gamma': 1e-4}``.
+
+        Returns
+        -------
+        run_paths : list of str
+            Sorted paths of the runs.
+        """
+        if isinstance(base_paths, str):
+            base_paths = [base_paths]
+        run_paths = []
+        for path, cfg in self._select_below('runs', ['path', 'cfg'],
+                                            base_paths):
+            if filters:
+                cfg = OmegaConf.create(json.loads(cfg))
+                if any(OmegaConf.select(cfg, k) != v
+                       for k, v in filters.items()):
+                    continue
+            run_paths.append(path)
+        return sorted(set(run_paths))
+
+    def get_checkpoints(self, base_paths, exclude_re=None):
+        """
+        Return the checkpoints (``.pt`` files) in the indexed directories below
+        `base_paths`, see :meth:`refresh`.
+
+        Parameters
+        ----------
+        base_paths : str or list of str
+            Base path(s).
+        exclude_re : str, optional
+            Regular expression for filenames to exclude.
+
+        Returns
+        -------
+        checkpoints : dict
+            Sorted filenames of the checkpoints, with the (sorted) directory
+            paths as keys. Directories without checkpoints are omitted.
+        """
+        if isinstance(base_paths, str):
+            base_paths = [base_paths]
+        checkpoints = {}
+        for path, files in self._select_below('dirs', ['path', 'files'],
+                                              base_paths):
+            filenames = sorted(
+                    f for f in json.loads(files) if f.endswith('.pt') and (
+                            exclude_re is None or
+                            not re.fullmatch(exclude_re, f)))
+            if filenames:
+                checkpoints[path] = filenames
+        return dict(sorted(checkpoints.items()))
+
+    def get_cfg(self, run_path):
+        """
+        Return the config of a run (like ``.hydra/config.yaml``).
+        """
+        cfg, _, _ = self._get_run(run_path)
+        return OmegaConf.create(json.loads(cfg))
+
+    def get_overrides(self, run_path):
+        """
+        Return the overrides of a run (like ``.hydra/overrides.yaml``), or
+        `None` if the run has no overrides file.
+        """
+        _, overrides, _ = self._get_run(run_path)
+        return json.loads(overrides)
+
+    def get_experiment_name(self, run_path):
+        """
+        Return the value of the ``+experiment`` override of a run.
+        """
+        overrides = self.get_overrides(run_path) or []
+        experiment_override = next(
+                (ov for ov in overrides if ov.startswith('+experiment=')),
+                None)
+        return experiment_override.split('=')[1]
+
+    def get_artifacts(self, run_path):
+        """
+        Return the paths of the artifacts of a run that exist.
+
+        Returns
+        -------
+        artifacts : dict
+            Paths of the artifacts, with the keys `'recos'`, `'histories'`
+            and `'iterates'` (if the respective files exist), and
+            `'checkpoints'` (list of paths of the ``.pt`` files in the
+            indexed directories of the run).
+        """
+        _, _, artifacts = self._get_run(run_path)
+        artifacts = {name: path for name, path in json.loads(artifacts).items()
+                     if os.path.isfile(path)}
+        artifacts['checkpoints'] = [
+                os.path.join(path, filename) for path, filenames in
+                self.get_checkpoints(os.path.abspath(run_path)).items()
+                for filename in filenames]
+        return artifacts
+
+def get_run_index(filename=None):
+    """
+    Return the :class:`RunIndex` used by the evaluation scripts.
+
+    Parameters
+    ----------
+    filename : str, optional
+        SQLite database file. By default, the environment variable
+        ``RUN_INDEX_FILENAME`` is used if set, and `DEFAULT_RUN_INDEX_FILENAME`
+        otherwise.
+    """
+    if filename is None:
+        filename = os.environ.get('RUN_INDEX_FILENAME',
+                                  DEFAULT_RUN_INDEX_FILENAME)
+    return RunIndex(filename)
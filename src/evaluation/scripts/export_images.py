@@ -9,6 +9,7 @@ import imageio
 import matplotlib.pyplot as plt
 from matplotlib.colors import Normalize
 from matplotlib.cm import get_cmap, ScalarMappable
+from evaluation.run_index import get_run_index
 from evaluation.utils import (
         get_multirun_cfgs, get_multirun_experiment_names,
         get_multirun_reconstructions, get_multirun_iterates, uses_swa_weights)
@@ -17,6 +18,8 @@ from deep_image_prior import DeepImagePriorReconstructor, PSNR, SSIM
 from torch.cuda.amp import autocast
 
 PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# see `get_run_index` for the location of the database file
+RUN_INDEX = get_run_index()
 CONFIG_PATH = os.path.join('..', '..', 'cfgs')
 
 OUTPUT_PATH = os.path.join(os.path.dirname(__file__), 'images')
@@ -208,18 +211,23 @@ for run_spec in runs_to_export:
                          '`runs.yaml`.'.format(data, experiment))
 
     run_path_multirun = os.path.join(PATH, run['run_path'])
+    RUN_INDEX.refresh(run_path_multirun)
     sub_runs = run_spec.get('sub_runs')
     export_iterates = run_spec.get('export_iterates')
 
     cfgs = get_multirun_cfgs(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     experiment_names = get_multirun_experiment_names(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     reconstructions = get_multirun_reconstructions(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     if export_iterates:
         saved_iterates_list, saved_iterates_iters_list = get_multirun_iterates(
-                run_path_multirun, sub_runs=sub_runs)
+                run_path_multirun, sub_runs=sub_runs,
+                run_index=RUN_INDEX)
         iterates_list = []
         iterates_iters_list = []
         for saved_iterates, saved_iterates_iters in zip(
@@ -7,6 +7,7 @@ import numpy as np
 import torch
 from torch.utils.data import DataLoader
 import yaml
+from evaluation.run_index import get_run_index
 from evaluation.utils import (
         get_multirun_cfgs, get_multirun_experiment_names, uses_swa_weights)
 from dataset import get_standard_dataset
@@ -14,6 +15,8 @@ from deep_image_prior import DeepImagePriorReconstructor, PSNR, SSIM
 from torch.cuda.amp import autocast
 
 PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# see `get_run_index` for the location of the database file
+RUN_INDEX = get_run_index()
 CONFIG_PATH = os.path.join('..', '..', 'cfgs')
 
 OUTPUT_PATH = os.path.join(os.path.dirname(__file__), 'images')
@@ -99,12 +102,15 @@ if run.get('run_path') is None:
                         '`runs.yaml`.'.format(data, experiment))
 
 run_path_multirun = os.path.join(PATH, run['run_path'])
+RUN_INDEX.refresh(run_path_multirun)
 sub_runs = run_spec.get('sub_runs')
 
 cfgs = get_multirun_cfgs(
-        run_path_multirun, sub_runs=sub_runs)
+        run_path_multirun, sub_runs=sub_runs,
+        run_index=RUN_INDEX)
 experiment_names = get_multirun_experiment_names(
-        run_path_multirun, sub_runs=sub_runs)
+        run_path_multirun, sub_runs=sub_runs,
+        run_index=RUN_INDEX)
 if len(cfgs) == 0:
     raise RuntimeError('No runs found at path "{}", aborting.'.format(
             run_path_multirun))
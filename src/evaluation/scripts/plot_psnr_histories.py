@@ -3,6 +3,8 @@ import json
 from warnings import warn
 import numpy as np
 import yaml
+from evaluation.run_index import get_run_index
+from evaluation.history_store import HistoryStore
 from evaluation.utils import (
         get_multirun_cfgs, get_multirun_experiment_names,
         get_multirun_histories, uses_swa_weights)
@@ -19,6 +21,13 @@ from matplotlib.patches import Rectangle
 # PATH = '/media/chen/Res/deep_image_prior_extension/'
 # PATH = '/localdata/jleuschn/experiments/deep_image_prior_extension/'
 PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# see `get_run_index` for the location of the database file
+RUN_INDEX = get_run_index()
+# store written with `save_histories_store_filename`, or None to load the
+# histories.npz file of each run
+HISTORY_STORE_FILENAME = None
+HISTORY_STORE = (HistoryStore(HISTORY_STORE_FILENAME)
+                 if HISTORY_STORE_FILENAME is not None else None)
 TVADAM_PSNRS_FILEPATH = os.path.join(
         os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
         'baselines', 'tvadam_psnrs.yaml')
@@ -1275,14 +1284,19 @@ for run_spec in runs_to_compare:
                          '`runs.yaml`.'.format(data, experiment))
 
     run_path_multirun = os.path.join(PATH, run['run_path'])
+    RUN_INDEX.refresh(run_path_multirun)
     sub_runs = run_spec.get('sub_runs')
 
     cfgs = get_multirun_cfgs(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     experiment_names = get_multirun_experiment_names(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     histories = get_multirun_histories(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX,
+            history_store=HISTORY_STORE)
     if len(cfgs) == 0:
         warn('No runs found at path "{}", skipping.'.format(run_path_multirun))
         continue
@@ -2,6 +2,7 @@ import os
 from warnings import warn
 import numpy as np
 import yaml
+from evaluation.run_index import get_run_index
 from evaluation.utils import (
         get_multirun_cfgs, get_multirun_experiment_names,
         get_multirun_histories, get_run_cfg)
@@ -12,6 +13,8 @@ import matplotlib.pyplot as plt
 # PATH = '/media/chen/Res/deep_image_prior_extension/'
 # PATH = '/localdata/jleuschn/experiments/deep_image_prior_extension/'
 PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# see `get_run_index` for the location of the database file
+RUN_INDEX = get_run_index()
 
 FIG_PATH = '.'
 
@@ -240,14 +243,18 @@ for run_spec in runs_to_combine:
                          '`runs.yaml`.'.format(data, experiment))
 
     run_path_multirun = os.path.join(PATH, run['run_path'])
+    RUN_INDEX.refresh(run_path_multirun)
     sub_runs = run_spec.get('sub_runs')
 
     cur_cfgs = get_multirun_cfgs(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     cur_experiment_names = get_multirun_experiment_names(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     cur_histories = get_multirun_histories(
-            run_path_multirun, sub_runs=sub_runs)
+            run_path_multirun, sub_runs=sub_runs,
+            run_index=RUN_INDEX)
     cur_num_runs = len(cur_cfgs)
     if cur_num_runs == 0:
         warn('No runs found at path "{}", skipping.'.format(run_path_multirun))
@@ -288,8 +295,10 @@ for run_spec in runs_to_combine:
             iterations = cur_cfgs[0].mdl.optim.iterations
             assert all((cfg.mdl.optim.iterations == iterations
                         for cfg in cur_cfgs))
+            RUN_INDEX.refresh(os.path.join(PATH, select_gamma_run_path))
             select_gamma_cfg = get_run_cfg(
-                    os.path.join(PATH, select_gamma_run_path))
+                    os.path.join(PATH, select_gamma_run_path),
+                    run_index=RUN_INDEX)
             select_gamma_cfg_psnr_steady_range = range(iterations)[
                     select_gamma_cfg.val.psnr_steady_start:
                     select_gamma_cfg.val.psnr_steady_stop]
@@ -5,6 +5,7 @@ import numpy as np
 import yaml
 from omegaconf import OmegaConf
 from dataset import get_validation_data
+from evaluation.run_index import get_run_index
 from evaluation.utils import get_run_cfg, get_run_experiment_name
 from evaluation.display_utils import (
         get_data_title_full, get_title_from_run_spec)
@@ -20,6 +21,8 @@ from matplotlib.patches import Rectangle
 # PATH = '/media/chen/Res/deep_image_prior_extension/'
 # PATH = '/localdata/jleuschn/experiments/deep_image_prior_extension/'
 PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# see `get_run_index` for the location of the database file
+RUN_INDEX = get_run_index()
 
 FIG_PATH = os.path.dirname(__file__)
 
@@ -150,8 +153,9 @@ if run.get('single_run_path') is None:
                      'insert it in `runs.yaml`.'.format(data, experiment))
 
 run_path = os.path.join(PATH, run['single_run_path'])
+RUN_INDEX.refresh(run_path)
 
-cfg = get_run_cfg(run_path)
+cfg = get_run_cfg(run_path, run_index=RUN_INDEX)
 
 # # one may need to adapt some absolute paths manually here
 # cfg.data.geometry_specs.ray_trafo_filename = '/localdata/data/FIPS_Lotus/LotusData128.mat'
@@ -188,8 +192,9 @@ max_psnr_steady = np.max(list(psnrs_steady.values()))
 zorder_list = plot_settings_dict[data].get(
         'zorder_list', [1.5 for _ in val_run_paths])
 
-baseline_cfg = get_run_cfg(cfg.val.baseline_run_path)
-baseline_experiment_name = get_run_experiment_name(cfg.val.baseline_run_path)
+RUN_INDEX.refresh(cfg.val.baseline_run_path)
+baseline_cfg = get_run_cfg(cfg.val.baseline_run_path, run_index=RUN_INDEX)
+baseline_experiment_name = get_run_experiment_name(cfg.val.baseline_run_path, run_index=RUN_INDEX)
 
 # update configs to load the saved histories from the run path
 # (or from the originally specified load path if any)
@@ -3,6 +3,7 @@ import yaml
 from warnings import warn
 import numpy as np
 from tqdm import tqdm
+from evaluation.run_index import get_run_index
 from evaluation.utils import (
         get_multirun_cfgs, get_multirun_experiment_names,
         get_run_cfg, get_run_experiment_name,
@@ -31,6 +32,8 @@ from matplotlib.patches import Rectangle
 # PATH = '/media/chen/Res/deep_image_prior_extension/'
 # PATH = '/localdata/jleuschn/experiments/deep_image_prior_extension/'
 PATH = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+# see `get_run_index` for the location of the database file
+RUN_INDEX = get_run_index()
 
 NPZ_CACHE_PATH = os.path.join(os.path.dirname(__file__), 'trn_logs_npz_cache')
 
@@ -177,21 +180,25 @@ for run_spec in runs_to_compare:
     run_path_single_run = None
     if run.get('run_path') is not None:
         run_path_multirun = os.path.join(PATH, run['run_path'])
+        RUN_INDEX.refresh(run_path_multirun)
         sub_runs = run_spec.get('sub_runs')
 
         cfgs = get_multirun_cfgs(
-                run_path_multirun, sub_runs=sub_runs)
+                run_path_multirun, sub_runs=sub_runs,
+                run_index=RUN_INDEX)
         experiment_names = get_multirun_experiment_names(
-                run_path_multirun, sub_runs=sub_runs)
+                run_path_multirun, sub_runs=sub_runs,
+                run_index=RUN_INDEX)
         trn_log_paths = [
                 os.path.join(run_path_multirun, '{:d}'.format(sub_runs[i] if sub_runs is not None else i),
                             cfg['trn']['log_path'])
                 for i, cfg in enumerate(cfgs)]
     else:
         run_path_single_run = os.path.join(PATH, run['single_run_path'])
+        RUN_INDEX.refresh(run_path_single_run)
 
-        cfgs = [get_run_cfg(run_path_single_run)]
-        experiment_names = [get_run_experiment_name(run_path_single_run)]
+        cfgs = [get_run_cfg(run_path_single_run, run_index=RUN_INDEX)]
+        experiment_names = [get_run_experiment_name(run_path_single_run, run_index=RUN_INDEX)]
         trn_log_paths = [
                 os.path.join(run_path_single_run, cfgs[0]['trn']['log_path'])]
 
@@ -1,5 +1,13 @@
 """
 Utility functions for accessing the results of the hydra runs.
+
+All functions accept an optional :class:`evaluation.run_index.RunIndex`
+(argument `run_index`), from which the configs, overrides and artifact paths
+are looked up instead of parsing the ``.hydra`` files of each run.
+The history accessors accept an optional
+:class:`evaluation.history_store.HistoryStore` (argument `history_store`),
+from which the histories of the runs it contains (with ``run_id`` being the
+absolute run path) are read instead of the ``histories.npz`` files.
 """
 import os
 import yaml
@@ -7,11 +15,15 @@ from omegaconf import OmegaConf
 import h5py
 import numpy as np
 
-def get_run_cfg(run_path):
+def get_run_cfg(run_path, run_index=None):
+    if run_index is not None:
+        return run_index.get_cfg(run_path)
     cfg = OmegaConf.load(os.path.join(run_path, '.hydra', 'config.yaml'))
     return cfg
 
-def get_run_experiment_name(run_path):
+def get_run_experiment_name(run_path, run_index=None):
+    if run_index is not None:
+        return run_index.get_experiment_name(run_path)
     with open(os.path.join(run_path, '.hydra', 'overrides.yaml'), 'r') as f:
         overrides = yaml.load(f, Loader=yaml.FullLoader)
         experiment_override = next(
@@ -21,28 +33,44 @@ def get_run_experiment_name(run_path):
 
     return experiment_name
 
-def get_run_reconstruction(run_path):
-    cfg = get_run_cfg(run_path)
+def get_run_reconstruction(run_path, run_index=None):
+    if run_index is not None:
+        filename = run_index.get_artifacts(run_path)['recos']
+    else:
+        cfg = get_run_cfg(run_path)
+        filename = os.path.join(
+                run_path, cfg['save_reconstruction_path'], 'recos.hdf5')
 
-    with h5py.File(os.path.join(
-            run_path, cfg['save_reconstruction_path'], 'recos.hdf5'), 'r') as f:
+    with h5py.File(filename, 'r') as f:
         recos = np.asarray(f['recos'])
 
     return recos
 
-def get_run_histories(run_path):
-    cfg = get_run_cfg(run_path)
+def get_run_histories(run_path, run_index=None, history_store=None):
+    if (history_store is not None and
+            history_store.has(os.path.abspath(run_path))):
+        return history_store.get_histories(os.path.abspath(run_path))
+
+    if run_index is not None:
+        filename = run_index.get_artifacts(run_path)['histories']
+    else:
+        cfg = get_run_cfg(run_path)
+        filename = os.path.join(
+                run_path, cfg['save_histories_path'], 'histories.npz')
 
-    histories = np.load(os.path.join(
-            run_path, cfg['save_histories_path'], 'histories.npz'))
+    histories = np.load(filename)
 
     return histories
 
-def get_run_iterates(run_path):
-    cfg = get_run_cfg(run_path)
+def get_run_iterates(run_path, run_index=None):
+    if run_index is not None:
+        filename = run_index.get_artifacts(run_path)['iterates']
+    else:
+        cfg = get_run_cfg(run_path)
+        filename = os.path.join(
+                run_path, cfg['save_iterates_path'], 'iterates.npz')
 
-    iterates_dict = np.load(os.path.join(
-            run_path, cfg['save_iterates_path'], 'iterates.npz'))
+    iterates_dict = np.load(filename)
     iterates = iterates_dict['iterates']
     iterates_iters = iterates_dict['iterates_iters']
 
@@ -55,62 +83,72 @@ def get_multirun_num_runs(run_path_multirun):
         num_runs += 1
     return num_runs
 
-def get_multirun_cfgs(run_path_multirun, sub_runs=None):
+def get_multirun_cfgs(run_path_multirun, sub_runs=None, run_index=None):
     if sub_runs is None:
         sub_runs = range(get_multirun_num_runs(run_path_multirun))
 
     cfgs = [get_run_cfg(os.path.join(run_path_multirun,
-                                     '{:d}'.format(i)))
+                                     '{:d}'.format(i)),
+                        run_index=run_index)
             for i in sub_runs]
 
     return cfgs
 
-def get_multirun_experiment_names(run_path_multirun, sub_runs=None):
+def get_multirun_experiment_names(run_path_multirun, sub_runs=None, run_index=None):
     if sub_runs is None:
         sub_runs = range(get_multirun_num_runs(run_path_multirun))
 
     experiment_names = [get_run_experiment_name(os.path.join(run_path_multirun,
-                                                             '{:d}'.format(i)))
+                                                             '{:d}'.format(i)),
+                                                run_index=run_index)
                         for i in sub_runs]
 
     return experiment_names
 
-def get_multirun_reconstructions(run_path_multirun, sub_runs=None):
+def get_multirun_reconstructions(run_path_multirun, sub_runs=None, run_index=None):
     if sub_runs is None:
         sub_runs = range(get_multirun_num_runs(run_path_multirun))
 
-    cfgs = get_multirun_cfgs(run_path_multirun, sub_runs=sub_runs)
+    cfgs = get_multirun_cfgs(run_path_multirun, sub_runs=sub_runs,
+                             run_index=run_index)
     assert len(sub_runs) == len(cfgs)
 
     recos_list = [get_run_reconstruction(os.path.join(run_path_multirun,
-                                                      '{:d}'.format(i)))
+                                                      '{:d}'.format(i)),
+                                         run_index=run_index)
                   for i in sub_runs]
 
     return recos_list
 
-def get_multirun_histories(run_path_multirun, sub_runs=None):
+def get_multirun_histories(run_path_multirun, sub_runs=None, run_index=None,
+                           history_store=None):
     if sub_runs is None:
         sub_runs = range(get_multirun_num_runs(run_path_multirun))
 
-    cfgs = get_multirun_cfgs(run_path_multirun, sub_runs=sub_runs)
+    cfgs = get_multirun_cfgs(run_path_multirun, sub_runs=sub_runs,
+                             run_index=run_index)
     assert len(sub_runs) == len(cfgs)
 
     histories_list = [get_run_histories(os.path.join(run_path_multirun,
-                                                     '{:d}'.format(i)))
+                                                     '{:d}'.format(i)),
+                                        run_index=run_index,
+                                        history_store=history_store)
                       for i, cfg in zip(sub_runs, cfgs)]
 
     return histories_list
 
-def get_multirun_iterates(run_path_multirun, sub_runs=None):
+def get_multirun_iterates(run_path_multirun, sub_runs=None, run_index=None):
     if sub_runs is None:
         sub_runs = range(get_multirun_num_runs(run_path_multirun))
 
-    cfgs = get_multirun_cfgs(run_path_multirun, sub_runs=sub_runs)
+    cfgs = get_multirun_cfgs(run_path_multirun, sub_runs=sub_runs,
+                             run_index=run_index)
     assert len(sub_runs) == len(cfgs)
 
     iterates_list, iterates_iters_list = zip(
             *[get_run_iterates(os.path.join(run_path_multirun,
-                                            '{:d}'.format(i)))
+                                            '{:d}'.format(i)),
+                               run_index=run_index)
               for i, cfg in zip(sub_runs, cfgs)])
     iterates_list = list(iterates_list)
     iterates_iters_list = list(iterates_iters_list)
@@ -0,0 +1,137 @@
+"""
+Measure the training throughput (samples per second) of the adversarial
+training modes of :class:`pre_training.Trainer` on a batch of the standard
+dataset, compared to training without attacks:
+
+    ``none``          plain training step
+    ``pgd``           PGD attack with ``trn.adversarial_attacks.steps`` steps
+    ``pgd_early``     PGD attack with early termination (``early_stop_tol``)
+    ``free``          free adversarial training, each batch is replayed
+                      ``trn.adversarial_attacks.free_replays`` times
+
+Each attack mode is run with the ODL FBP module and, if available (matrix
+implementation), with the torch FBP module.
+
+Since free adversarial training runs ``trn.epochs / free_replays`` epochs
+(see :attr:`pre_training.Trainer.num_epochs`), the throughput is also
+reported relative to the epoch budget (``budget samples/s``, i.e. the
+samples per second multiplied by the number of replays), which determines
+the training time for a fixed ``trn.epochs``.
+
+Example:
+
+    python examples/benchmark_adversarial_training.py data=standard_ellipses_lotus_20 +benchmark.num_batches=10
+"""
+import time
+import json
+from itertools import islice
+from copy import deepcopy
+import hydra
+import numpy as np
+import torch
+from omegaconf import DictConfig
+from dataset import get_standard_dataset
+from deep_image_prior import DeepImagePriorReconstructor
+from pre_training.adversarial_attacks import PGDAttack, FreeAttack
+
+def get_batch(dataset, batch_size, device):
+    obs, fbp, gt = zip(*islice(dataset.generator('train'), batch_size))
+    to_tensor = lambda x: torch.from_numpy(
+            np.stack([np.asarray(a) for a in x])[:, None]).float().to(device)
+    return to_tensor(obs), to_tensor(fbp), to_tensor(gt)
+
+def train_steps(model, optimizer, fbp, gt, criterion, num_replays=1,
+                attack=None, obs=None):
+    for _ in range(num_replays):
+        if isinstance(attack, FreeAttack):
+            fbp = attack.perturb(obs)
+        optimizer.zero_grad()
+        loss = criterion(model(fbp), gt)
+        loss.backward()
+        if isinstance(attack, FreeAttack):
+            attack.step()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1)
+        optimizer.step()
+
+@hydra.main(config_path='../cfgs', config_name='config')
+def coordinator(cfg : DictConfig) -> None:
+    benchmark_cfg = cfg.get('benchmark', {})
+    num_batches = benchmark_cfg.get('num_batches', 10)
+    adv_cfg = cfg.trn.adversarial_attacks
+    early_stop_tol = adv_cfg.get('early_stop_tol') or 1e-3
+
+    dataset, ray_trafos = get_standard_dataset(cfg.data.name, cfg.data)
+    reconstructor = DeepImagePriorReconstructor(
+            ray_trafos['ray_trafo_module'], reco_space=dataset.space[1],
+            observation_space=dataset.space[0], cfg=cfg.mdl)
+    device = reconstructor.device
+    obs, fbp, gt = get_batch(dataset, cfg.trn.batch_size, device)
+    criterion = torch.nn.MSELoss()
+
+    fbp_modes = ['odl']
+    if ray_trafos.get('torch_smooth_pinv_ray_trafo_module') is not None:
+        fbp_modes.append('torch')
+    variants = [('none', None)]
+    for fbp_mode in fbp_modes:
+        variants += [('pgd', fbp_mode), ('pgd_early', fbp_mode),
+                     ('free', fbp_mode)]
+
+    results = []
+    for mode, fbp_mode in variants:
+        model = deepcopy(reconstructor.model).to(device)
+        model.train()
+        optimizer = torch.optim.Adam(model.parameters(), lr=cfg.trn.lr)
+        attack = None
+        if mode in ['pgd', 'pgd_early']:
+            attack = PGDAttack(
+                    model=model, ray_trafos=ray_trafos, steps=adv_cfg.steps,
+                    eps=adv_cfg.eps, alpha=adv_cfg.alpha, fbp_mode=fbp_mode,
+                    early_stop_tol=(early_stop_tol if mode == 'pgd_early'
+                                    else None))
+        elif mode == 'free':
+            attack = FreeAttack(
+                    model=model, ray_trafos=ray_trafos, eps=adv_cfg.eps,
+                    alpha=adv_cfg.alpha, fbp_mode=fbp_mode)
+        num_replays = adv_cfg.free_replays if mode == 'free' else 1
+
+        num_attack_steps = []
+        for i in range(num_batches + 1):  # first batch for warm-up
+            if i == 1:
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+            adv_fbp = fbp
+            if isinstance(attack, PGDAttack):
+                adv_fbp, costs = attack(obs, gt)
+                num_attack_steps.append(len(costs))
+            train_steps(model, optimizer, adv_fbp, gt, criterion,
+                        num_replays=num_replays, attack=attack, obs=obs)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        duration = time.perf_counter() - start
+        results.append({
+                'mode': mode, 'fbp_mode': fbp_mode,
+                'samples_per_sec': num_batches * cfg.trn.batch_size / duration,
+                'budget_samples_per_sec': (
+                        num_replays * num_batches * cfg.trn.batch_size /
+                        duration),
+                'param_updates_per_batch': num_replays,
+                'mean_attack_steps': (float(np.mean(num_attack_steps))
+                                      if num_attack_steps else 0.)})
+
+    reference = results[0]['samples_per_sec']
+    print('{:>10s} {:>8s} {:>12s} {:>9s} {:>18s} {:>14s} {:>12s}'.format(
+            'mode', 'fbp', 'samples/s', 'relative', 'budget samples/s',
+            'updates/batch', 'attack steps'))
+    for r in results:
+        print('{:>10s} {:>8s} {:12.3f} {:9.3f} {:18.3f} {:14d} {:12.1f}'.format(
+                r['mode'], str(r['fbp_mode']), r['samples_per_sec'],
+                r['samples_per_sec'] / reference,
+                r['budget_samples_per_sec'],
+                r['param_updates_per_batch'], r['mean_attack_steps']))
+    with open('benchmark_adversarial_training_{}.json'.format(
+            cfg.data.name), 'w') as f:
+        json.dump(results, f, indent=1)
+
+if __name__ == '__main__':
+    coordinator()
@@ -0,0 +1,72 @@
+"""
+Measure the per-step overhead of tensorboard logging in the training loop,
+comparing :class:`util.async_logging.LoggingService` in synchronous mode
+(equivalent to using :class:`tensorboardX.SummaryWriter` directly) and in
+asynchronous mode.
+
+Each step logs three scalars (like :class:`pre_training.Trainer`), every
+``--image_interval`` steps an image and every ``--figure_interval`` steps the
+adversarial output figure of :meth:`pre_training.Trainer.log_adversarial`.
+The reported time is the time spent in the logging calls (the time for
+closing, i.e. writing the remaining logs, is reported separately).
+
+Example:
+
+    python examples/benchmark_logging.py --num_steps 5000
+"""
+import time
+import json
+import argparse
+import tempfile
+import torch
+from util.async_logging import LoggingService
+from pre_training.trainer import _render_adversarial_output
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_steps', type=int, default=5000)
+parser.add_argument('--image_interval', type=int, default=1000)
+parser.add_argument('--figure_interval', type=int, default=500)
+parser.add_argument('--im_size', type=int, default=128)
+parser.add_argument('--output', type=str, default=None,
+                    help='optional json file to store the results')
+
+def run_benchmark(asynchronous, args):
+    image = torch.rand(1, args.im_size, args.im_size)
+    with tempfile.TemporaryDirectory() as logdir:
+        writer = LoggingService(logdir=logdir, asynchronous=asynchronous)
+        duration = 0.
+        for i in range(args.num_steps):
+            start = time.perf_counter()
+            writer.add_scalar('loss', 0.1, i)
+            writer.add_scalar('psnr', 30., i)
+            writer.add_scalar('lr', 1e-4, i)
+            if i % args.image_interval == 0:
+                writer.add_image('reco', image, i)
+            if i % args.figure_interval == 0:
+                writer.add_figure(
+                        'adversarial_output', _render_adversarial_output,
+                        {'adv_output': image, 'orig_output': image,
+                         'gt': image},
+                        i, figsize=(24, 3.5))
+            duration += time.perf_counter() - start
+        start = time.perf_counter()
+        writer.close()
+        close_duration = time.perf_counter() - start
+    return {'asynchronous': asynchronous,
+            'us_per_step': 1e6 * duration / args.num_steps,
+            'close_sec': close_duration,
+            'num_dropped': writer.num_dropped}
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    results = [run_benchmark(asynchronous, args)
+               for asynchronous in [False, True]]
+    print('{:>12s} {:>12s} {:>10s} {:>10s}'.format(
+            'mode', 'us/step', 'close (s)', 'dropped'))
+    for r in results:
+        print('{:>12s} {:12.1f} {:10.3f} {:10d}'.format(
+                'async' if r['asynchronous'] else 'sync', r['us_per_step'],
+                r['close_sec'], r['num_dropped']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=1)
@@ -0,0 +1,121 @@
+"""
+Benchmark the meta-update modes of :class:`pre_training.MetaTrainer`
+(``'second_order'``, ``'first_order'``, ``'reptile'``) in terms of
+iterations per second and peak memory, using the default UNet architecture
+(``cfgs/mdl/model_white.yaml``) and random task batches.
+
+Each mode runs in a separate process, so that peak memory is measured
+independently: on cuda by :func:`torch.cuda.max_memory_allocated`, on CPU by
+the maximum resident set size of the process (which includes the memory of
+the python interpreter and libraries).
+
+Example:
+
+    python examples/benchmark_meta_update.py --num_iters 20 --im_size 128
+"""
+import os
+import json
+import time
+import resource
+import argparse
+import tempfile
+import torch
+import torch.multiprocessing as mp
+from omegaconf import OmegaConf
+from deep_image_prior.network import UNet
+from pre_training import MetaTrainer
+
+MDL_CFG_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'cfgs', 'mdl', 'model_white.yaml')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--modes', type=str, nargs='+',
+                    default=['second_order', 'first_order', 'reptile'])
+parser.add_argument('--num_iters', type=int, default=20)
+parser.add_argument('--num_warmup_iters', type=int, default=2)
+parser.add_argument('--num_tasks_per_iter', type=int, default=3)
+parser.add_argument('--num_inner_steps', type=int, default=1)
+parser.add_argument('--batch_size', type=int, default=4)
+parser.add_argument('--im_size', type=int, default=128)
+parser.add_argument('--device', type=str, default=None)
+parser.add_argument('--output', type=str, default=None,
+                    help='optional json file to store the results')
+
+def run_benchmark(mode, args, result_queue):
+    device = torch.device(args.device or (
+            'cuda:0' if torch.cuda.is_available() else 'cpu'))
+    arch = OmegaConf.load(MDL_CFG_PATH).arch
+    torch.manual_seed(1)
+    model = UNet(1, 1,
+                 channels=arch.channels[:arch.scales],
+                 skip_channels=arch.skip_channels[:arch.scales],
+                 use_sigmoid=arch.use_sigmoid,
+                 use_norm=arch.use_norm).to(device)
+    with tempfile.TemporaryDirectory() as log_path:
+        cfg = OmegaConf.create({
+            'log_path': log_path, 'lr': 1e-4, 'weight_decay': 1e-5,
+            'meta_trainer': {
+                'meta_update': mode,
+                'num_inner_steps': args.num_inner_steps,
+                'inner_loop_optim': {'lr': 1e-5}}})
+        trainer = MetaTrainer(model=model, cfg=cfg)
+        trainer.device = device
+        trainer.init_optimizer()
+        criterion = torch.nn.MSELoss()
+        shape = (args.batch_size, 1, args.im_size, args.im_size)
+        task_batches = [(torch.rand(shape, device=device),
+                         torch.rand(shape, device=device))
+                        for _ in range(args.num_tasks_per_iter)]
+
+        def sync():
+            if device.type == 'cuda':
+                torch.cuda.synchronize(device)
+
+        for _ in range(args.num_warmup_iters):
+            trainer.meta_update(task_batches, criterion)
+        sync()
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+        start = time.perf_counter()
+        for _ in range(args.num_iters):
+            trainer.meta_update(task_batches, criterion)
+        sync()
+        duration = time.perf_counter() - start
+        trainer.writer.close()
+
+    if device.type == 'cuda':
+        peak_memory_mb = torch.cuda.max_memory_allocated(device) / 2**20
+    else:
+        # ru_maxrss is in kilobytes on linux
+        peak_memory_mb = resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss / 2**10
+    result_queue.put({'mode': mode,
+                      'device': str(device),
+                      'iters_per_sec': args.num_iters / duration,
+                      'peak_memory_mb': peak_memory_mb})
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    ctx = mp.get_context('spawn')
+    results = []
+    for mode in args.modes:
+        result_queue = ctx.Queue()
+        p = ctx.Process(target=run_benchmark, args=(mode, args, result_queue))
+        p.start()
+        results.append(result_queue.get())
+        p.join()
+
+    reference = next((r for r in results if r['mode'] == 'second_order'),
+                     results[0])
+    print('{:>14s} {:>10s} {:>10s} {:>14s} {:>10s}'.format(
+            'mode', 'iters/s', 'speedup', 'peak mem (MB)', 'mem ratio'))
+    for r in results:
+        print('{:>14s} {:10.3f} {:10.2f} {:14.1f} {:10.2f}'.format(
+                r['mode'], r['iters_per_sec'],
+                r['iters_per_sec'] / reference['iters_per_sec'],
+                r['peak_memory_mb'],
+                r['peak_memory_mb'] / reference['peak_memory_mb']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=1)
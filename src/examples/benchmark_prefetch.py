@@ -0,0 +1,98 @@
+"""
+Measure the training steps per second of :class:`pre_training.Trainer`-like
+steps with and without :class:`pre_training.prefetch.DevicePrefetcher`
+(copying and augmenting the next batch in a side stream on cuda).
+
+Random pairs are served by a data loader with pinned memory, and the model is
+the default UNet (``cfgs/mdl/model_white.yaml``). Without a cuda device both
+variants are equivalent.
+
+Example:
+
+    python examples/benchmark_prefetch.py --num_steps 200 --im_size 128
+"""
+import os
+import json
+import time
+import argparse
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from omegaconf import OmegaConf
+from deep_image_prior.network import UNet
+from util.transforms import random_brightness_contrast
+from pre_training.prefetch import DevicePrefetcher
+
+MDL_CFG_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        'cfgs', 'mdl', 'model_white.yaml')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_steps', type=int, default=200)
+parser.add_argument('--num_warmup_steps', type=int, default=10)
+parser.add_argument('--batch_size', type=int, default=32)
+parser.add_argument('--im_size', type=int, default=128)
+parser.add_argument('--num_data_loader_workers', type=int, default=0)
+parser.add_argument('--device', type=str, default=None)
+parser.add_argument('--output', type=str, default=None,
+                    help='optional json file to store the results')
+
+def run_benchmark(use_side_stream, args, device):
+    arch = OmegaConf.load(MDL_CFG_PATH).arch
+    torch.manual_seed(1)
+    model = UNet(1, 1,
+                 channels=arch.channels[:arch.scales],
+                 skip_channels=arch.skip_channels[:arch.scales],
+                 use_sigmoid=arch.use_sigmoid,
+                 use_norm=arch.use_norm).to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    criterion = torch.nn.MSELoss()
+    num_samples = args.batch_size * (args.num_steps + args.num_warmup_steps)
+    shape = (num_samples, 1, args.im_size, args.im_size)
+    data_loader = DataLoader(
+            TensorDataset(torch.rand(shape), torch.rand(shape),
+                          torch.rand(shape)),
+            batch_size=args.batch_size, shuffle=True, pin_memory=True,
+            num_workers=args.num_data_loader_workers)
+    def apply_transforms(batch):
+        obs, fbp, gt = batch
+        fbp, gt = random_brightness_contrast([fbp, gt])
+        return obs, fbp, gt
+
+    prefetcher = DevicePrefetcher(data_loader, device,
+                                  transform=apply_transforms,
+                                  use_side_stream=use_side_stream)
+
+    def sync():
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+
+    for i, (_, fbp, gt) in enumerate(prefetcher):
+        if i == args.num_warmup_steps:
+            sync()
+            start = time.perf_counter()
+        optimizer.zero_grad()
+        loss = criterion(model(fbp), gt)
+        loss.backward()
+        torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1)
+        optimizer.step()
+        loss.item()  # synchronizes like the logging in the trainer
+    sync()
+    duration = time.perf_counter() - start
+    return {'use_side_stream': use_side_stream,
+            'device': str(device),
+            'steps_per_sec': args.num_steps / duration}
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    device = torch.device(args.device or (
+            'cuda:0' if torch.cuda.is_available() else 'cpu'))
+    results = [run_benchmark(use_side_stream, args, device)
+               for use_side_stream in [False, True]]
+    print('{:>12s} {:>10s} {:>10s}'.format('prefetch', 'steps/s', 'speedup'))
+    for r in results:
+        print('{:>12s} {:10.3f} {:10.2f}'.format(
+                str(r['use_side_stream']), r['steps_per_sec'],
+                r['steps_per_sec'] / results[0]['steps_per_sec']))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=1)
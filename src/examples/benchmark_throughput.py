@@ -0,0 +1,229 @@
+"""
+Benchmark the throughput (samples per second) of the pretraining pipeline
+stages for each data config in ``cfgs/data/``:
+
+    ``ground_truth_generation``   ground truth generator of the train fold
+    ``ray_trafo``                 forward operator (``ray_trafos['ray_trafo']``)
+    ``smooth_pinv_ray_trafo``     FBP (``ray_trafos['smooth_pinv_ray_trafo']``)
+    ``network_forward_backward``  network forward and backward pass with
+                                  ``trn.batch_size``
+    ``trainer``                   :meth:`pre_training.Trainer.train` for one
+                                  epoch of ``benchmark.num_batches`` batches
+                                  (including pair generation and validation
+                                  on a cached batch)
+
+Configs requiring ASTRA with CUDA or external data (paths that are not
+specified) are skipped, as are configs for which the dataset setup fails (the
+reason is stored in the results). Errors in the benchmarked stages are not
+caught.
+
+The results are written to a json file (``benchmark.output``). If a baseline
+file (``benchmark.baseline``, the output of a previous run) is specified,
+stages slower than ``(1 - benchmark.tolerance)`` times the baseline, as well
+as stages of the baseline without a current result (e.g. because the config
+was skipped), are reported as regressions, and the script exits with status 1.
+
+Example:
+
+    python examples/benchmark_throughput.py +experiment=pretrain +benchmark.baseline=benchmark_throughput_baseline.json
+    python examples/benchmark_throughput.py +experiment=pretrain '+benchmark.data_cfgs=[standard_ellipses_lotus_20]' +benchmark.stages=[network_forward_backward]
+"""
+import os
+import sys
+import json
+import time
+import glob
+import tempfile
+from copy import deepcopy
+from itertools import islice
+import hydra
+import odl
+import numpy as np
+import torch
+from hydra.utils import to_absolute_path
+from omegaconf import DictConfig, OmegaConf
+from dataset import get_standard_dataset
+from deep_image_prior import DeepImagePriorReconstructor
+from pre_training import Trainer
+
+CFGS_PATH = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cfgs')
+
+STAGES = ['ground_truth_generation', 'ray_trafo', 'smooth_pinv_ray_trafo',
+          'network_forward_backward', 'trainer']
+
+# config entries that need to point to external data
+EXTERNAL_DATA_KEYS = ['data_path', 'data_path_test',
+                      'geometry_specs.ray_trafo_filename']
+
+def get_skip_reason(data_cfg):
+    if data_cfg.geometry_specs.impl == 'astra_cuda':
+        if not (odl.tomo.ASTRA_CUDA_AVAILABLE and torch.cuda.is_available()):
+            return 'requires ASTRA with CUDA'
+    for key in EXTERNAL_DATA_KEYS:
+        if (OmegaConf.select(data_cfg, key, default='') is None and
+                not (key == 'geometry_specs.ray_trafo_filename' and
+                     data_cfg.geometry_specs.impl != 'matrix')):
+            return 'requires external data (data.{} is not specified)'.format(
+                    key)
+    return None
+
+def measure(func, num_samples, device=None):
+    """
+    Return the number of samples per second of ``func()``, which processes
+    `num_samples` samples.
+    """
+    if device is not None and device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    func()
+    if device is not None and device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return num_samples / (time.perf_counter() - start)
+
+def benchmark_data_cfg(cfg, dataset, ray_trafos, stages, num_samples,
+                       num_batches):
+    results = {}
+    if len(dataset.space[1].shape) == 3:
+        cfg.mdl = OmegaConf.merge(cfg.mdl, OmegaConf.load(
+                os.path.join(CFGS_PATH, 'mdl', 'model_white_3d.yaml')))
+    gts = []
+
+    def generate_ground_truth():
+        gt_gen = dataset.get_ground_truth_dataset().generator('train')
+        gts.extend(islice(gt_gen, num_samples))
+    # the ground truth is also needed by the operator stages
+    results['ground_truth_generation'] = measure(
+            generate_ground_truth, num_samples)
+    obs = []
+    if 'ray_trafo' in stages or 'smooth_pinv_ray_trafo' in stages:
+        results['ray_trafo'] = measure(
+                lambda: obs.extend(np.asarray(ray_trafos['ray_trafo'](gt))
+                                   for gt in gts), num_samples)
+    if 'smooth_pinv_ray_trafo' in stages:
+        results['smooth_pinv_ray_trafo'] = measure(
+                lambda: [ray_trafos['smooth_pinv_ray_trafo'](o) for o in obs],
+                num_samples)
+
+    if 'network_forward_backward' in stages:
+        reconstructor = DeepImagePriorReconstructor(
+                ray_trafos['ray_trafo_module'], reco_space=dataset.space[1],
+                observation_space=dataset.space[0], cfg=cfg.mdl)
+        model, device = reconstructor.model, reconstructor.device
+        model.train()
+        x = torch.rand((cfg.trn.batch_size, 1) + dataset.space[1].shape,
+                       device=device)
+
+        def forward_backward():
+            for _ in range(num_batches):
+                model.zero_grad()
+                torch.mean(model(x)**2).backward()
+        forward_backward()  # warm-up
+        results['network_forward_backward'] = measure(
+                forward_backward, num_batches * cfg.trn.batch_size,
+                device=device)
+
+    if 'trainer' in stages:
+        reconstructor = DeepImagePriorReconstructor(
+                ray_trafos['ray_trafo_module'], reco_space=dataset.space[1],
+                observation_space=dataset.space[0], cfg=cfg.mdl)
+        dataset.train_len = num_batches * cfg.trn.batch_size
+        with tempfile.TemporaryDirectory() as tmp_path:
+            trn_cfg = OmegaConf.merge(cfg.trn, {
+                    'epochs': 1, 'train_len': dataset.train_len,
+                    'validation_len': cfg.trn.batch_size,
+                    'perform_swa': False,
+                    'show_pbar': False, 'log_path': tmp_path,
+                    'checkpoint_path': None, 'resume': False,
+                    'save_best_learned_params_path': None,
+                    'save_learned_params_base_path': None,
+                    'save_swa_learned_params_path': None})
+            trainer = Trainer(model=reconstructor.model,
+                              ray_trafos=ray_trafos, cfg=trn_cfg)
+            results['trainer'] = measure(
+                    lambda: trainer.train(dataset), dataset.train_len,
+                    device=trainer.device)
+    return {stage: results[stage] for stage in stages if stage in results}
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Return the regressions ``(name, stage, samples_per_sec, reference)`` of
+    `results` compared to `baseline`. Stages of the baseline that are missing
+    in `results` are included with ``samples_per_sec=None``.
+    """
+    regressions = []
+    for name, baseline_entry in baseline.items():
+        entry = results.get(name, {})
+        for stage, reference in baseline_entry.get(
+                'samples_per_sec', {}).items():
+            samples_per_sec = entry.get('samples_per_sec', {}).get(stage)
+            if samples_per_sec is None or (
+                    samples_per_sec < (1. - tolerance) * reference):
+                regressions.append((name, stage, samples_per_sec, reference))
+    return regressions
+
+@hydra.main(config_path='../cfgs', config_name='config')
+def coordinator(cfg : DictConfig) -> None:
+    benchmark_cfg = cfg.get('benchmark', {})
+    stages = list(benchmark_cfg.get('stages') or STAGES)
+    num_samples = benchmark_cfg.get('num_samples', 32)
+    num_batches = benchmark_cfg.get('num_batches', 5)
+    tolerance = benchmark_cfg.get('tolerance', 0.1)
+    data_cfg_names = benchmark_cfg.get('data_cfgs') or sorted(
+            os.path.splitext(os.path.basename(p))[0]
+            for p in glob.glob(os.path.join(CFGS_PATH, 'data', '*.yaml')))
+
+    results = {}
+    for data_cfg_name in data_cfg_names:
+        data_cfg = OmegaConf.load(
+                os.path.join(CFGS_PATH, 'data', data_cfg_name + '.yaml'))
+        entry = {'data': data_cfg.name, 'device': (
+                'cuda' if torch.cuda.is_available() else 'cpu')}
+        skip_reason = get_skip_reason(data_cfg)
+        if skip_reason is None:
+            bench_cfg = deepcopy(cfg)
+            OmegaConf.set_struct(bench_cfg, False)
+            bench_cfg.data = data_cfg
+            try:
+                dataset, ray_trafos = get_standard_dataset(
+                        data_cfg.name, data_cfg)
+            except Exception as e:  # e.g. missing files or dependencies
+                skip_reason = 'setup failed: {}: {}'.format(
+                        type(e).__name__, e)
+            else:
+                entry['samples_per_sec'] = benchmark_data_cfg(
+                        bench_cfg, dataset, ray_trafos, stages, num_samples,
+                        num_batches)
+        if skip_reason is not None:
+            entry['skipped'] = skip_reason
+            print('skipping {}: {}'.format(data_cfg_name, skip_reason))
+        results[data_cfg_name] = entry
+
+    print('{:>40s} {:>26s} {:>12s}'.format('data', 'stage', 'samples/s'))
+    for name, entry in results.items():
+        for stage, samples_per_sec in entry.get('samples_per_sec', {}).items():
+            print('{:>40s} {:>26s} {:12.3f}'.format(
+                    name, stage, samples_per_sec))
+    output = to_absolute_path(benchmark_cfg.get(
+            'output', 'benchmark_throughput.json'))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('results written to {}'.format(output))
+
+    if benchmark_cfg.get('baseline') is not None:
+        with open(to_absolute_path(benchmark_cfg.baseline), 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, tolerance)
+        for name, stage, samples_per_sec, reference in regressions:
+            if samples_per_sec is None:
+                print('REGRESSION {} {}: missing (baseline {:.3f})'.format(
+                        name, stage, reference))
+            else:
+                print('REGRESSION {} {}: {:.3f} samples/s (baseline {:.3f})'
+                      .format(name, stage, samples_per_sec, reference))
+        if regressions:
+            sys.exit(1)
+        print('no regressions (tolerance {:.0%})'.format(tolerance))
+
+if __name__ == '__main__':
+    coordinator()
@@ -0,0 +1,125 @@
+"""
+Compare warm started DIP reconstructions of consecutive samples (e.g.
+neighboring walnut slices, see ``mdl.optim.warm_start``) to cold started ones
+by the time to reach a target PSNR.
+
+The first ``warm_start_benchmark.num_samples`` samples of the test data (or
+the validation data if ``validation_run=True``) are reconstructed in dataset
+order, once with the usual initialization (cold) and once initialized from
+the final state of the previous sample (warm, the first sample is cold
+started). The target PSNR of each sample is the maximum PSNR of its cold
+start reconstruction minus ``warm_start_benchmark.psnr_margin``. The time to
+the target is estimated from the first iteration reaching it and the mean
+time per iteration.
+
+The results are written to a json file (``warm_start_benchmark.output``).
+
+Example:
+
+    python examples/benchmark_warm_start.py +experiment=pretrain data=walnuts mdl.optim.warm_start.restore_optimizer_state=True +warm_start_benchmark.num_samples=4
+"""
+import json
+import time
+from copy import deepcopy
+from itertools import islice
+import hydra
+import numpy as np
+import torch
+from hydra.utils import to_absolute_path
+from omegaconf import DictConfig
+from dataset import get_standard_dataset, get_test_data, get_validation_data
+from deep_image_prior import DeepImagePriorReconstructor
+
+def get_samples(cfg, dataset, num_samples):
+    obs_shape = dataset.space[0].shape
+    im_shape = dataset.space[1].shape
+    fold = 'validation' if cfg.validation_run else 'test'
+    if cfg.validation_run and cfg.data.validation_data:
+        dataset_test = get_validation_data(cfg.data.name, cfg.data)
+    elif not cfg.validation_run and cfg.data.test_data:
+        dataset_test = get_test_data(cfg.data.name, cfg.data)
+    else:
+        dataset_test = dataset.create_torch_dataset(
+                fold=fold, reshape=((1,) + obs_shape,
+                                    (1,) + im_shape,
+                                    (1,) + im_shape))
+    return list(islice(dataset_test, num_samples))
+
+def run_reconstruction(reconstructor, sample, warm_start):
+    noisy_obs, fbp, gt = sample
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    _, histories = reconstructor.reconstruct(
+            noisy_obs.float().unsqueeze(dim=0), fbp.unsqueeze(dim=0),
+            gt.unsqueeze(dim=0), return_histories=True,
+            warm_start=warm_start)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    elapsed = time.perf_counter() - start
+    return np.asarray(histories['psnr']), elapsed
+
+def get_time_to_psnr(psnr_history, elapsed, target_psnr):
+    reached = np.nonzero(psnr_history >= target_psnr)[0]
+    if len(reached) == 0:
+        return None, None
+    iters = int(reached[0]) + 1
+    return iters, iters * elapsed / len(psnr_history)
+
+@hydra.main(config_path='../cfgs', config_name='config')
+def coordinator(cfg : DictConfig) -> None:
+    benchmark_cfg = cfg.get('warm_start_benchmark', {})
+    num_samples = benchmark_cfg.get('num_samples', 4)
+    psnr_margin = benchmark_cfg.get('psnr_margin', 0.1)
+
+    dataset, ray_trafos = get_standard_dataset(cfg.data.name, cfg.data)
+    ray_trafo = {'ray_trafo_module': ray_trafos['ray_trafo_module'],
+                 'reco_space': dataset.space[1],
+                 'observation_space': dataset.space[0]}
+    samples = get_samples(cfg, dataset, num_samples)
+
+    reconstructor_cold = DeepImagePriorReconstructor(
+            **ray_trafo, cfg=deepcopy(cfg.mdl))
+    reconstructor_warm = DeepImagePriorReconstructor(
+            **ray_trafo, cfg=deepcopy(cfg.mdl))
+    results = []
+    for i, sample in enumerate(samples):
+        psnr_cold, elapsed_cold = run_reconstruction(
+                reconstructor_cold, sample, warm_start=False)
+        psnr_warm, elapsed_warm = run_reconstruction(
+                reconstructor_warm, sample, warm_start=i > 0)
+        target_psnr = float(np.max(psnr_cold)) - psnr_margin
+        iters_cold, time_cold = get_time_to_psnr(
+                psnr_cold, elapsed_cold, target_psnr)
+        iters_warm, time_warm = get_time_to_psnr(
+                psnr_warm, elapsed_warm, target_psnr)
+        results.append({
+                'sample': i, 'target_psnr': target_psnr,
+                'cold': {'iterations_to_target': iters_cold,
+                         'time_to_target': time_cold,
+                         'max_psnr': float(np.max(psnr_cold)),
+                         'iterations': len(psnr_cold),
+                         'time': elapsed_cold},
+                'warm': {'iterations_to_target': iters_warm,
+                         'time_to_target': time_warm,
+                         'max_psnr': float(np.max(psnr_warm)),
+                         'iterations': len(psnr_warm),
+                         'time': elapsed_warm}})
+
+    print('{:>6s} {:>10s} {:>16s} {:>16s}'.format(
+            'sample', 'target', 'cold time [s]', 'warm time [s]'))
+    for r in results:
+        print('{:>6d} {:10.2f} {:>16s} {:>16s}'.format(
+                r['sample'], r['target_psnr'],
+                *('{:.1f}'.format(r[m]['time_to_target'])
+                  if r[m]['time_to_target'] is not None else 'not reached'
+                  for m in ['cold', 'warm'])))
+    output = to_absolute_path(benchmark_cfg.get(
+            'output', 'benchmark_warm_start.json'))
+    with open(output, 'w') as f:
+        json.dump({'psnr_margin': psnr_margin, 'samples': results}, f,
+                  indent=1)
+    print('results written to {}'.format(output))
+
+if __name__ == '__main__':
+    coordinator()
@@ -1,46 +1,200 @@
+"""
+Compute the ``stats`` (means and standard deviations of the FBP and ground
+truth images) used by :meth:`DeepImagePriorReconstructor.init_model` via
+``cfg.stats`` if ``normalize_by_stats`` is enabled.
+
+The train fold is split into chunks which are processed by worker processes.
+Each chunk yields exact (two-pass) statistics that are merged with the
+parallel algorithm by Chan et al., avoiding the cancellation of the
+``E[x^2] - E[x]^2`` formula. If shards exported by
+``examples/export_shards.py`` are available (``trn.shards_path`` or
+``+compute_stats.shards_path``), the workers read the stored samples;
+otherwise the ground truth images are generated in the main process and the
+workers apply the forward operator, the noise model and the FBP.
+
+Example:
+
+    python examples/compute_stats.py data=standard_ellipses_lotus_20 +compute_stats.num_workers=8
+"""
+import os
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from itertools import islice
 import hydra
 import numpy as np
 from tqdm import tqdm
 from omegaconf import DictConfig
 from dataset.standard import get_standard_dataset
+from dataset.shards import ShardedDataset, load_shard
+
+# dataset used by the worker processes, inherited via fork (ray transforms
+# are generally not picklable)
+_worker_dataset = None
+
+def get_array_stats(x):
+    """
+    Return the statistics ``(count, mean, m2)`` of an array, where ``m2`` is
+    the sum of squared deviations from the mean.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    mean = np.mean(x)
+    m2 = np.sum(np.square(x - mean))
+    return (x.size, mean, m2)
+
+def merge_stats(a, b):
+    """
+    Merge two statistics ``(count, mean, m2)`` (Chan et al., 1979).
+    """
+    n_a, mean_a, m2_a = a
+    n_b, mean_b, m2_b = b
+    n = n_a + n_b
+    if n == 0:
+        return (0, 0., 0.)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * (n_b / n)
+    m2 = m2_a + m2_b + delta**2 * (n_a * n_b / n)
+    return (n, mean, m2)
+
+def _get_samples_stats(samples):
+    stats_fbp = (0, 0., 0.)
+    stats_gt = (0, 0., 0.)
+    for fbp, gt in samples:
+        stats_fbp = merge_stats(stats_fbp, get_array_stats(fbp))
+        stats_gt = merge_stats(stats_gt, get_array_stats(gt))
+    return stats_fbp, stats_gt
 
-def compute_dataset_stats_fbp_gt(dataset, max_samples=None):
+def _compute_shard_chunk_stats(shard_path, start, stop):
+    _, fbps, gts = load_shard(shard_path, 3, start, stop)
+    return _get_samples_stats(zip(fbps, gts))
+
+def _compute_ground_truth_chunk_stats(ground_truths, seed):
+    random_gen = np.random.default_rng(seed)
+    def samples():
+        for ground_truth in ground_truths:
+            noisy_obs = _worker_dataset.ground_truth_to_obs(
+                    ground_truth, random_gen)
+            fbp = _worker_dataset.pinv_ray_trafo(noisy_obs)
+            yield fbp, ground_truth
+    return _get_samples_stats(samples())
+
+def _iter_shard_chunks(dataset, n):
+    offset = 0
+    for shard_path, shard in zip(dataset.get_shard_paths('train'),
+                                 dataset.indices['train']['shards']):
+        if offset >= n:
+            break
+        stop = min(shard['num_samples'], n - offset)
+        yield (shard_path, 0, stop), stop
+        offset += stop
+
+def _iter_ground_truth_chunks(dataset, n, chunk_size):
+    base_seed = dataset.noise_seeds.get('train')
+    gt_gen = islice(dataset.ground_truth_gen(fold='train'), n)
+    for i in range(0, n, chunk_size):
+        ground_truths = [np.asarray(gt) for gt in islice(gt_gen, chunk_size)]
+        if not ground_truths:
+            break
+        # seed depends on the chunk index only, so results do not depend on
+        # the number of workers
+        seed = None if base_seed is None else [base_seed, i // chunk_size]
+        yield (ground_truths, seed), len(ground_truths)
+
+def compute_dataset_stats_fbp_gt(dataset, max_samples=None, num_workers=None,
+                                 chunk_size=64):
     """
     Compute means and standard deviations of the FBP and ground truth images
     in the ``'train'`` fold of a dataset.
+
+    Parameters
+    ----------
+    dataset : :class:`dataset.ShardedDataset` or :class:`dataset.dataset.ObservationGroundTruthPairDataset`
+        Dataset yielding samples ``(obs, fbp, gt)``.
+        For a :class:`dataset.ShardedDataset`, each shard forms a chunk.
+        Otherwise, the noise is drawn per chunk from generators seeded by
+        ``[dataset.noise_seeds['train'], chunk_index]``, so the noise
+        realizations differ from the ones of ``dataset.generator('train')``.
+    max_samples : int, optional
+        Maximum number of samples to use. By default, the whole fold is used.
+    num_workers : int, optional
+        Number of worker processes. ``0`` processes all chunks in the main
+        process. The default is ``os.cpu_count()``.
+    chunk_size : int, optional
+        Number of ground truth images per chunk (only used if `dataset` is
+        not a :class:`dataset.ShardedDataset`). The default is ``64``.
+
+    Returns
+    -------
+    stats : dict
+        Dictionary with the keys ``'mean_fbp', 'std_fbp', 'mean_gt',
+        'std_gt'``.
     """
-    # Adapted from: https://github.com/ahendriksen/msd_pytorch/blob/162823c502701f5eedf1abcd56e137f8447a72ef/msd_pytorch/msd_model.py#L95
-    mean_fbp = 0.
-    mean_gt = 0.
-    square_fbp = 0.
-    square_gt = 0.
+    global _worker_dataset
+
     n = dataset.get_len('train')
     if max_samples is not None:
         n = min(max_samples, n)
-    for obs, fbp, gt in tqdm(islice(dataset.generator('train'), max_samples),
-                             total=n, desc='computing dataset stats'):
-        mean_fbp += np.mean(fbp)
-        mean_gt += np.mean(gt)
-        square_fbp += np.mean(np.square(fbp))
-        square_gt += np.mean(np.square(gt))
-    mean_fbp /= n
-    mean_gt /= n
-    square_fbp /= n
-    square_gt /= n
-    std_fbp = np.sqrt(square_fbp - mean_fbp**2)
-    std_gt = np.sqrt(square_gt - mean_gt**2)
-    stats = {'mean_fbp': mean_fbp,
-             'std_fbp': std_fbp,
-             'mean_gt': mean_gt,
-             'std_gt': std_gt}
+    if num_workers is None:
+        num_workers = os.cpu_count()
+
+    if isinstance(dataset, ShardedDataset):
+        chunk_func = _compute_shard_chunk_stats
+        chunks = _iter_shard_chunks(dataset, n)
+    else:
+        chunk_func = _compute_ground_truth_chunk_stats
+        chunks = _iter_ground_truth_chunks(dataset, n, chunk_size)
+
+    chunk_stats = []
+    _worker_dataset = dataset
+    with tqdm(total=n, desc='computing dataset stats') as pbar:
+        if num_workers == 0:
+            for args, num_samples in chunks:
+                chunk_stats.append(chunk_func(*args))
+                pbar.update(num_samples)
+        else:
+            mp_context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(max_workers=num_workers,
+                                     mp_context=mp_context) as executor:
+                # bound the number of pending chunks, since each holds its
+                # ground truth images
+                pending = []
+                for args, num_samples in chunks:
+                    pending.append(
+                            (executor.submit(chunk_func, *args), num_samples))
+                    if len(pending) >= 2 * num_workers:
+                        future, num_samples_done = pending.pop(0)
+                        chunk_stats.append(future.result())
+                        pbar.update(num_samples_done)
+                for future, num_samples_done in pending:
+                    chunk_stats.append(future.result())
+                    pbar.update(num_samples_done)
+        _worker_dataset = None
+
+    # merge in chunk order, making the result deterministic
+    stats_fbp = (0, 0., 0.)
+    stats_gt = (0, 0., 0.)
+    for chunk_stats_fbp, chunk_stats_gt in chunk_stats:
+        stats_fbp = merge_stats(stats_fbp, chunk_stats_fbp)
+        stats_gt = merge_stats(stats_gt, chunk_stats_gt)
+
+    stats = {'mean_fbp': float(stats_fbp[1]),
+             'std_fbp': float(np.sqrt(stats_fbp[2] / stats_fbp[0])),
+             'mean_gt': float(stats_gt[1]),
+             'std_gt': float(np.sqrt(stats_gt[2] / stats_gt[0]))}
     return stats
 
 @hydra.main(config_path='../cfgs', config_name='config')
 def compute_mean(cfg : DictConfig) -> None:
-    dataset, ray_trafo = get_standard_dataset(cfg.data.name, cfg.data, return_ray_trafo_torch_module=False)
-    stats = compute_dataset_stats_fbp_gt(dataset)
+    stats_cfg = cfg.get('compute_stats', {})
+    shards_path = stats_cfg.get('shards_path', cfg.trn.get('shards_path'))
+    if shards_path is not None:
+        dataset = ShardedDataset(shards_path, shuffle=False)
+    else:
+        dataset, ray_trafo = get_standard_dataset(cfg.data.name, cfg.data, return_ray_trafo_torch_module=False)
+    stats = compute_dataset_stats_fbp_gt(
+            dataset, max_samples=stats_cfg.get('max_samples'),
+            num_workers=stats_cfg.get('num_workers'),
+            chunk_size=stats_cfg.get('chunk_size', 64))
     print(stats)
     with open('stats_standard_{}.json'.format(cfg.data.name), 'w') as f:
         json.dump(stats, f, indent=1)
@@ -0,0 +1,27 @@
+"""
+Decode the dcm files listed for :class:`dataset.brain.ACRINFMISOBrainDataset`
+once and store them in a memory-mapped cache, which can be used by passing
+``data.cache_path=CACHE_PATH`` (config ``standard_brain_walnut_120``).
+
+Requirement: ACRIN-FMISO-Brain dataset stored at `DATA_PATH`
+https://doi.org/10.7937/K9/TCIA.2018.vohlekok
+"""
+import argparse
+from dataset.brain import build_dicom_cache
+
+DATA_PATH = '/localdata/ACRIN-FMISO-Brain'
+CACHE_PATH = '/localdata/ACRIN-FMISO-Brain-cache'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data_path', type=str, default=DATA_PATH)
+parser.add_argument('--cache_path', type=str, default=CACHE_PATH)
+parser.add_argument('--dcm_file_list_path', type=str,
+                    default='acrin_fmiso_brain_file_list.json')
+parser.add_argument('--dtype', type=str, default='uint16')
+parser.add_argument('--num_workers', type=int, default=None)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    build_dicom_cache(args.data_path, args.cache_path,
+                      dcm_file_list_path=args.dcm_file_list_path,
+                      dtype=args.dtype, num_workers=args.num_workers)
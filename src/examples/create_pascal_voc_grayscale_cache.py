@@ -0,0 +1,23 @@
+"""
+Decode the train and validation images of Pascal VOC2012 once and store them
+as grayscale images in a memory-mapped cache, which can be used by passing
+``data.cache_path=CACHE_PATH`` (config ``standard_pascal_voc_lotus_20``).
+
+Requirement: Pascal VOC2012 stored at `DATA_PATH` (folder containing the
+``VOCdevkit`` folder)
+http://host.robots.ox.ac.uk/pascal/VOC/voc2012/index.html
+"""
+import argparse
+from dataset.pascal_voc import build_grayscale_cache
+
+DATA_PATH = '/localdata/PascalVOC'
+CACHE_PATH = '/localdata/PascalVOC-grayscale-cache'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data_path', type=str, default=DATA_PATH)
+parser.add_argument('--cache_path', type=str, default=CACHE_PATH)
+parser.add_argument('--year', type=str, default='2012')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    build_grayscale_cache(args.data_path, args.cache_path, year=args.year)
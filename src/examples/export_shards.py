@@ -0,0 +1,30 @@
+"""
+Export folds of a standard dataset to shards that can be streamed during
+pre-training by passing ``trn.shards_path=SHARDS_PATH`` (or specifying
+``shards_path`` for a dataset in ``trn.meta_trainer.datasets_cfg_list``).
+
+Example:
+
+    python examples/export_shards.py data=standard_ellipses_lotus_20 +shards.path=/localdata/shards/ellipses_lotus_20
+"""
+import hydra
+from omegaconf import DictConfig
+from dataset.standard import get_standard_dataset
+from dataset.shards import export_shards
+
+@hydra.main(config_path='../cfgs', config_name='config')
+def coordinator(cfg : DictConfig) -> None:
+    shards_cfg = cfg.get('shards', {})
+    path = shards_cfg.get('path')
+    if path is None:
+        raise ValueError('Please specify the output path via `+shards.path=`')
+    folds = shards_cfg.get('folds', ['train', 'validation'])
+    shard_size = shards_cfg.get('shard_size', 256)
+
+    dataset, _ = get_standard_dataset(cfg.data.name, cfg.data,
+                                      return_ray_trafo_torch_module=False)
+    for fold in folds:
+        export_shards(dataset, path, fold=fold, shard_size=shard_size)
+
+if __name__ == '__main__':
+    coordinator()
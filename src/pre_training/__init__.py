@@ -1,4 +1,4 @@
 from .trainer import Trainer
-from .adversarial_attacks import PGDAttack
+from .adversarial_attacks import PGDAttack, FreeAttack
 from .maml_trainer import MetaTrainer
 from .maml_utils import one_step_gd_update_wtups
\ No newline at end of file
@@ -2,6 +2,52 @@ import torch
 from torch.nn import MSELoss
 from odl.contrib.torch import OperatorModule
 
+def get_smooth_pinv_ray_trafo_module(ray_trafos, fbp_mode='odl'):
+    """
+    Select the smooth pseudo-inverse module through which the attacks
+    differentiate.
+
+    Parameters
+    ----------
+    ray_trafos : dict
+        Ray transforms, see :func:`dataset.standard.get_ray_trafos`.
+    fbp_mode : {``'odl'``, ``'torch'``}, optional
+        ``'odl'`` uses `'smooth_pinv_ray_trafo_module'` (e.g. an
+        :class:`OperatorModule` wrapping the ODL FBP), ``'torch'`` uses
+        `'torch_smooth_pinv_ray_trafo_module'`, applying a precomputed filter
+        by torch operations (only available for the matrix implementation).
+    """
+    if fbp_mode == 'odl':
+        key = 'smooth_pinv_ray_trafo_module'
+    elif fbp_mode == 'torch':
+        key = 'torch_smooth_pinv_ray_trafo_module'
+    else:
+        raise ValueError('Unknown fbp mode \'{}\''.format(fbp_mode))
+    if ray_trafos.get(key) is None:
+        raise ValueError(
+                'fbp mode \'{}\' requires ray_trafos[\'{}\']'.format(
+                        fbp_mode, key))
+    return ray_trafos[key]
+
+def l2_sign_step(obs, adv_obs, grad, alpha, eps, eps_for_division=1e-10):
+    """
+    Ascent step on the normalized gradient sign, followed by projection of the
+    perturbation ``adv_obs - obs`` onto the L2 ball with radius `eps`.
+    """
+    batch_size = len(obs)
+    grad_norms = torch.norm(grad.view(batch_size, -1), p=2,
+                            dim=1) + eps_for_division
+    grad = grad / grad_norms.view(batch_size, 1, 1, 1)
+    adv_obs = adv_obs.detach() + alpha * grad.sign()
+
+    delta = adv_obs - obs
+    delta_norms = torch.norm(delta.view(batch_size, -1), p=2,
+            dim=1)
+    factor = eps / delta_norms
+    factor = torch.min(factor, torch.ones_like(delta_norms))
+    delta = delta * factor.view(-1, 1, 1, 1)
+    return obs + delta
+
 class Attack:
 
     """
@@ -52,25 +98,34 @@ class Attack:
 
 class PGDAttack(Attack):
 
-    def __init__(self, model, ray_trafos, steps=10, eps=1, alpha=0.1, eps_for_division=1e-10):
+    def __init__(self, model, ray_trafos, steps=10, eps=1, alpha=0.1,
+                 eps_for_division=1e-10, fbp_mode='odl', early_stop_tol=None):
+        """
+        Arguments:
+        ----------
+        fbp_mode: see :func:`get_smooth_pinv_ray_trafo_module`
+        early_stop_tol: if not `None`, stop as soon as the cost increased by
+            no more than ``early_stop_tol * cost`` in the last step, returning
+            the observation with the highest cost
+        """
         super().__init__('PGD-L2', model, ray_trafos)
         self.steps = steps
         self.eps = eps
         self.alpha = alpha
         self.eps_for_division = eps_for_division
-        self.smooth_pinv_ray_trafo_module = \
-            self.ray_trafos['smooth_pinv_ray_trafo_module'
-                            ].to(self.device)
+        self.early_stop_tol = early_stop_tol
+        self.smooth_pinv_ray_trafo_module = get_smooth_pinv_ray_trafo_module(
+                self.ray_trafos, fbp_mode).to(self.device)
         self.criterion = MSELoss()
 
     def forward(self, obs, gt, randn_mask=None):
 
-        batch_size = len(gt)
         obs = obs.clone().detach().to(self.device)
         gt = gt.clone().detach().to(self.device)
         adv_obs = obs.clone().detach()
 
         costs = []
+        best_adv_obs = adv_obs
         for i in range(self.steps):
             adv_obs.requires_grad_(True)
             outputs = \
@@ -78,21 +133,69 @@ class PGDAttack(Attack):
             cost = self.criterion(outputs, gt)
             costs.append(cost.item())
 
+            if self.early_stop_tol is not None and i > 0:
+                if costs[-1] > max(costs[:-1]):
+                    best_adv_obs = adv_obs
+                if costs[-1] - costs[-2] <= self.early_stop_tol * abs(costs[-2]):
+                    # cost stopped increasing, skip the remaining steps
+                    adv_obs = best_adv_obs
+                    break
+
             # Update adversarial observation
 
             grad = torch.autograd.grad(cost, adv_obs,
                     retain_graph=False, create_graph=False)[0]
-            grad_norms = torch.norm(grad.view(batch_size, -1), p=2,
-                                    dim=1) + self.eps_for_division
-            grad = grad / grad_norms.view(batch_size, 1, 1, 1)
-            adv_obs = adv_obs.detach() + self.alpha * grad.sign()
-
-            delta = adv_obs - obs
-            delta_norms = torch.norm(delta.view(batch_size, -1), p=2,
-                    dim=1)
-            factor = self.eps / delta_norms
-            factor = torch.min(factor, torch.ones_like(delta_norms))
-            delta = delta * factor.view(-1, 1, 1, 1)
-            adv_obs = (obs + delta)
-
-        return self.smooth_pinv_ray_trafo_module(adv_obs), costs
+            adv_obs = l2_sign_step(obs, adv_obs, grad, alpha=self.alpha,
+                                   eps=self.eps,
+                                   eps_for_division=self.eps_for_division)
+
+        return self.smooth_pinv_ray_trafo_module(adv_obs.detach()), costs
+
+
+class FreeAttack(Attack):
+
+    """
+    Perturbation for "free" adversarial training (Shafahi et al., 2019,
+    https://arxiv.org/abs/1904.12843).
+
+    Instead of running separate attack steps, the gradient w.r.t. the
+    perturbed observation is obtained from the backward pass of the parameter
+    update: :meth:`perturb` returns the perturbed observation (requiring
+    gradients), and after the training step's backward pass, :meth:`step`
+    updates the perturbation, which is kept for the next replay or batch.
+    """
+
+    def __init__(self, model, ray_trafos, eps=1, alpha=0.1,
+                 eps_for_division=1e-10, fbp_mode='odl'):
+        super().__init__('Free-L2', model, ray_trafos)
+        self.eps = eps
+        self.alpha = alpha
+        self.eps_for_division = eps_for_division
+        self.smooth_pinv_ray_trafo_module = get_smooth_pinv_ray_trafo_module(
+                self.ray_trafos, fbp_mode).to(self.device)
+        self.delta = None
+        self._obs = None
+        self._adv_obs = None
+
+    def perturb(self, obs):
+        """
+        Return the smooth pseudo-inverse of the perturbed observation, through
+        which the next backward pass computes the perturbation gradient.
+        """
+        obs = obs.detach().to(self.device)
+        if self.delta is None or self.delta.shape != obs.shape:
+            self.delta = torch.zeros_like(obs)
+        self._obs = obs
+        self._adv_obs = (obs + self.delta).requires_grad_(True)
+        return self.smooth_pinv_ray_trafo_module(self._adv_obs)
+
+    def step(self):
+        """
+        Update the perturbation using the gradient of the last backward pass.
+        """
+        adv_obs = l2_sign_step(self._obs, self._adv_obs, self._adv_obs.grad,
+                               alpha=self.alpha, eps=self.eps,
+                               eps_for_division=self.eps_for_division)
+        self.delta = (adv_obs - self._obs).detach()
+        self._obs = None
+        self._adv_obs = None
@@ -0,0 +1,174 @@
+"""
+Provides :class:`ValidationWorker`, evaluating snapshots of the model weights
+on a fixed validation subset in a separate process while training continues.
+"""
+import queue
+from copy import deepcopy
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import TensorDataset, DataLoader
+from deep_image_prior import PSNR
+from .checkpoint import to_cpu
+
+
+def cache_validation_pairs(dataset, num_samples=None, pair_generator=None,
+                           batch_size=32):
+    """
+    Load the first `num_samples` samples of a torch dataset into CPU memory.
+
+    Parameters
+    ----------
+    dataset : :class:`torch.utils.data.Dataset`
+        Dataset yielding ``(obs, fbp, gt)``, or ``gt`` if `pair_generator` is
+        specified.
+    num_samples : int, optional
+        Number of samples. By default, all samples are loaded.
+    pair_generator : :class:`dataset.TorchPairGenerator`, optional
+        Generator of the pairs from the ground truth (with the noise for the
+        ``'validation'`` fold).
+    batch_size : int, optional
+        Batch size for generating the pairs.
+
+    Returns
+    -------
+    dataset : :class:`torch.utils.data.TensorDataset`
+        Dataset of ``(obs, fbp, gt)`` tensors.
+    """
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    if pair_generator is not None:
+        pair_generator.reset('validation')
+    obs_list, fbp_list, gt_list = [], [], []
+    num_loaded = 0
+    for batch in loader:
+        if num_samples is not None and num_loaded >= num_samples:
+            break
+        if pair_generator is not None:
+            with torch.no_grad():
+                batch = pair_generator(batch.to(pair_generator.device),
+                                       fold='validation')
+        obs, fbp, gt = (x.cpu() for x in batch)
+        obs_list.append(obs)
+        fbp_list.append(fbp)
+        gt_list.append(gt)
+        num_loaded += len(gt)
+    tensors = [torch.cat(l)[:num_samples] for l in
+               [obs_list, fbp_list, gt_list]]
+    return TensorDataset(*tensors)
+
+
+def validate(model, data_loader, device, add_randn_mask=False):
+    """
+    Return the mean loss (MSE) and PSNR of `model` on a data loader yielding
+    ``(obs, fbp, gt)``.
+    """
+    criterion = torch.nn.MSELoss(reduction='sum')
+    model.eval()
+    loss_sum, psnr_sum, size = 0., 0., 0
+    with torch.no_grad():
+        for _, fbp, gt in data_loader:
+            fbp, gt = fbp.to(device), gt.to(device)
+            if add_randn_mask:
+                fbp = torch.cat([fbp, 0.1*torch.randn_like(fbp)], dim=1)
+            outputs = model(fbp)
+            loss_sum += criterion(outputs, gt).item() / gt[0].numel()
+            for i in range(outputs.shape[0]):
+                psnr_sum += PSNR(outputs[i, 0].cpu().numpy(),
+                                 gt[i, 0].cpu().numpy(), data_range=1)
+            size += outputs.shape[0]
+    return loss_sum / size, psnr_sum / size
+
+
+def _worker_main(model, dataset, batch_size, device, add_randn_mask,
+                 request_queue, result_queue):
+    model.to(device)
+    data_loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    while True:
+        request = request_queue.get()
+        if request is None:
+            break
+        key, state_dict = request
+        model.load_state_dict(state_dict)
+        torch.manual_seed(0)  # same randn mask for all snapshots
+        loss, psnr = validate(model, data_loader, device,
+                              add_randn_mask=add_randn_mask)
+        result_queue.put((key, loss, psnr))
+
+
+class ValidationWorker():
+    """
+    Validates snapshots of the model weights in a separate process.
+
+    Snapshots are submitted with :meth:`submit` and a key (e.g. the iteration
+    number); the results ``(key, loss, psnr, state_dict)`` are collected with
+    :meth:`poll` (non-blocking) or :meth:`wait`. The submitted snapshots are
+    kept (in :attr:`pending`) until their results are collected, so the
+    caller can use the weights of the best snapshot.
+    """
+    def __init__(self, model, dataset, batch_size, device,
+                 add_randn_mask=False):
+        """
+        Parameters
+        ----------
+        model : :class:`torch.nn.Module`
+            Model, copied to the worker process once (its weights are
+            replaced by the submitted snapshots).
+        dataset : :class:`torch.utils.data.TensorDataset`
+            Validation dataset (e.g. from :func:`cache_validation_pairs`).
+        batch_size : int
+            Batch size.
+        device : :class:`torch.device` or str
+            Device used by the worker.
+        add_randn_mask : bool, optional
+            Whether to append a random channel to the input.
+        """
+        ctx = mp.get_context('spawn')
+        self.pending = {}
+        self._request_queue = ctx.Queue()
+        self._result_queue = ctx.Queue()
+        self._process = ctx.Process(
+                target=_worker_main,
+                args=(deepcopy(model).cpu(), dataset, batch_size, str(device),
+                      add_randn_mask, self._request_queue,
+                      self._result_queue),
+                daemon=True)
+        self._process.start()
+
+    def submit(self, key, state_dict):
+        """
+        Queue a snapshot of the weights for validation.
+        """
+        state_dict = to_cpu(state_dict)
+        self.pending[key] = state_dict
+        self._request_queue.put((key, state_dict))
+
+    def _collect(self, block):
+        results = []
+        while self.pending:
+            try:
+                key, loss, psnr = self._result_queue.get(
+                        block=block, timeout=1. if block else None)
+            except queue.Empty:
+                if not block:
+                    break
+                if not self._process.is_alive():
+                    raise RuntimeError('validation worker process died')
+                continue
+            results.append((key, loss, psnr, self.pending.pop(key)))
+        return results
+
+    def poll(self):
+        """
+        Return the results available so far, as a list of
+        ``(key, loss, psnr, state_dict)``.
+        """
+        return self._collect(block=False)
+
+    def wait(self):
+        """
+        Return the results of all pending snapshots (see :meth:`poll`).
+        """
+        return self._collect(block=True)
+
+    def close(self):
+        self._request_queue.put(None)
+        self._process.join()
@@ -0,0 +1,135 @@
+"""
+Provides resumable training checkpoints for :class:`pre_training.Trainer` and
+:class:`pre_training.MetaTrainer`.
+
+A checkpoint is a dictionary saved with :func:`torch.save`, containing the
+state dicts of the model, optimizer, schedulers etc., the training progress
+(counters, best validation PSNR and parameters) and the random number
+generator states. Writing is performed by :class:`CheckpointWriter` in a
+background thread, so the training loop only blocks for copying the state to
+CPU memory.
+"""
+import os
+import random
+import threading
+import queue
+import numpy as np
+import torch
+
+
+def get_rng_states():
+    """
+    Return the states of the python, numpy and torch (CPU and cuda) global
+    random number generators.
+    """
+    return {'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state(),
+            'cuda': (torch.cuda.get_rng_state_all()
+                     if torch.cuda.is_available() else [])}
+
+
+def set_rng_states(states):
+    """
+    Restore random number generator states returned by
+    :func:`get_rng_states`.
+    """
+    random.setstate(states['python'])
+    np.random.set_state(states['numpy'])
+    torch.set_rng_state(states['torch'])
+    if states['cuda'] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(states['cuda'])
+
+
+def to_cpu(obj):
+    """
+    Copy all tensors in a (nested) dict/list/tuple to CPU memory.
+    Tensors already on CPU are cloned, so the copy is not affected by
+    subsequent in-place updates.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+def load_checkpoint(path, map_location='cpu'):
+    """
+    Load a checkpoint written by :class:`CheckpointWriter`.
+    """
+    return torch.load(path, map_location=map_location)
+
+
+class CheckpointWriter():
+    """
+    Writes checkpoints to a file in a background thread.
+
+    At most one checkpoint is pending at a time: :meth:`save` waits for the
+    previous checkpoint to be written before queuing the next one. Files are
+    replaced atomically, so a crash while writing keeps the last complete
+    checkpoint.
+    """
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            File path of the checkpoint (``'.pt'`` is appended if missing).
+        """
+        self.path = path if path.endswith('.pt') else path + '.pt'
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            state = self._queue.get()
+            if state is None:
+                break
+            try:
+                tmp_path = self.path + '.tmp'
+                torch.save(state, tmp_path)
+                os.replace(tmp_path, self.path)
+            except Exception as e:  # raised in the training thread
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, state):
+        """
+        Copy `state` to CPU memory and queue it for writing, after waiting
+        for the previous checkpoint to be written.
+        """
+        state = to_cpu(state)
+        # `put` would only wait for the previous state to be taken from the
+        # queue, not for it to be written
+        self._queue.join()
+        self._raise_error()
+        self._queue.put(state)
+
+    def wait(self):
+        """
+        Block until all queued checkpoints are written.
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Write pending checkpoints and stop the background thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_error()
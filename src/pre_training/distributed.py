@@ -0,0 +1,102 @@
+"""
+Helpers for distributed data-parallel pre-training with
+:mod:`torch.distributed`.
+
+Processes can either be launched by ``torchrun``, e.g.
+
+    torchrun --nproc_per_node=4 coordinator.py trn.distributed=True
+
+or locally by :func:`spawn`. The ``'gloo'`` backend allows to train on CPU.
+"""
+import os
+import socket
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(backend='gloo'):
+    """
+    Initialize the default process group from the environment variables set
+    by ``torchrun`` (or :func:`spawn`), if not already initialized.
+
+    Returns
+    -------
+    rank, world_size : int
+        Rank and world size; ``(0, 1)`` if not launched distributed.
+    """
+    if (not is_distributed() and dist.is_available() and
+            int(os.environ.get('WORLD_SIZE', 1)) > 1):
+        dist.init_process_group(backend=backend, init_method='env://')
+    return get_rank(), get_world_size()
+
+
+def all_reduce_sum(values, device='cpu'):
+    """
+    Sum a list of numbers over all processes.
+
+    Parameters
+    ----------
+    values : list of float
+        Values of this process.
+    device : str or :class:`torch.device`, optional
+        Device of the communication tensor, must be supported by the backend
+        (``'cpu'`` for ``'gloo'``, a cuda device for ``'nccl'``).
+
+    Returns
+    -------
+    sums : list of float
+        Sums over all processes (`values` if not distributed).
+    """
+    if not is_distributed():
+        return list(values)
+    t = torch.tensor(values, dtype=torch.float64, device=device)
+    dist.all_reduce(t, op=dist.ReduceOp.SUM)
+    return t.tolist()
+
+
+def _get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _spawn_worker(rank, fn, world_size, backend, args):
+    os.environ['RANK'] = str(rank)
+    os.environ['LOCAL_RANK'] = str(rank)
+    os.environ['WORLD_SIZE'] = str(world_size)
+    dist.init_process_group(backend=backend, init_method='env://',
+                            rank=rank, world_size=world_size)
+    try:
+        fn(rank, *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def spawn(fn, world_size, args=(), backend='gloo'):
+    """
+    Run ``fn(rank, *args)`` in `world_size` local processes forming a
+    process group, as an alternative to launching with ``torchrun``.
+
+    `fn` and `args` must be picklable (e.g. a module-level function).
+    """
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ['MASTER_PORT'] = str(_get_free_port())
+    mp.spawn(_spawn_worker, args=(fn, world_size, backend, args),
+             nprocs=world_size, join=True)
@@ -6,14 +6,19 @@ from itertools import islice
 import torch
 import numpy as np
 import functorch as ftch
-import tensorboardX
 from copy import deepcopy
+from functools import partial
 from math import ceil
 from tqdm import tqdm
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 from torch.optim.lr_scheduler import CyclicLR, OneCycleLR
 from deep_image_prior import PSNR
-from .maml_utils import one_step_gd_update_wtups
+from util.async_logging import LoggingService
+from .maml_utils import (
+        one_step_gd_update_wtups, disable_batch_norm_running_stats)
+from .prefetch import DevicePrefetcher
+from .checkpoint import (
+        CheckpointWriter, load_checkpoint, get_rng_states, set_rng_states)
 
 # taken from https://gist.githubusercontent.com/MFreidank/821cc87b012c53fade03b0c7aba13958/raw/41ad2c08a019c72b278866e1b02b355f1fce44a4/infinite_dataloader.py
 class InfiniteDataLoader(DataLoader):
@@ -21,6 +26,9 @@ class InfiniteDataLoader(DataLoader):
         super().__init__(*args, **kwargs)
         # Initialize an iterator over the dataset.
         self.dataset_iterator = super().__iter__()
+        # number of batches drawn, allows to fast-forward a new loader with
+        # the same `generator` seed when resuming
+        self.num_batches_drawn = 0
 
     def __iter__(self):
         return self
@@ -32,12 +40,26 @@ class InfiniteDataLoader(DataLoader):
             # Dataset exhausted, use a new fresh iterator.
             self.dataset_iterator = super().__iter__()
             batch = next(self.dataset_iterator)
+        self.num_batches_drawn += 1
         return batch
 
+    def skip(self, num_batches):
+        """
+        Draw and discard `num_batches` batches.
+        """
+        for _ in range(num_batches):
+            next(self)
+
 class MetaTrainer():
 
     """
     Wrapper for meta-pre-trainig a model.
+
+    If ``cfg.checkpoint_path`` is specified, the full training state is saved
+    every ``cfg.checkpoint_interval`` iterations (by default at each
+    evaluation), and with ``cfg.resume`` training continues from it. Each
+    data loader uses its own seeded :class:`torch.Generator`, so its position
+    can be restored from the number of batches drawn.
     """
     def __init__(self, model, cfg):
         self.model = model
@@ -48,7 +70,8 @@ class MetaTrainer():
         logdir = os.path.join(
             cfg.log_path,
             current_time + '_' + socket.gethostname() + comment)
-        self.writer = tensorboardX.SummaryWriter(logdir=logdir)
+        self.writer = LoggingService(
+                logdir=logdir, asynchronous=self.cfg.get('async_logging', True))
         self.func_model_with_input, self.func_params = ftch.make_functional(self.model)
         ftch._src.make_functional.extract_weights(self.model) # self.model.parameters() will be empty
 
@@ -69,13 +92,32 @@ class MetaTrainer():
 
         num_tasks = len(list_datasets_train)
 
-        def _create_data_loader(dset):
+        checkpoint_path = self.cfg.get('checkpoint_path')
+        if checkpoint_path is not None:
+            checkpoint_path = (checkpoint_path if checkpoint_path.endswith('.pt')
+                               else checkpoint_path + '.pt')
+        resume_state = None
+        if (self.cfg.get('resume', False) and checkpoint_path is not None and
+                os.path.isfile(checkpoint_path)):
+            resume_state = load_checkpoint(checkpoint_path)
+
+        if resume_state is not None:
+            loader_seeds = resume_state['loader_seeds']
+        else:
+            loader_seeds = {
+                fold: torch.randint(2**62, (len(list_datasets_train),)).tolist()
+                for fold in ['train', 'validation']}
+
+        def _create_data_loader(dset, seed):
+            # iterable datasets, e.g. streamed from shards, shuffle themselves
             return InfiniteDataLoader(dset, batch_size=self.cfg.batch_size,
-                    num_workers=self.cfg.num_data_loader_workers, shuffle=True,
-                    pin_memory=True)
+                    num_workers=self.cfg.num_data_loader_workers,
+                    shuffle=not isinstance(dset, IterableDataset),
+                    pin_memory=True,
+                    generator=torch.Generator().manual_seed(seed))
         # create PyTorch dataloaders
-        data_loaders = {'train': [_create_data_loader(dataset_train) for dataset_train in list_datasets_train],
-                        'validation': [_create_data_loader(dataset_validation) for dataset_validation in list_datasets_validation]}
+        data_loaders = {'train': [_create_data_loader(dataset_train, seed) for dataset_train, seed in zip(list_datasets_train, loader_seeds['train'])],
+                        'validation': [_create_data_loader(dataset_validation, seed) for dataset_validation, seed in zip(list_datasets_validation, loader_seeds['validation'])]}
 
         self.init_optimizer()
         self.init_scheduler()
@@ -86,46 +128,80 @@ class MetaTrainer():
 
         best_model_func_params = deepcopy(self.func_params)
         best_psnr = -np.inf
-        with tqdm(range(int(self.cfg.meta_trainer.num_iters))) as pbar:
+        start_it = 0
+        if resume_state is not None:
+            with torch.no_grad():
+                for p, v in zip(self.func_params, resume_state['func_params']):
+                    p.copy_(v)
+            self._optimizer.load_state_dict(resume_state['optimizer'])
+            if self._scheduler is not None:
+                self._scheduler.load_state_dict(resume_state['scheduler'])
+            best_model_func_params = [
+                    v.to(self.device).requires_grad_(p.requires_grad)
+                    for p, v in zip(self.func_params,
+                                    resume_state['best_model_func_params'])]
+            best_psnr = resume_state['best_psnr']
+            start_it = resume_state['it']
+            for fold in ['train', 'validation']:
+                for loader, num_batches in zip(
+                        data_loaders[fold],
+                        resume_state['loader_num_batches_drawn'][fold]):
+                    loader.skip(num_batches)
+            set_rng_states(resume_state['rng_states'])
+        # on cuda, each loader keeps its next batch on the device, copied in
+        # a side stream
+        prefetchers = {
+                fold: [DevicePrefetcher(
+                        loader, self.device,
+                        use_side_stream=self.cfg.get('prefetch_to_device', True))
+                       for loader in loaders]
+                for fold, loaders in data_loaders.items()}
+        checkpoint_writer = (CheckpointWriter(checkpoint_path)
+                             if checkpoint_path is not None else None)
+        checkpoint_interval = (self.cfg.get('checkpoint_interval') or
+                               self.cfg.meta_trainer.eval_every_num_iters)
+
+        def save_checkpoint(it):
+            # `it` is the next iteration
+            checkpoint_writer.save({
+                'func_params': list(self.func_params),
+                'optimizer': self._optimizer.state_dict(),
+                'scheduler': (self._scheduler.state_dict()
+                              if self._scheduler is not None else None),
+                'best_model_func_params': list(best_model_func_params),
+                'best_psnr': best_psnr,
+                'it': it,
+                'loader_seeds': loader_seeds,
+                'loader_num_batches_drawn': {
+                        fold: [loader.num_batches_drawn - prefetcher.num_pending
+                               for loader, prefetcher in zip(
+                                       loaders, prefetchers[fold])]
+                        for fold, loaders in data_loaders.items()},
+                'rng_states': get_rng_states()})
+
+        num_iters = int(self.cfg.meta_trainer.num_iters)
+        with tqdm(range(start_it, num_iters),
+                  initial=start_it, total=num_iters) as pbar:
             for it in pbar:
                 id_tasks = [
                         random.randint(0, num_tasks-1) for _ in range(
                             self.cfg.meta_trainer.num_tasks_per_iter)
                     ]
                 picked_dataloaders = [
-                    data_loaders['train'][id_task] for id_task in id_tasks]
+                    prefetchers['train'][id_task] for id_task in id_tasks]
 
-                self._optimizer.zero_grad()
-                # inner loop
-                inn_loop_data = []
+                task_batches = []
                 for dataset in picked_dataloaders:
-                    _, fbp, gt = next(dataset)
-                    fbp, gt= fbp.to(self.device), gt.to(self.device)
-                    outputs = self.func_model_with_input(self.func_params, fbp)
-                    loss = criterion(outputs, gt)
-                    ftch_grads = torch.autograd.grad(loss, self.func_params, create_graph=True)
-                    inn_loop_data.append(
-                        (one_step_gd_update_wtups(
-                            self.func_params, ftch_grads, self.cfg.meta_trainer.inner_loop_optim.lr), fbp, gt) )
-                # outer loop
-                all_loss = torch.tensor([0.0]).to(self.device)
-                for data in inn_loop_data:
-                    one_step_gd_update_func_params, fbp, gt = data
-                    outputs = self.func_model_with_input(one_step_gd_update_func_params, fbp)
-                    loss = criterion(outputs, gt)
-                    all_loss += loss
-
-                all_loss.backward()
-                torch.nn.utils.clip_grad_norm_(
-                    self.model.parameters(), max_norm=1)
-                self._optimizer.step()
-
-                # overall training stats
+                    _, fbp, gt = next(dataset)  # on the device
+                    task_batches.append((fbp, gt))
+                all_loss, task_outputs = self.meta_update(
+                        task_batches, criterion)
+
+                # overall training stats (outputs for the parameters before
+                # the meta-update, reused from the inner loop)
                 all_psnrs = []
-                for data in inn_loop_data:
-                    _, fbp, gt = data
-                    outputs = self.func_model_with_input(self.func_params, fbp)
-                    all_psnrs.append(PSNR(outputs.detach().cpu(), gt.detach().cpu(), data_range=1))
+                for outputs, (_, gt) in zip(task_outputs, task_batches):
+                    all_psnrs.append(PSNR(outputs.cpu(), gt.detach().cpu(), data_range=1))
                 if (self._scheduler is not None and
                         schedule_every_batch):
                     self._scheduler.step()
@@ -137,9 +213,8 @@ class MetaTrainer():
                 pbar.set_description(f'loss: {all_loss.item()}, psnr: {np.mean(all_psnrs)}')
                 if ( (it + 1) % self.cfg.meta_trainer.eval_every_num_iters) == 0:
                     all_val_loss, all_val_psnrs = [], []
-                    for val_loader in data_loaders['validation']:
+                    for val_loader in prefetchers['validation']:
                         for _, fbp, gt in islice(val_loader, self.cfg.meta_trainer.num_val_iters_per_task):
-                            fbp, gt = fbp.to(self.device), gt.to(self.device)
                             outputs = self.func_model_with_input(self.func_params, fbp)
                             loss = criterion(outputs, gt)
                             all_val_loss.append(loss.item())
@@ -163,6 +238,13 @@ class MetaTrainer():
                             self.save_learned_params(
                                 self.cfg.save_best_learned_params_path)
 
+                if (checkpoint_writer is not None and
+                        (it + 1) % checkpoint_interval == 0):
+                    save_checkpoint(it + 1)
+
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
+
         ftch._src.make_functional.load_state(
                 self.model,
                 best_model_func_params,
@@ -172,6 +254,128 @@ class MetaTrainer():
         print('Best val psnr: {:4f}'.format(best_psnr))
         self.writer.close()
 
+    def meta_update(self, task_batches, criterion):
+        """
+        Perform one meta-update of the parameters.
+
+        The update rule is selected by ``cfg.meta_trainer.meta_update``:
+
+            ``'second_order'`` (default)
+                MAML, differentiating through the inner loop.
+            ``'first_order'``
+                First-order MAML, treating the inner loop gradients as
+                constants, i.e. the outer gradient at the adapted parameters
+                is applied to the initial parameters.
+            ``'reptile'``
+                Reptile, passing the mean difference between the initial and
+                the adapted parameters as gradient to the optimizer.
+
+        In the inner loop, each task performs
+        ``cfg.meta_trainer.num_inner_steps`` gradient descent steps on its
+        batch.
+
+        If ``cfg.meta_trainer.vmap_tasks`` is `True` (default) and all task
+        batches have the same shape, the tasks are processed by a single
+        :func:`functorch.vmap`-batched call over the stacked batches and fast
+        weights instead of a python loop. Batch norm running statistics are
+        not updated in this case.
+
+        Parameters
+        ----------
+        task_batches : list of 2-tuple of :class:`torch.Tensor`
+            Batches ``(fbp, gt)``, one per task.
+        criterion : callable
+            Loss function, computing the mean over the batch.
+
+        Returns
+        -------
+        all_loss : :class:`torch.Tensor`
+            Sum of the task losses for the adapted parameters.
+        task_outputs : list of :class:`torch.Tensor`
+            Detached network outputs for the initial parameters (computed in
+            the first inner step), one per task, e.g. for logging.
+        """
+        meta_update = self.cfg.meta_trainer.get('meta_update', 'second_order')
+        if meta_update not in ['second_order', 'first_order', 'reptile']:
+            raise ValueError(
+                    'Unknown meta update \'{}\''.format(meta_update))
+        vmap_tasks = (
+                self.cfg.meta_trainer.get('vmap_tasks', True) and
+                len(set((fbp.shape, gt.shape) for fbp, gt in task_batches)) == 1)
+
+        self._optimizer.zero_grad()
+        if meta_update == 'reptile':
+            init_params = tuple(p.detach() for p in self.func_params)
+        else:
+            init_params = tuple(self.func_params)
+        adapt_func = partial(
+                self._adapt_task, criterion=criterion,
+                first_order=(meta_update != 'second_order'))
+        if vmap_tasks:
+            fbps = torch.stack([fbp for fbp, _ in task_batches])
+            gts = torch.stack([gt for _, gt in task_batches])
+            # the functional model runs a copy of `self.model`
+            with disable_batch_norm_running_stats(
+                    self.func_model_with_input.stateless_model):
+                losses, params, outputs = ftch.vmap(
+                        adapt_func, in_dims=(None, 0, 0))(
+                                init_params, fbps, gts)
+            all_loss = torch.sum(losses, dim=0, keepdim=True)
+            task_outputs = list(outputs.detach())
+            if meta_update == 'reptile':
+                # mean of the adapted parameters over the tasks
+                mean_params = tuple(torch.mean(p, dim=0) for p in params)
+        else:
+            all_loss = torch.tensor([0.0]).to(self.device)
+            task_outputs = []
+            mean_params = tuple(torch.zeros_like(p) for p in init_params)
+            for fbp, gt in task_batches:
+                loss, params, outputs = adapt_func(init_params, fbp, gt)
+                all_loss += loss
+                task_outputs.append(outputs.detach())
+                if meta_update == 'reptile':
+                    mean_params = tuple(
+                            m + p / len(task_batches)
+                            for m, p in zip(mean_params, params))
+
+        if meta_update == 'reptile':
+            for p, m in zip(self.func_params, mean_params):
+                p.grad = p.detach() - m
+        else:
+            all_loss.backward()
+
+        torch.nn.utils.clip_grad_norm_(
+            self.model.parameters(), max_norm=1)
+        self._optimizer.step()
+        return all_loss.detach(), task_outputs
+
+    def _adapt_task(self, params, fbp, gt, criterion, first_order=False):
+        """
+        Run the inner loop for one task and evaluate the loss for the adapted
+        parameters (written with :mod:`functorch` transforms, so that it can
+        be batched over tasks by :func:`functorch.vmap`).
+
+        Returns the loss for the adapted parameters, the adapted parameters
+        and the outputs for the initial parameters.
+        """
+        def compute_loss(params):
+            outputs = self.func_model_with_input(params, fbp)
+            return criterion(outputs, gt), outputs
+
+        init_outputs = None
+        for _ in range(self.cfg.meta_trainer.get('num_inner_steps', 1)):
+            grads, outputs = ftch.grad(compute_loss, has_aux=True)(params)
+            if init_outputs is None:
+                init_outputs = outputs
+            if first_order:
+                grads = tuple(g.detach() for g in grads)
+            params = one_step_gd_update_wtups(
+                    params, grads, self.cfg.meta_trainer.inner_loop_optim.lr)
+        loss, outputs = compute_loss(params)
+        if init_outputs is None:
+            init_outputs = outputs
+        return loss, params, init_outputs
+
     def init_optimizer(self):
         """
         Initialize the optimizer.
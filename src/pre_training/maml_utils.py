@@ -1,3 +1,6 @@
+from contextlib import contextmanager
+import torch
+
 
 def one_step_gd_update_wtups(tupparams, tupgrads, scalalpha):
     assert len(tupparams) == len(tupgrads)
@@ -5,3 +8,26 @@ def one_step_gd_update_wtups(tupparams, tupgrads, scalalpha):
     for param, grad in zip(tupparams, tupgrads): 
         update.append(param - scalalpha * grad)
     return tuple(update)
+
+@contextmanager
+def disable_batch_norm_running_stats(model):
+    """
+    Temporarily use batch statistics in all batch norm layers without
+    updating the running statistics, as required by :func:`functorch.vmap`
+    (which cannot update the unbatched running statistics in-place).
+    """
+    saved = []
+    for module in model.modules():
+        if isinstance(module, torch.nn.modules.batchnorm._BatchNorm):
+            saved.append((module, module.track_running_stats,
+                          module.running_mean, module.running_var))
+            module.track_running_stats = False
+            module.running_mean = None
+            module.running_var = None
+    try:
+        yield
+    finally:
+        for module, track_running_stats, running_mean, running_var in saved:
+            module.track_running_stats = track_running_stats
+            module.running_mean = running_mean
+            module.running_var = running_var
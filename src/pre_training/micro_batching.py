@@ -0,0 +1,161 @@
+"""
+Provides gradient accumulation over micro-batches, allowing to train with a
+batch size that does not fit into memory at once.
+"""
+import contextlib
+from copy import deepcopy
+from math import ceil
+import torch
+from torch.cuda.amp import autocast
+
+
+def forward_backward_micro_batches(model, inputs, targets, criterion,
+                                   micro_batch_size, scaler=None,
+                                   use_mixed=False, no_sync=None):
+    """
+    Apply `model` to the batch `inputs` in micro-batches of size
+    `micro_batch_size` and, if gradients are enabled, accumulate the gradients
+    of the loss.
+
+    The loss of each micro-batch is weighted by its relative size, so the
+    accumulated gradients equal the ones of the full batch for a `criterion`
+    averaging over the batch (like :class:`torch.nn.MSELoss`). Layers depending
+    on the batch (e.g. batch normalization in training mode) see the
+    micro-batches, though.
+
+    If `inputs` requires gradients (e.g. a perturbation to be updated by
+    free adversarial training), its gradient is propagated once after all
+    micro-batches.
+
+    Parameters
+    ----------
+    model : callable
+        Model.
+    inputs, targets : :class:`torch.Tensor`
+        Batch of inputs and targets.
+    criterion : callable
+        Loss function, averaging over the batch.
+    micro_batch_size : int
+        Size of the micro-batches (the last one may be smaller).
+    scaler : :class:`torch.cuda.amp.GradScaler`, optional
+        Scaler for mixed precision training, applied to each backward pass.
+    use_mixed : bool, optional
+        Whether to use :func:`torch.cuda.amp.autocast`.
+    no_sync : callable, optional
+        Context manager skipping the gradient synchronization of distributed
+        data-parallel training (``DistributedDataParallel.no_sync``), used for
+        all but the last micro-batch.
+
+    Returns
+    -------
+    outputs : :class:`torch.Tensor`
+        Detached outputs for the full batch.
+    loss : :class:`torch.Tensor`
+        Detached loss of the full batch.
+    """
+    batch_size = inputs.shape[0]
+    backward = torch.is_grad_enabled()
+    split_inputs = inputs
+    if backward and inputs.requires_grad and micro_batch_size < batch_size:
+        # backward through the computation of `inputs` only once
+        split_inputs = inputs.detach().requires_grad_(True)
+    micro_batches = list(zip(split_inputs.split(micro_batch_size),
+                             targets.split(micro_batch_size)))
+    outputs_list = []
+    loss = 0.
+    for i, (x, y) in enumerate(micro_batches):
+        last = i == len(micro_batches) - 1
+        with (no_sync() if no_sync is not None and backward and not last
+              else contextlib.nullcontext()):
+            with autocast() if use_mixed else contextlib.nullcontext():
+                outputs = model(x)
+                micro_batch_loss = criterion(outputs, y) * (
+                        x.shape[0] / batch_size)
+            if backward:
+                if scaler is not None:
+                    scaler.scale(micro_batch_loss).backward()
+                else:
+                    micro_batch_loss.backward()
+        outputs_list.append(outputs.detach())
+        loss = loss + micro_batch_loss.detach()
+    if split_inputs is not inputs:
+        inputs.backward(split_inputs.grad)
+    return torch.cat(outputs_list), loss
+
+
+def find_micro_batch_size(model, sample_shape, batch_size, device,
+                          max_memory_fraction=0.8, use_mixed=False):
+    """
+    Find the largest micro-batch size out of ``batch_size``,
+    ``ceil(batch_size / 2)``, ``ceil(batch_size / 4)``, ..., ``1``, for which
+    the peak memory of a forward and backward pass of `model` does not exceed
+    `max_memory_fraction` of the device memory.
+
+    The margin should account for memory not allocated during the probe, like
+    the optimizer state. The parameters and buffers of `model` are restored
+    afterwards. Only cuda devices are supported, since the peak memory is
+    not tracked on other devices.
+
+    Parameters
+    ----------
+    model : :class:`torch.nn.Module`
+        Model (on `device`).
+    sample_shape : tuple of int
+        Shape of a single input sample (including the channel dimension).
+    batch_size : int
+        Full batch size.
+    device : :class:`torch.device`
+        Device.
+    max_memory_fraction : float, optional
+        Fraction of the total device memory that may be used.
+        The default is ``0.8``.
+    use_mixed : bool, optional
+        Whether to probe with :func:`torch.cuda.amp.autocast`.
+
+    Returns
+    -------
+    micro_batch_size : int
+        Micro-batch size.
+
+    Raises
+    ------
+    ValueError
+        If `device` is not a cuda device.
+    """
+    if device.type != 'cuda':
+        raise ValueError(
+                'the micro-batch size can only be determined automatically '
+                'on cuda devices, please specify micro_batch_size explicitly '
+                'for device \'{}\''.format(device))
+    max_memory = (max_memory_fraction *
+                  torch.cuda.get_device_properties(device).total_memory)
+    state_dict = deepcopy(model.state_dict())
+    micro_batch_size = batch_size
+    try:
+        while True:
+            model.zero_grad(set_to_none=True)
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats(device)
+            out_of_memory = False
+            try:
+                x = torch.zeros((micro_batch_size,) + tuple(sample_shape),
+                                device=device)
+                with autocast() if use_mixed else contextlib.nullcontext():
+                    outputs = model(x)
+                    loss = torch.mean(outputs**2)
+                loss.backward()
+            except RuntimeError as e:
+                if 'out of memory' not in str(e):
+                    raise
+                out_of_memory = True
+            x = outputs = loss = None
+            fits = (not out_of_memory and
+                    torch.cuda.max_memory_allocated(device) <= max_memory)
+            if fits or micro_batch_size == 1:
+                break
+            micro_batch_size = ceil(micro_batch_size / 2)
+    finally:
+        model.zero_grad(set_to_none=True)
+        model.load_state_dict(state_dict)
+        torch.cuda.empty_cache()
+    return micro_batch_size
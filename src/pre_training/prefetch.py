@@ -0,0 +1,109 @@
+"""
+Provides :class:`DevicePrefetcher`, overlapping the host-to-device copies (and
+augmentation) of the next batch with the computation on the current batch.
+"""
+import torch
+from .checkpoint import get_rng_states
+
+
+def to_device(batch, device, non_blocking=False):
+    """
+    Move all tensors in a (nested) list/tuple to `device`.
+    """
+    if isinstance(batch, torch.Tensor):
+        return batch.to(device, non_blocking=non_blocking)
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(to_device(b, device, non_blocking=non_blocking)
+                           for b in batch)
+    return batch
+
+
+def _record_stream(batch, stream):
+    if isinstance(batch, torch.Tensor):
+        batch.record_stream(stream)
+    elif isinstance(batch, (list, tuple)):
+        for b in batch:
+            _record_stream(b, stream)
+
+
+class DevicePrefetcher():
+    """
+    Iterator over the batches of a data loader, moved to `device` and
+    optionally transformed.
+
+    On cuda devices, the next batch is copied (with ``non_blocking=True``,
+    which is asynchronous for pinned memory, i.e. a data loader with
+    ``pin_memory=True``) and transformed in a side stream while the current
+    batch is processed. This keeps one batch pending on the device.
+    On other devices (or with ``use_side_stream=False``), each batch is moved
+    and transformed when it is requested.
+
+    Since the pending batch is loaded and transformed ahead of time, random
+    draws from the global generators (python, numpy and torch, e.g. by
+    `transform` or the data loader) happen earlier than without prefetching.
+    :attr:`pending_rng_states` holds the states of all these generators (see
+    :func:`pre_training.checkpoint.get_rng_states`) from before the pending
+    batch was loaded, so a checkpoint can store the states as if the pending
+    batch had not been drawn yet.
+    """
+    def __init__(self, iterable, device, transform=None, use_side_stream=True):
+        """
+        Parameters
+        ----------
+        iterable : iterable
+            Data loader (or iterator over it) yielding a tensor or a tuple of
+            tensors per batch.
+        device : :class:`torch.device` or str
+            Target device.
+        transform : callable, optional
+            Function applied to each batch after moving it to `device`.
+        use_side_stream : bool, optional
+            Whether to prefetch in a side stream on cuda devices.
+            The default is `True`.
+        """
+        self.iterator = iter(iterable)
+        self.device = torch.device(device)
+        self.transform = transform
+        self.stream = (torch.cuda.Stream(device=self.device)
+                       if use_side_stream and self.device.type == 'cuda'
+                       else None)
+        self.num_pending = 0
+        self.pending_rng_states = None
+        self._pending_batch = None
+        if self.stream is not None:
+            self._preload()
+
+    def __iter__(self):
+        return self
+
+    def _load(self, non_blocking=False):
+        batch = to_device(next(self.iterator), self.device,
+                          non_blocking=non_blocking)
+        if self.transform is not None:
+            batch = self.transform(batch)
+        return batch
+
+    def _preload(self):
+        self.pending_rng_states = get_rng_states()
+        try:
+            with torch.cuda.stream(self.stream):
+                self._pending_batch = self._load(non_blocking=True)
+            self.num_pending = 1
+        except StopIteration:
+            self._pending_batch = None
+            self.num_pending = 0
+            self.pending_rng_states = None
+
+    def __next__(self):
+        if self.stream is None:
+            return self._load()
+        if self.num_pending == 0:
+            raise StopIteration
+        current_stream = torch.cuda.current_stream(self.device)
+        current_stream.wait_stream(self.stream)
+        batch = self._pending_batch
+        # the memory was allocated in the side stream, but is used (and may
+        # only be reused after being used) in the current stream
+        _record_stream(batch, current_stream)
+        self._preload()
+        return batch
@@ -2,66 +2,213 @@ import os
 import json
 import socket
 import datetime
-import contextlib
 import odl
 import h5py
 import torch
 import numpy as np
 import torch.nn.functional as F
-import tensorboardX
-import matplotlib.pyplot as plt
 from copy import deepcopy
 from math import ceil
 from tqdm import tqdm, trange
 from inspect import signature, Parameter
 from warnings import warn
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, IterableDataset
 from torch.optim.lr_scheduler import CyclicLR, OneCycleLR
 from torch.optim.swa_utils import AveragedModel, SWALR
-from torch.cuda.amp import autocast, GradScaler
+from torch.cuda.amp import GradScaler
+from torch.nn.parallel import DistributedDataParallel
 from deep_image_prior import PSNR, SSIM
 from util.transforms import random_brightness_contrast
+from util.async_logging import LoggingService
+from dataset.dataset import ObservationGroundTruthPairDataset
+from dataset.torch_pair_generation import TorchPairGenerator
 from functools import partial
-from .adversarial_attacks import PGDAttack
+from .adversarial_attacks import PGDAttack, FreeAttack
+from .distributed import init_distributed, all_reduce_sum
+from .prefetch import DevicePrefetcher
+from .async_validation import ValidationWorker, cache_validation_pairs
+from .micro_batching import (
+        forward_backward_micro_batches, find_micro_batch_size)
+from .checkpoint import (
+        CheckpointWriter, load_checkpoint, get_rng_states, set_rng_states)
+
+def _imshow(fig, ax, image, title):
+    im = ax.imshow(image[0].T, cmap='gray')
+    fig.colorbar(im, ax=ax)
+    ax.set_title(title)
+
+def _render_cost_convergence(fig, costs):
+    ax = fig.subplots()
+    ax.plot(costs)
+    ax.set_xlabel('adversarial steps')
+    ax.set_ylabel('cost')
+    fig.tight_layout()
+
+def _render_adversarial_fbp(fig, adv_fbp, orig_fbp):
+    ax = fig.subplots(1, 3)
+    _imshow(fig, ax[0], adv_fbp, 'adv_fbp')
+    _imshow(fig, ax[1], orig_fbp, 'orig_fbp')
+    _imshow(fig, ax[2], adv_fbp-orig_fbp, 'adv_fbp-orig_fbp')
+    fig.tight_layout()
+
+def _render_adversarial_output(fig, adv_output, orig_output, gt):
+    ax = fig.subplots(1, 6)
+    _imshow(fig, ax[0], adv_output, 'adv_output')
+    _imshow(fig, ax[1], orig_output, 'orig_output')
+    _imshow(fig, ax[2], adv_output-orig_output, 'adv_output-orig_output')
+    _imshow(fig, ax[3], gt, 'gt')
+    _imshow(fig, ax[4], adv_output-gt, 'adv_output-gt')
+    _imshow(fig, ax[5], orig_output-gt, 'orig_output-gt')
+    fig.tight_layout()
 
 class Trainer():
 
     """
     Wrapper for pre-trainig a model.
+
+    If ``cfg.distributed`` is `True` and the process is launched by
+    ``torchrun`` (or :func:`pre_training.distributed.spawn`), the model is
+    trained data-parallel, with each process using a shard of the train and
+    validation folds (``cfg.batch_size`` is the batch size per process).
+    Logging and saving parameters are performed by rank 0 only.
+
+    Batches are moved to the device and augmented by a
+    :class:`pre_training.prefetch.DevicePrefetcher`, which on cuda prepares
+    the next batch in a side stream (unless ``cfg.prefetch_to_device`` is
+    `False`).
+
+    If ``cfg.micro_batch_size`` is smaller than ``cfg.batch_size``, each batch
+    is processed in micro-batches, accumulating the gradients for one
+    optimizer (and scheduler) step per batch (see
+    :mod:`pre_training.micro_batching`). With ``'auto'``, the largest
+    micro-batch size fitting into the device memory is determined (cuda
+    only).
+
+    Validation is performed every ``cfg.validation_interval`` epochs (and
+    after the last one). If ``cfg.validation_len`` is specified, a fixed
+    subset of this size is generated once and kept in memory. With
+    ``cfg.async_validation``, the (cached) validation is run by a
+    :class:`pre_training.async_validation.ValidationWorker` process on
+    snapshots of the weights while training continues; the best model is
+    selected as the results arrive (and after training).
+
+    Tensorboard logging is performed by a :class:`util.async_logging.LoggingService`,
+    writing scalars and rendering figures in a background thread (unless
+    ``cfg.async_logging`` is `False`).
+
+    If ``cfg.checkpoint_path`` is specified, the full training state is saved
+    after each epoch and every ``cfg.checkpoint_interval`` training steps (see
+    :mod:`pre_training.checkpoint`). With ``cfg.resume``, training continues
+    from this checkpoint at the saved batch, restoring the random number
+    generator states (of rank 0 in case of distributed training) and skipping
+    the batches already processed in the current epoch.
     """
     def __init__(self, model, ray_trafos, cfg):
         self.model = model
         self.ray_trafos = ray_trafos
         self.cfg = cfg
-        self.device = torch.device(('cuda:0' if torch.cuda.is_available() else 'cpu'))
-        current_time = datetime.datetime.now().strftime('%b%d_%H-%M-%S')
-        comment = 'trainer.train'
-        logdir = os.path.join(
-            cfg.log_path,
-            current_time + '_' + socket.gethostname() + comment)
-        self.writer = tensorboardX.SummaryWriter(logdir=logdir)
+        self.distributed_backend = self.cfg.get('distributed_backend', 'gloo')
+        if self.cfg.get('distributed', False):
+            self.rank, self.world_size = init_distributed(
+                    self.distributed_backend)
+        else:
+            self.rank, self.world_size = 0, 1
+        cuda_index = (int(os.environ.get('LOCAL_RANK', 0))
+                      if self.world_size > 1 else 0)
+        self.device = torch.device(('cuda:{:d}'.format(cuda_index) if torch.cuda.is_available() else 'cpu'))
+        self.writer = None
+        if self.is_main_process:
+            current_time = datetime.datetime.now().strftime('%b%d_%H-%M-%S')
+            comment = 'trainer.train'
+            logdir = os.path.join(
+                cfg.log_path,
+                current_time + '_' + socket.gethostname() + comment)
+            self.writer = LoggingService(
+                    logdir=logdir,
+                    asynchronous=self.cfg.get('async_logging', True))
         if self.cfg.use_adversarial_attacks:
-            self.adversarial_attack = PGDAttack(model=model, ray_trafos=ray_trafos,
-                                                steps=cfg.adversarial_attacks.steps,
-                                                eps=cfg.adversarial_attacks.eps,
-                                                alpha=cfg.adversarial_attacks.alpha)
+            adversarial_mode = cfg.adversarial_attacks.get('mode', 'pgd')
+            fbp_mode = cfg.adversarial_attacks.get('fbp_mode', 'odl')
+            if adversarial_mode == 'pgd':
+                self.adversarial_attack = PGDAttack(model=model, ray_trafos=ray_trafos,
+                                                    steps=cfg.adversarial_attacks.steps,
+                                                    eps=cfg.adversarial_attacks.eps,
+                                                    alpha=cfg.adversarial_attacks.alpha,
+                                                    fbp_mode=fbp_mode,
+                                                    early_stop_tol=cfg.adversarial_attacks.get('early_stop_tol'))
+            elif adversarial_mode == 'free':
+                self.adversarial_attack = FreeAttack(model=model, ray_trafos=ray_trafos,
+                                                     eps=cfg.adversarial_attacks.eps,
+                                                     alpha=cfg.adversarial_attacks.alpha,
+                                                     fbp_mode=fbp_mode)
+            else:
+                raise ValueError('Unknown adversarial attacks mode \'{}\''.format(
+                        adversarial_mode))
+
+    @property
+    def is_main_process(self):
+        return self.rank == 0
+
+    @property
+    def num_epochs(self):
+        """
+        Number of epochs to train. With free adversarial training, each batch
+        is replayed ``cfg.adversarial_attacks.free_replays`` times, so
+        ``cfg.epochs`` is divided by this number (rounding up), keeping the
+        number of parameter updates (cf. Shafahi et al., 2019).
+        """
+        if (self.cfg.use_adversarial_attacks and
+                self.cfg.adversarial_attacks.get('mode', 'pgd') == 'free'):
+            return ceil(self.cfg.epochs /
+                        self.cfg.adversarial_attacks.get('free_replays', 4))
+        return self.cfg.epochs
 
     def train(self, dataset):
         if self.cfg.torch_manual_seed:
             torch.random.manual_seed(self.cfg.torch_manual_seed)
+        # each process uses its own shard of the folds
+        shard_kwargs = ({'num_shards': self.world_size,
+                         'shard_index': self.rank}
+                        if self.world_size > 1 else {})
         # create PyTorch datasets
-        dataset_train = dataset.create_torch_dataset(
-            fold='train', reshape=((1,) + dataset.space[0].shape,
-                                   (1,) + dataset.space[1].shape,
-                                   (1,) + dataset.space[1].shape))
-
-        dataset_validation = dataset.create_torch_dataset(
-            fold='validation', reshape=((1,) + dataset.space[0].shape,
-                                        (1,) + dataset.space[1].shape,
-                                        (1,) + dataset.space[1].shape))
+        batched_pair_generation = self.cfg.get('batched_pair_generation', False)
+        if batched_pair_generation:
+            if not isinstance(dataset, ObservationGroundTruthPairDataset):
+                # e.g. a ShardedDataset with pre-generated pairs
+                raise ValueError(
+                        'batched_pair_generation requires a dataset '
+                        'generating the pairs from the ground truth, it '
+                        'cannot be combined with pre-generated pairs (e.g. '
+                        'shards_path)')
+            # load ground truth only, pairs are generated batch-wise on the
+            # device right before the network step
+            pair_generator = TorchPairGenerator.from_dataset(
+                    dataset, self.ray_trafos, device=self.device,
+                    shard_index=self.rank).to(self.device)
+            gt_dataset = dataset.get_ground_truth_dataset()
+            dataset_train = gt_dataset.create_torch_dataset(
+                fold='train', reshape=((1,) + dataset.space[1].shape,),
+                **shard_kwargs)
+            dataset_validation = gt_dataset.create_torch_dataset(
+                fold='validation', reshape=((1,) + dataset.space[1].shape,),
+                **shard_kwargs)
+        else:
+            dataset_train = dataset.create_torch_dataset(
+                fold='train', reshape=((1,) + dataset.space[0].shape,
+                                       (1,) + dataset.space[1].shape,
+                                       (1,) + dataset.space[1].shape),
+                **shard_kwargs)
+
+            dataset_validation = dataset.create_torch_dataset(
+                fold='validation', reshape=((1,) + dataset.space[0].shape,
+                                            (1,) + dataset.space[1].shape,
+                                            (1,) + dataset.space[1].shape),
+                **shard_kwargs)
 
         criterion = torch.nn.MSELoss()
         self.init_optimizer()
+        adversarial_mode = (self.cfg.adversarial_attacks.get('mode', 'pgd')
+                            if self.cfg.use_adversarial_attacks else None)
 
         transforms = []
         for transform in self.cfg.get('transforms', []):
@@ -81,15 +228,40 @@ class Trainer():
                 raise ValueError(
                         'Unknown transform \'{}\''.format(transform.name))
 
+        def apply_transforms(batch):
+            obs, fbp, gt = batch
+            for transform in transforms:
+                fbp, gt = transform([fbp, gt])
+            return obs, fbp, gt
+
+        validation_interval = self.cfg.get('validation_interval') or 1
+        validation_len = self.cfg.get('validation_len')
+        async_validation = self.cfg.get('async_validation', False)
+        if async_validation and self.world_size > 1:
+            raise ValueError(
+                    'async validation is not supported for distributed training')
+        # fixed validation subset, generated once and kept in memory
+        cache_validation = validation_len is not None or async_validation
+        if cache_validation:
+            dataset_validation = cache_validation_pairs(
+                    dataset_validation,
+                    num_samples=(validation_len // self.world_size
+                                 if validation_len is not None else None),
+                    pair_generator=(pair_generator if batched_pair_generation
+                                    else None),
+                    batch_size=self.cfg.batch_size)
+
         # create PyTorch dataloaders
+        # (iterable datasets, e.g. streamed from shards, shuffle themselves)
         data_loaders = {'train': DataLoader(dataset_train, batch_size=self.cfg.batch_size,
-            num_workers=self.cfg.num_data_loader_workers, shuffle=True,
+            num_workers=self.cfg.num_data_loader_workers,
+            shuffle=not isinstance(dataset_train, IterableDataset),
             pin_memory=True),
                         'validation': DataLoader(dataset_validation, batch_size=self.cfg.batch_size,
-            num_workers=self.cfg.num_data_loader_workers,
-            shuffle=True, pin_memory=True)}
-
-        dataset_sizes = {'train': len(dataset_train), 'validation': len(dataset_validation)}
+            num_workers=(0 if cache_validation else self.cfg.num_data_loader_workers),
+            shuffle=not (isinstance(dataset_validation, IterableDataset) or
+                         cache_validation),
+            pin_memory=True)}
 
         self.init_scheduler()
         if self._scheduler is not None:
@@ -109,6 +281,16 @@ class Trainer():
         self.model.to(self.device)
         self.model.train()
 
+        if self.world_size > 1:
+            # gradients are averaged over the processes; self.model remains
+            # the plain module (used for validation, SWA and saving)
+            train_model = DistributedDataParallel(
+                    self.model,
+                    device_ids=([self.device] if self.device.type == 'cuda'
+                                else None))
+        else:
+            train_model = self.model
+
         if self.cfg.perform_swa:
             self.swa_model = AveragedModel(self.model)
 
@@ -117,80 +299,272 @@ class Trainer():
         if self.cfg.use_mixed:
             scaler = GradScaler()
 
+        micro_batch_size = self.cfg.get('micro_batch_size') or self.cfg.batch_size
+        if micro_batch_size == 'auto':
+            micro_batch_size = find_micro_batch_size(
+                    self.model,
+                    sample_shape=((2 if self.cfg.add_randn_mask else 1,) +
+                                  dataset.space[1].shape),
+                    batch_size=self.cfg.batch_size, device=self.device,
+                    max_memory_fraction=self.cfg.get(
+                            'micro_batch_max_memory_fraction', 0.8),
+                    use_mixed=self.cfg.use_mixed)
+            if self.is_main_process:
+                print('Using micro-batch size {:d}'.format(micro_batch_size))
+
         num_iter = 0
-        for epoch in range(self.cfg.epochs):
-            # Each epoch has a training and validation phase
-            for phase in ['train', 'validation']:
+        scale = None
+        start_epoch = 0
+        resume_state = None
+        checkpoint_path = self.cfg.get('checkpoint_path')
+        if checkpoint_path is not None:
+            checkpoint_path = (checkpoint_path if checkpoint_path.endswith('.pt')
+                               else checkpoint_path + '.pt')
+        if (self.cfg.get('resume', False) and checkpoint_path is not None and
+                os.path.isfile(checkpoint_path)):
+            resume_state = load_checkpoint(checkpoint_path)
+            self.model.load_state_dict(resume_state['model'])
+            self._optimizer.load_state_dict(resume_state['optimizer'])
+            if self._scheduler is not None:
+                self._scheduler.load_state_dict(resume_state['scheduler'])
+            if self.cfg.use_mixed:
+                scaler.load_state_dict(resume_state['scaler'])
+            if self.cfg.perform_swa:
+                self.swa_model.load_state_dict(resume_state['swa_model'])
+                self.swa_scheduler.load_state_dict(
+                        resume_state['swa_scheduler'])
+            best_model_wts = resume_state['best_model_wts']
+            best_psnr = resume_state['best_psnr']
+            num_iter = resume_state['num_iter']
+            scale = resume_state['last_scale']
+            start_epoch = resume_state['epoch']
+        checkpoint_writer = (CheckpointWriter(checkpoint_path)
+                             if checkpoint_path is not None and
+                             self.is_main_process else None)
+        checkpoint_interval = self.cfg.get('checkpoint_interval')
+
+        validation_worker = None
+        if async_validation:
+            validation_worker = ValidationWorker(
+                    self.model, dataset_validation,
+                    batch_size=self.cfg.batch_size, device=self.device,
+                    add_randn_mask=self.cfg.add_randn_mask)
+            if resume_state is not None:
+                for key, state_dict in resume_state.get(
+                        'pending_validation', {}).items():
+                    validation_worker.submit(key, state_dict)
+
+        def process_validation_results(results):
+            # select the best model from the asynchronously validated
+            # snapshots, in the order of training
+            nonlocal best_psnr, best_model_wts
+            for key, loss, psnr, state_dict in sorted(
+                    results, key=lambda r: r[0]):
+                if self.writer is not None:
+                    self.writer.add_scalar('val_loss', loss, key)
+                    self.writer.add_scalar('val_psnr', psnr, key)
+                if psnr > best_psnr:
+                    best_psnr = psnr
+                    best_model_wts = state_dict
+                    if self.cfg.save_best_learned_params_path is not None:
+                        self.save_learned_params(
+                            self.cfg.save_best_learned_params_path,
+                            state_dict=state_dict)
+
+        prefetcher = None
+
+        def save_checkpoint(epoch, num_batches):
+            # `epoch` and `num_batches` are the next epoch and the number of
+            # batches processed in its train phase
+            if (prefetcher is not None and
+                    prefetcher.pending_rng_states is not None):
+                # states before the prefetcher loaded the next batch
+                rng_states = prefetcher.pending_rng_states
+            else:
+                rng_states = get_rng_states()
+            checkpoint_writer.save({
+                'model': self.model.state_dict(),
+                'optimizer': self._optimizer.state_dict(),
+                'scheduler': (self._scheduler.state_dict()
+                              if self._scheduler is not None else None),
+                'scaler': scaler.state_dict() if self.cfg.use_mixed else None,
+                'swa_model': (self.swa_model.state_dict()
+                              if self.cfg.perform_swa else None),
+                'swa_scheduler': (self.swa_scheduler.state_dict()
+                                  if self.cfg.perform_swa else None),
+                'best_model_wts': best_model_wts,
+                'best_psnr': best_psnr,
+                'epoch': epoch,
+                'num_batches': num_batches,
+                'num_iter': num_iter,
+                'last_scale': scale,
+                'running_stats': ((running_loss, running_psnr, running_size)
+                                  if num_batches > 0 else None),
+                'pending_validation': (validation_worker.pending
+                                       if validation_worker is not None
+                                       else {}),
+                'rng_states_epoch_start': rng_states_epoch_start,
+                'rng_states': rng_states,
+                'pair_generator_rng_states': (
+                        {fold: random_gen.get_state() for fold, random_gen
+                         in pair_generator.random_gens.items()}
+                        if batched_pair_generation else None)})
+
+        for epoch in range(start_epoch, self.num_epochs):
+            # Each epoch has a training and (every `validation_interval`
+            # epochs) a validation phase, which is run by the validation
+            # worker in case of async validation
+            validate_epoch = ((epoch + 1) % validation_interval == 0 or
+                              epoch + 1 == self.num_epochs)
+            phases = ['train']
+            if validate_epoch and not async_validation:
+                phases.append('validation')
+            for phase in phases:
                 if phase == 'train':
-                    self.model.train()  # Set model to training mode
+                    train_model.train()  # Set model to training mode
                 else:
-                    self.model.eval()  # Set model to evaluate mode
+                    train_model.eval()  # Set model to evaluate mode
+
+                # the cached validation subset contains the generated pairs
+                generate_pairs = batched_pair_generation and not (
+                        phase == 'validation' and cache_validation)
+                if generate_pairs:
+                    # same noise per epoch, like the non-batched generator
+                    pair_generator.reset(phase)
+                if hasattr(data_loaders[phase].dataset, 'set_epoch'):
+                    data_loaders[phase].dataset.set_epoch(epoch)
 
                 running_psnr = 0.0
                 running_loss = 0.0
                 running_size = 0
-                with tqdm(data_loaders[phase],
+                num_batches = 0
+                if phase == 'train' and resume_state is not None:
+                    num_batches = resume_state['num_batches']
+                    # the data loader iterator draws from the global random
+                    # number generators when created
+                    set_rng_states(resume_state['rng_states_epoch_start']
+                                   if num_batches > 0
+                                   else resume_state['rng_states'])
+                if phase == 'train':
+                    rng_states_epoch_start = get_rng_states()
+                data_iter = iter(data_loaders[phase])
+                if phase == 'train' and resume_state is not None:
+                    for _ in range(num_batches):
+                        next(data_iter)
+                    if num_batches > 0:
+                        running_loss, running_psnr, running_size = (
+                                resume_state['running_stats'])
+                        set_rng_states(resume_state['rng_states'])
+                    if batched_pair_generation:
+                        for fold, state in resume_state[
+                                'pair_generator_rng_states'].items():
+                            pair_generator.reset(fold)
+                            pair_generator.random_gens[fold].set_state(state)
+                    resume_state = None
+                # the transforms are applied by the prefetcher, except for
+                # batched pair generation, which only yields the ground truth
+                prefetcher = DevicePrefetcher(
+                        data_iter, self.device,
+                        transform=(apply_transforms
+                                   if phase == 'train' and transforms and
+                                   not generate_pairs else None),
+                        use_side_stream=self.cfg.get('prefetch_to_device', True))
+                with tqdm(prefetcher,
+                          total=len(data_loaders[phase]), initial=num_batches,
                           desc='epoch {:d}'.format(epoch + 1),
                           disable=not self.cfg.show_pbar) as pbar:
-                    for obs, fbp, gt in pbar:
+                    for batch in pbar:
 
-                        if phase == 'train':
-                            for transform in transforms:
-                                fbp, gt = transform([fbp, gt])
+                        if generate_pairs:
+                            obs, fbp, gt = pair_generator(batch, fold=phase)
+                            if phase == 'train':
+                                obs, fbp, gt = apply_transforms((obs, fbp, gt))
+                        else:
+                            obs, fbp, gt = batch
 
-                            if self.cfg.use_adversarial_attacks:
+                        if phase == 'train':
+                            if (self.cfg.use_adversarial_attacks and
+                                    adversarial_mode == 'pgd'):
                                 tmp_fbp = fbp.clone()
-                                fbp, costs = self.adversarial_attack(obs, gt)
-
-                                if (self.cfg.adversarial_attacks.log_interval and
+                                # attack each micro-batch, costs are logged
+                                # for the first one
+                                adv_fbps, all_costs = zip(*[
+                                        self.adversarial_attack(obs_, gt_)
+                                        for obs_, gt_ in zip(
+                                                obs.split(micro_batch_size),
+                                                gt.split(micro_batch_size))])
+                                fbp, costs = torch.cat(adv_fbps), all_costs[0]
+
+                                if (self.writer is not None and
+                                        self.cfg.adversarial_attacks.log_interval and
                                             num_iter % self.cfg.adversarial_attacks.log_interval == 0):
                                     self.log_adversarial(
                                             num_iter=num_iter, adv_fbp=fbp,
                                             orig_fbp=tmp_fbp, gt=gt,
                                             costs=costs)
 
-                        fbp = fbp.to(self.device)
-                        gt = gt.to(self.device)
-
-                        if self.cfg.add_randn_mask:
-                            fbp = torch.cat([fbp, 0.1*torch.randn(*fbp.shape).to(self.device)], dim=1)
-
-                        # zero the parameter gradients
-                        self._optimizer.zero_grad()
-
-                        # forward
-                        # track gradients only if in train phase
-                        with torch.set_grad_enabled(phase == 'train'):
-                            with autocast() if self.cfg.use_mixed else contextlib.nullcontext():
-                                outputs = self.model(fbp)
-                                loss = criterion(outputs, gt)
-
-                            # backward + optimize only if in training phase
-                            if phase == 'train':
-                                if self.cfg.use_mixed:
-                                    scaler.scale(loss).backward()
-                                    scaler.unscale_(self._optimizer)
-                                else:
-                                    loss.backward()
-                                torch.nn.utils.clip_grad_norm_(
-                                    self.model.parameters(), max_norm=1)
-                                if self.cfg.use_mixed:
-                                    scaler.step(self._optimizer)
-                                    scale = scaler.get_scale()
-                                    scaler.update()
-                                else:
-                                    self._optimizer.step()
-                                if (self._scheduler is not None and
-                                        schedule_every_batch and
-                                        not (self.cfg.perform_swa and
-                                            epoch >= self.cfg.swa.start_epoch)):
+                        # "free" adversarial training replays the batch,
+                        # updating the parameters and the perturbation
+                        free_adversarial = (
+                                phase == 'train' and
+                                self.cfg.use_adversarial_attacks and
+                                adversarial_mode == 'free')
+                        num_replays = (
+                                self.cfg.adversarial_attacks.get('free_replays', 4)
+                                if free_adversarial else 1)
+                        for replay in range(num_replays):
+                            if free_adversarial:
+                                fbp = self.adversarial_attack.perturb(obs)
+                            fbp = fbp.to(self.device)
+                            gt = gt.to(self.device)
+
+                            if self.cfg.add_randn_mask:
+                                fbp = torch.cat([fbp, 0.1*torch.randn_like(fbp)], dim=1)
+
+                            # zero the parameter gradients
+                            self._optimizer.zero_grad()
+
+                            # forward (and backward), accumulating the
+                            # gradients over micro-batches
+                            # track gradients only if in train phase
+                            with torch.set_grad_enabled(phase == 'train'):
+                                outputs, loss = forward_backward_micro_batches(
+                                        train_model if phase == 'train' else self.model,
+                                        fbp, gt, criterion, micro_batch_size,
+                                        scaler=(scaler if self.cfg.use_mixed and
+                                                phase == 'train' else None),
+                                        use_mixed=self.cfg.use_mixed,
+                                        no_sync=(train_model.no_sync
+                                                 if self.world_size > 1 else None))
+
+                                # optimize only if in training phase
+                                if phase == 'train':
                                     if self.cfg.use_mixed:
-                                        # avoid calling scheduler before optimizer in case of nan/inf values
-                                        # https://discuss.pytorch.org/t/optimizer-step-before-lr-scheduler-step-error-using-gradscaler/92930/8
-                                        if scaler.get_scale() == scale:
-                                            self._scheduler.step()
+                                        scaler.unscale_(self._optimizer)
+                                    if free_adversarial:
+                                        # perturbation gradient from the same
+                                        # backward pass
+                                        self.adversarial_attack.step()
+                                    torch.nn.utils.clip_grad_norm_(
+                                        self.model.parameters(), max_norm=1)
+                                    if self.cfg.use_mixed:
+                                        scaler.step(self._optimizer)
+                                        scale = scaler.get_scale()
+                                        scaler.update()
                                     else:
-                                        self._scheduler.step()
+                                        self._optimizer.step()
+                                    if (self._scheduler is not None and
+                                            schedule_every_batch and
+                                            replay == num_replays - 1 and
+                                            not (self.cfg.perform_swa and
+                                                epoch >= self.cfg.swa.start_epoch)):
+                                        if self.cfg.use_mixed:
+                                            # avoid calling scheduler before optimizer in case of nan/inf values
+                                            # https://discuss.pytorch.org/t/optimizer-step-before-lr-scheduler-step-error-using-gradscaler/92930/8
+                                            if scaler.get_scale() == scale:
+                                                self._scheduler.step()
+                                        else:
+                                            self._scheduler.step()
 
                         for i in range(outputs.shape[0]):
                             gt_ = gt[i, 0].detach().cpu().numpy()
@@ -207,6 +581,8 @@ class Trainer():
 
                         if phase == 'train':
                             num_iter += 1
+                            num_batches += 1
+                        if phase == 'train' and self.writer is not None:
                             self.writer.add_scalar('loss', running_loss/running_size, num_iter)
                             self.writer.add_scalar('psnr', running_psnr/running_size, num_iter)
                             self.writer.add_scalar('lr', self.optimizer.param_groups[0]['lr'], num_iter)
@@ -217,6 +593,12 @@ class Trainer():
                             self.save_learned_params(
                                 '{}_epochs{:d}_steps{:d}'.format(self.cfg.save_learned_params_base_path, epoch, ceil(running_size / self.cfg.batch_size)))
 
+                        if (phase == 'train' and
+                                checkpoint_writer is not None and
+                                checkpoint_interval and
+                                num_iter % checkpoint_interval == 0):
+                            save_checkpoint(epoch, num_batches)
+
                     if phase == 'train':
                         if (self.cfg.perform_swa
                                 and epoch >= self.cfg.swa.start_epoch):
@@ -232,10 +614,16 @@ class Trainer():
                             else:
                                 self._scheduler.step()
 
-                    epoch_loss = running_loss / dataset_sizes[phase]
-                    epoch_psnr = running_psnr / dataset_sizes[phase]
+                    # aggregate over all processes, so that all of them
+                    # select the same best model
+                    running_loss, running_psnr, running_size = all_reduce_sum(
+                            [running_loss, running_psnr, running_size],
+                            device=('cpu' if self.distributed_backend == 'gloo'
+                                    else self.device))
+                    epoch_loss = running_loss / running_size
+                    epoch_psnr = running_psnr / running_size
 
-                    if phase == 'validation':
+                    if phase == 'validation' and self.writer is not None:
                         self.writer.add_scalar('val_loss', epoch_loss, num_iter)
                         self.writer.add_scalar('val_psnr', epoch_psnr, num_iter)
 
@@ -246,13 +634,29 @@ class Trainer():
                         if self.cfg.save_best_learned_params_path is not None:
                             self.save_learned_params(
                                 self.cfg.save_best_learned_params_path)
-                    if (phase =='validation' and
-                            self.cfg.get('save_learned_params_base_path') is not None and
-                            (epoch + 1) % self.cfg.get('save_learned_params_interval', self.cfg.epochs) == 0):
-                        self.save_learned_params(
-                            '{}_epochs{:d}'.format(self.cfg.save_learned_params_base_path, epoch + 1))
 
-        print('Best val psnr: {:4f}'.format(best_psnr))
+            if validation_worker is not None:
+                if validate_epoch:
+                    validation_worker.submit(num_iter, self.model.state_dict())
+                process_validation_results(validation_worker.poll())
+
+            if (self.cfg.get('save_learned_params_base_path') is not None and
+                    (epoch + 1) % self.cfg.get('save_learned_params_interval', self.num_epochs) == 0):
+                self.save_learned_params(
+                    '{}_epochs{:d}'.format(self.cfg.save_learned_params_base_path, epoch + 1))
+
+            if checkpoint_writer is not None:
+                save_checkpoint(epoch + 1, 0)
+
+        if validation_worker is not None:
+            process_validation_results(validation_worker.wait())
+            validation_worker.close()
+
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
+
+        if self.is_main_process:
+            print('Best val psnr: {:4f}'.format(best_psnr))
         if self.cfg.perform_swa:
             self.best_model = deepcopy(self.model)
             self.best_model.load_state_dict(best_model_wts)
@@ -263,58 +667,27 @@ class Trainer():
                     self.cfg.save_swa_learned_params_path)
         else:
             self.model.load_state_dict(best_model_wts)
-        self.writer.close()
+        if self.writer is not None:
+            self.writer.close()
 
     def log_adversarial(self, num_iter, adv_fbp, orig_fbp, gt, costs):
-        fig, ax = plt.subplots()
-        ax.plot(costs)
-        ax.set_xlabel('adversarial steps')
-        ax.set_ylabel('cost')
-        fig.tight_layout()
-        self.writer.add_figure('cost_convergence', fig, num_iter)
-
-        fig, ax = plt.subplots(1, 3, figsize=(13, 3.5))
-        im = ax[0].imshow(adv_fbp.cpu()[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[0])
-        ax[0].set_title('adv_fbp')
-        im = ax[1].imshow(orig_fbp.cpu()[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[1])
-        ax[1].set_title('orig_fbp')
-        im = ax[2].imshow((adv_fbp.cpu()-orig_fbp.cpu())[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[2])
-        ax[2].set_title('adv_fbp-orig_fbp')
-        fig.tight_layout()
-        self.writer.add_figure('adversarial_fbp', fig, num_iter)
-
         mode = self.model.training
         self.model.eval()
         with torch.no_grad():
-            adv_outputs = self.model(adv_fbp.to(self.device))
-            orig_outputs = self.model(orig_fbp.to(self.device))
+            adv_outputs = self.model(adv_fbp[:1].to(self.device))
+            orig_outputs = self.model(orig_fbp[:1].to(self.device))
         self.model.train(mode)
 
-        fig, ax = plt.subplots(1, 6, figsize=(24, 3.5))
-        im = ax[0].imshow(adv_outputs.cpu()[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[0])
-        ax[0].set_title('adv_output')
-        im = ax[1].imshow(orig_outputs.cpu()[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[1])
-        ax[1].set_title('orig_output')
-        im = ax[2].imshow((adv_outputs.cpu()-orig_outputs.cpu())[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[2])
-        ax[2].set_title('adv_output-orig_output')
-        im = ax[3].imshow(gt.cpu()[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[3])
-        ax[3].set_title('gt')
-        im = ax[4].imshow((adv_outputs.cpu()-gt.cpu())[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[4])
-        ax[4].set_title('adv_output-gt')
-        im = ax[5].imshow((orig_outputs.cpu()-gt.cpu())[0].numpy().T, cmap='gray')
-        fig.colorbar(im, ax=ax[5])
-        ax[5].set_title('orig_output-gt')
-        fig.tight_layout()
-        self.writer.add_figure('adversarial_output', fig, num_iter)
-
+        # the figures are rendered from CPU copies by the logging service
+        self.writer.add_figure('cost_convergence', _render_cost_convergence,
+                               {'costs': costs}, num_iter)
+        self.writer.add_figure('adversarial_fbp', _render_adversarial_fbp,
+                               {'adv_fbp': adv_fbp[0], 'orig_fbp': orig_fbp[0]},
+                               num_iter, figsize=(13, 3.5))
+        self.writer.add_figure('adversarial_output', _render_adversarial_output,
+                               {'adv_output': adv_outputs[0],
+                                'orig_output': orig_outputs[0], 'gt': gt[0]},
+                               num_iter, figsize=(24, 3.5))
 
     def init_optimizer(self):
         """
@@ -342,14 +715,15 @@ class Trainer():
         if self.cfg.scheduler.lower() == 'cosine':
             self._scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
                 self.optimizer,
-                T_max=self.cfg.epochs,
+                T_max=self.num_epochs,
                 eta_min=self.cfg.lr_min)
         elif self.cfg.scheduler.lower() == 'onecyclelr':
             self._scheduler = OneCycleLR(
                 self.optimizer,
-                steps_per_epoch=ceil(self.cfg.train_len / self.cfg.batch_size),
+                steps_per_epoch=ceil((self.cfg.train_len // self.world_size) /
+                                     self.cfg.batch_size),
                 max_lr=self.cfg.max_lr,
-                epochs=self.cfg.epochs)
+                epochs=self.num_epochs)
         else:
             raise KeyError
 
@@ -366,13 +740,18 @@ class Trainer():
     def scheduler(self, value):
         self._scheduler = value
 
-    def save_learned_params(self, path):
+    def save_learned_params(self, path, state_dict=None):
         """
-        Save learned parameters from file.
+        Save learned parameters from file (only by the main process).
+        By default, the current parameters of the model are saved, otherwise
+        `state_dict`.
         """
+        if not self.is_main_process:
+            return
         path = path if path.endswith('.pt') else path + '.pt'
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        torch.save(self.model.state_dict(), path)
+        torch.save(state_dict if state_dict is not None
+                   else self.model.state_dict(), path)
 
     def load_learned_params(self, path):
         """
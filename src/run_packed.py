@@ -0,0 +1,116 @@
+"""
+Run many small hydra jobs (by default ``coordinator.py`` runs, e.g. 2D DIP
+reconstructions) concurrently on a single CPU node, see
+:class:`util.packing.PackingScheduler`. This replaces hydra's ``--multirun``,
+which runs the jobs one after another.
+
+The jobs are given by lines of hydra overrides in a file (``--jobs_file``),
+and/or by a sweep like for ``--multirun`` (all combinations of the comma
+separated values, where commas inside brackets or quotes do not separate
+values, e.g. ``mdl.optim.gamma_sweep=[1e-4,2e-4],[1e-3,2e-3]`` yields two
+values). Each job is run in ``OUTPUT_DIR/<index>`` (via
+``hydra.run.dir``), its output is written to ``OUTPUT_DIR/logs``, and the
+status summary (including the throughput in reconstructions per hour) to
+``OUTPUT_DIR/packed_status.json``.
+
+Example:
+
+    python run_packed.py --output_dir packed_runs/gamma --iterations 5000 --sweep +experiment=no_pretrain mdl.optim.gamma=1e-4,2e-4,5e-4 mdl.optim.iterations=5000
+"""
+import os
+import sys
+import json
+import shlex
+import argparse
+import itertools
+from util.packing import PackingScheduler
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--script', type=str, default=os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), 'coordinator.py'))
+parser.add_argument('--jobs_file', type=str, default=None,
+                    help='file with one line of hydra overrides per job')
+parser.add_argument('--sweep', type=str, nargs='*', default=[],
+                    help='hydra overrides, comma separated values are swept')
+parser.add_argument('--output_dir', type=str, required=True)
+parser.add_argument('--num_cores', type=int, default=None)
+parser.add_argument('--concurrency', type=int, default=1,
+                    help='initial number of concurrent jobs')
+parser.add_argument('--max_concurrency', type=int, default=None)
+parser.add_argument('--num_threads_per_job', type=int, default=None)
+parser.add_argument('--no_adaptive', action='store_true',
+                    help='keep the concurrency fixed')
+parser.add_argument('--num_reconstructions_per_job', type=int, default=1)
+parser.add_argument('--iterations', type=int, default=1,
+                    help='DIP iterations per reconstruction (measuring the '
+                         'throughput in iterations per second)')
+
+def split_sweep_values(value):
+    """
+    Split the value of a sweep override at the commas that are not enclosed
+    in brackets (``[]``, ``{}``, ``()``) or quotes.
+    """
+    values = []
+    start = 0
+    depth = 0
+    quote = None
+    for i, c in enumerate(value):
+        if quote is not None:
+            if c == quote:
+                quote = None
+        elif c in '\'"':
+            quote = c
+        elif c in '[{(':
+            depth += 1
+        elif c in ']})':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            values.append(value[start:i])
+            start = i + 1
+    values.append(value[start:])
+    return values
+
+def get_overrides_list(args):
+    overrides_list = []
+    if args.jobs_file is not None:
+        with open(args.jobs_file, 'r') as f:
+            overrides_list += [shlex.split(line) for line in f
+                               if line.strip() and
+                               not line.lstrip().startswith('#')]
+    if args.sweep:
+        keys, values = zip(*(override.split('=', 1)
+                             for override in args.sweep))
+        for combination in itertools.product(
+                *(split_sweep_values(v) for v in values)):
+            overrides_list.append(['{}={}'.format(k, v)
+                                   for k, v in zip(keys, combination)])
+    return overrides_list
+
+def main():
+    args = parser.parse_args()
+    output_dir = os.path.abspath(args.output_dir)
+    jobs = []
+    for i, overrides in enumerate(get_overrides_list(args)):
+        jobs.append({
+                'name': str(i),
+                'args': [sys.executable, args.script] + overrides + [
+                         'hydra.run.dir={}'.format(
+                                 os.path.join(output_dir, str(i)))],
+                'work': args.num_reconstructions_per_job * args.iterations,
+                'num_reconstructions': args.num_reconstructions_per_job})
+    if not jobs:
+        raise ValueError('No jobs specified, please pass --jobs_file or '
+                         '--sweep')
+    scheduler = PackingScheduler(
+            jobs, num_cores=args.num_cores, concurrency=args.concurrency,
+            max_concurrency=args.max_concurrency,
+            num_threads_per_job=args.num_threads_per_job,
+            adaptive=not args.no_adaptive,
+            summary_filename=os.path.join(output_dir, 'packed_status.json'),
+            log_path=os.path.join(output_dir, 'logs'))
+    summary = scheduler.run()
+    print(json.dumps({k: v for k, v in summary.items() if k != 'jobs'},
+                     indent=1))
+
+if __name__ == '__main__':
+    main()
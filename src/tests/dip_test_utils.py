@@ -0,0 +1,55 @@
+"""
+Small DIP reconstruction problem shared by the tests of
+:class:`deep_image_prior.DeepImagePriorReconstructor`.
+"""
+from types import SimpleNamespace
+import torch
+from omegaconf import OmegaConf
+
+def get_test_cfg(log_path, overrides=None):
+    """
+    Return a model configuration for a small network and 20 iterations,
+    merged with `overrides` (nested dict).
+    """
+    cfg = OmegaConf.create({
+            'arch': {'scales': 2, 'channels': [8, 8],
+                     'skip_channels': [0, 4], 'use_norm': True,
+                     'use_sigmoid': False, 'use_relu_out': None},
+            'optim': {'lr': 1e-3, 'init_lr': 1e-7, 'num_warmup_iter': 0,
+                      'encoder': {'lr': 1e-3, 'init_lr': 1e-7,
+                                  'num_warmup_iter': 0},
+                      'decoder': {'lr': 1e-3, 'init_lr': 1e-7,
+                                  'num_warmup_iter': 0},
+                      'iterations': 20, 'loss_function': 'mse',
+                      'gamma': 1e-4, 'gamma_sweep': None,
+                      'use_scheduler': False, 'use_adaptive_lr': False},
+            'show_pbar': False, 'async_logging': False,
+            'torch_manual_seed': 10, 'use_mixed': False,
+            'load_pretrain_model': False, 'learned_params_path': None,
+            'recon_from_randn': False, 'add_init_reco': False,
+            'log_path': log_path, 'normalize_by_stats': False,
+            'implicit_scaling_except_for_test_data': None})
+    if overrides is not None:
+        cfg = OmegaConf.merge(cfg, overrides)
+    return cfg
+
+def get_test_problem():
+    """
+    Return a 16x16 problem with a fixed random convolution as the ray
+    transform.
+
+    Returns
+    -------
+    problem : :class:`types.SimpleNamespace`
+        Namespace with the attributes `ray_trafo_module`, `reco_space`, `gt`
+        and `noisy_obs` (noise-free).
+    """
+    torch.manual_seed(1)
+    ray_trafo_module = torch.nn.Conv2d(1, 1, 3, padding=1, bias=False)
+    ray_trafo_module.requires_grad_(False)
+    gt = torch.rand(1, 1, 16, 16)
+    with torch.no_grad():
+        noisy_obs = ray_trafo_module(gt)
+    return SimpleNamespace(ray_trafo_module=ray_trafo_module,
+                           reco_space=SimpleNamespace(shape=(16, 16)),
+                           gt=gt, noisy_obs=noisy_obs)
@@ -0,0 +1,105 @@
+import unittest
+import tempfile
+import threading
+import torch
+from util.async_logging import LoggingService, render_figure
+
+class RecordingWriter():
+    """
+    Records the calls, optionally blocking until `release` is set.
+    """
+    def __init__(self):
+        self.scalars = []
+        self.images = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def add_scalar(self, tag, value, step=None):
+        self.scalars.append((tag, value, step))
+
+    def add_image(self, tag, img, step, dataformats='CHW'):
+        self.release.wait()
+        self.images.append((tag, img, step, dataformats))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+rendered_values = []
+
+def render_line(fig, values):
+    rendered_values.append(values)
+    ax = fig.subplots()
+    ax.plot(values)
+
+class TestLoggingService(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_service(self, **kwargs):
+        kwargs.setdefault('flush_interval', 0.01)
+        service = LoggingService(self.tmp_dir.name, **kwargs)
+        service.writer.close()
+        service.writer = RecordingWriter()
+        return service
+
+    def test_scalars(self):
+        # no periodic writing before closing
+        service = self.get_service(max_pending_scalars=3, flush_interval=100.)
+        writer = service.writer
+        for i in range(6):
+            service.add_scalar('loss', float(i), i)
+        service.close()
+        # values 3 to 5 are aggregated into the last pending value
+        self.assertEqual(writer.scalars[:2], [('loss', 0., 0), ('loss', 1., 1)])
+        self.assertEqual(writer.scalars[2], ('loss', (2. + 3. + 4. + 5.) / 4, 5))
+        self.assertEqual(len(writer.scalars), 3)
+
+    def test_drop_when_full(self):
+        service = self.get_service(max_queue_size=2)
+        writer = service.writer
+        writer.release.clear()
+        image = torch.zeros(1, 4, 4)
+        for i in range(10):
+            service.add_image('reco', image, i)
+        writer.release.set()
+        service.close()
+        self.assertLess(len(writer.images), 10)
+        self.assertEqual(len(writer.images) + service.num_dropped, 10)
+        self.assertIn(('logging/num_dropped', service.num_dropped, None),
+                      writer.scalars)
+
+    def test_snapshot(self):
+        service = self.get_service()
+        writer = service.writer
+        writer.release.clear()
+        values = torch.zeros(5)
+        service.add_figure('line', render_line, {'values': values}, 0,
+                           figsize=(2, 2))
+        values += 1.  # must not affect the queued figure
+        writer.release.set()
+        service.close()
+        self.assertEqual(rendered_values[-1].tolist(), [0.] * 5)
+        (tag, image, step, dataformats), = writer.images
+        self.assertEqual((tag, step, dataformats), ('line', 0, 'HWC'))
+        self.assertEqual(
+                image.shape,
+                render_figure(render_line, {'values': values.numpy()},
+                              figsize=(2, 2)).shape)
+
+    def test_synchronous(self):
+        service = self.get_service(asynchronous=False)
+        writer = service.writer
+        service.add_scalar('loss', 1., 0)
+        service.add_figure('line', render_line, {'values': torch.zeros(5)}, 0)
+        self.assertEqual(writer.scalars, [('loss', 1., 0)])
+        self.assertEqual(len(writer.images), 1)
+        service.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from pre_training.async_validation import (
+        ValidationWorker, cache_validation_pairs, validate)
+
+class TestAsyncValidation(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.model = torch.nn.Conv2d(1, 1, 3, padding=1)
+        shape = (10, 1, 8, 8)
+        self.dataset = TensorDataset(
+                torch.rand(shape), torch.rand(shape), torch.rand(shape))
+
+    def test_cache_validation_pairs(self):
+        cached = cache_validation_pairs(self.dataset, num_samples=7,
+                                        batch_size=3)
+        self.assertEqual(len(cached), 7)
+        for x, x_cached in zip(self.dataset.tensors, cached.tensors):
+            self.assertTrue(torch.equal(x[:7], x_cached))
+
+    def test_validation_worker(self):
+        data_loader = DataLoader(self.dataset, batch_size=4)
+        state_dicts = {}
+        expected = {}
+        for key in range(3):
+            with torch.no_grad():
+                self.model.weight.add_(0.1)
+            state_dicts[key] = {k: v.clone() for k, v in
+                                self.model.state_dict().items()}
+            expected[key] = validate(self.model, data_loader, 'cpu')
+        worker = ValidationWorker(self.model, self.dataset, batch_size=4,
+                                  device='cpu')
+        try:
+            for key, state_dict in state_dicts.items():
+                worker.submit(key, state_dict)
+            results = worker.poll() + worker.wait()
+        finally:
+            worker.close()
+        self.assertEqual(sorted(r[0] for r in results), [0, 1, 2])
+        self.assertEqual(worker.pending, {})
+        for key, loss, psnr, state_dict in results:
+            self.assertAlmostEqual(loss, expected[key][0], places=5)
+            self.assertAlmostEqual(psnr, expected[key][1], places=4)
+            self.assertTrue(torch.equal(state_dict['weight'],
+                                        state_dicts[key]['weight']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import random
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import numpy as np
+import torch
+from torch.utils.data import TensorDataset
+import pre_training.checkpoint as checkpoint_module
+from pre_training.checkpoint import (
+        CheckpointWriter, load_checkpoint, get_rng_states, set_rng_states)
+from pre_training.maml_trainer import InfiniteDataLoader
+
+def draw_random_numbers():
+    return (random.random(), np.random.rand(), torch.rand(1).item())
+
+class TestRngStates(unittest.TestCase):
+    def test_restore(self):
+        states = get_rng_states()
+        numbers = draw_random_numbers()
+        set_rng_states(states)
+        self.assertEqual(draw_random_numbers(), numbers)
+
+    def test_restore_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            writer = CheckpointWriter(os.path.join(tmp_path, 'ckpt'))
+            writer.save({'rng_states': get_rng_states()})
+            writer.close()
+            numbers = draw_random_numbers()
+            checkpoint = load_checkpoint(os.path.join(tmp_path, 'ckpt.pt'))
+        set_rng_states(checkpoint['rng_states'])
+        self.assertEqual(draw_random_numbers(), numbers)
+
+class TestCheckpointWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_path.name, 'ckpt.pt')
+
+    def tearDown(self):
+        self.tmp_path.cleanup()
+
+    def test_save(self):
+        writer = CheckpointWriter(self.path)
+        x = torch.zeros(3)
+        writer.save({'x': x, 'epoch': 1})
+        x += 1.  # does not affect the queued copy
+        writer.wait()
+        checkpoint = load_checkpoint(self.path)
+        self.assertEqual(checkpoint['epoch'], 1)
+        self.assertTrue(torch.equal(checkpoint['x'], torch.zeros(3)))
+        writer.save({'x': x, 'epoch': 2})
+        writer.close()
+        checkpoint = load_checkpoint(self.path)
+        self.assertEqual(checkpoint['epoch'], 2)
+        self.assertTrue(torch.equal(checkpoint['x'], torch.ones(3)))
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_save_waits_for_previous_write(self):
+        torch_save = torch.save
+        write_started, continue_write = threading.Event(), threading.Event()
+        def blocking_save(state, path):
+            if state['epoch'] == 1:
+                write_started.set()
+                continue_write.wait()
+            torch_save(state, path)
+        writer = CheckpointWriter(self.path)
+        with mock.patch.object(checkpoint_module.torch, 'save',
+                               side_effect=blocking_save):
+            writer.save({'epoch': 1})
+            write_started.wait()
+            # the queue is empty now, but the first checkpoint is not written
+            second_save = threading.Thread(
+                    target=writer.save, args=({'epoch': 2},))
+            second_save.start()
+            second_save.join(timeout=0.2)
+            self.assertTrue(second_save.is_alive())
+            continue_write.set()
+            second_save.join()
+            writer.close()
+        self.assertEqual(load_checkpoint(self.path)['epoch'], 2)
+
+    def test_raise_error(self):
+        writer = CheckpointWriter(self.path)
+        with mock.patch.object(checkpoint_module.torch, 'save',
+                               side_effect=OSError('disk full')):
+            writer.save({'epoch': 1})
+            with self.assertRaises(OSError):
+                writer.wait()
+        writer.close()
+
+class TestResumeDataLoader(unittest.TestCase):
+    def get_data_loader(self):
+        dataset = TensorDataset(torch.arange(10))
+        return InfiniteDataLoader(dataset, batch_size=2, shuffle=True,
+                                  generator=torch.Generator().manual_seed(1))
+
+    def test_skip(self):
+        data_loader = self.get_data_loader()
+        batches = [next(data_loader)[0] for _ in range(8)]
+        self.assertEqual(data_loader.num_batches_drawn, 8)
+        # resume within the second epoch
+        resumed_data_loader = self.get_data_loader()
+        resumed_data_loader.skip(6)
+        self.assertEqual(resumed_data_loader.num_batches_drawn, 6)
+        for batch in batches[6:]:
+            self.assertTrue(torch.equal(next(resumed_data_loader)[0], batch))
+
+if __name__ == '__main__':
+    unittest.main()
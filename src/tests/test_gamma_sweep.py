@@ -0,0 +1,45 @@
+import unittest
+import tempfile
+import numpy as np
+from deep_image_prior import DeepImagePriorReconstructor
+from dip_test_utils import get_test_cfg, get_test_problem
+
+class TestGammaSweep(unittest.TestCase):
+    def setUp(self):
+        self.log_path = tempfile.TemporaryDirectory()
+        self.cfg = get_test_cfg(self.log_path.name,
+                                {'recon_from_randn': True})
+        problem = get_test_problem()
+        self.ray_trafo_module = problem.ray_trafo_module
+        self.reco_space = problem.reco_space
+        self.gt = problem.gt
+        self.noisy_obs = problem.noisy_obs
+
+    def tearDown(self):
+        self.log_path.cleanup()
+
+    def get_reconstructor(self):
+        return DeepImagePriorReconstructor(
+                self.ray_trafo_module, reco_space=self.reco_space,
+                observation_space=None, cfg=self.cfg)
+
+    def test_same_as_separate_runs(self):
+        gammas = [1e-4, 1e-2]
+        outs, histories = self.get_reconstructor().reconstruct_gamma_sweep(
+                self.noisy_obs, ground_truth=self.gt, gammas=gammas,
+                return_histories=True)
+        self.assertEqual(len(outs), len(gammas))
+        for gamma, out, history in zip(gammas, outs, histories):
+            self.cfg.optim.gamma = gamma
+            out_, history_ = self.get_reconstructor().reconstruct(
+                    self.noisy_obs, ground_truth=self.gt,
+                    return_histories=True)
+            self.assertEqual(out.shape, out_.shape)
+            self.assertTrue(np.allclose(out, out_, atol=1e-4))
+            self.assertTrue(np.allclose(history['loss'], history_['loss'],
+                                        rtol=1e-3))
+            self.assertTrue(np.allclose(history['psnr'], history_['psnr'],
+                                        atol=1e-2))
+
+if __name__ == '__main__':
+    unittest.main()
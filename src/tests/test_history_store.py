@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from evaluation.history_store import HistoryStore
+from evaluation.evaluation import (
+        get_median_psnr_history, get_psnr_steady, get_rise_time_to_baseline)
+
+class TestHistoryStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+        self.store = HistoryStore(
+                os.path.join(self.tmp_path.name, 'histories.h5'),
+                chunk_size=7)
+        rng = np.random.default_rng(1)
+        self.psnr_histories = {}
+        for repeat in range(3):
+            for sample in range(2):
+                psnr = np.cumsum(rng.random(50)).astype(np.float32)
+                self.psnr_histories[(repeat, sample)] = psnr
+                self.store.append('run', {'psnr': psnr, 'loss': -psnr},
+                                  repeat=repeat, sample=sample)
+        self.store.append('other_run', {'psnr': np.zeros(30)})
+
+    def tearDown(self):
+        self.tmp_path.cleanup()
+
+    def test_get_histories(self):
+        histories = self.store.get_histories('run', repeat=1, sample=1)
+        self.assertTrue(np.array_equal(histories['psnr'],
+                                       self.psnr_histories[(1, 1)]))
+        self.assertTrue(np.array_equal(histories['loss'],
+                                       -self.psnr_histories[(1, 1)]))
+        histories = self.store.get_histories('other_run')
+        self.assertEqual(len(histories['psnr']), 30)
+        self.assertEqual(len(histories['loss']), 30)
+        self.assertTrue(np.all(np.isnan(histories['loss'])))
+        self.assertTrue(self.store.has('run', repeat=2, sample=0))
+        self.assertFalse(self.store.has('run', repeat=3, sample=0))
+
+    def test_replace(self):
+        self.store.append('run', {'psnr': np.ones(20)}, repeat=0, sample=0)
+        self.assertEqual(len(self.store.select('psnr')), 7)
+        psnr = self.store.get_histories('run', repeat=0, sample=0)['psnr']
+        self.assertTrue(np.array_equal(psnr, np.ones(20)))
+
+    def test_evaluation_functions(self):
+        psnr_histories = np.array(list(self.psnr_histories.values()))
+        selection = self.store.select('psnr', run_ids='run')
+        self.assertEqual(len(selection), len(self.psnr_histories))
+        self.assertTrue(np.allclose(get_median_psnr_history(selection),
+                                    get_median_psnr_history(psnr_histories)))
+        self.assertAlmostEqual(
+                get_psnr_steady(selection, start=-20, stop=None),
+                get_psnr_steady(psnr_histories, start=-20, stop=None),
+                places=5)
+        baseline_psnr_steady = float(np.median(psnr_histories[:, 30]))
+        self.assertEqual(
+                get_rise_time_to_baseline(selection, baseline_psnr_steady),
+                get_rise_time_to_baseline(psnr_histories,
+                                          baseline_psnr_steady))
+        with self.assertRaises(IndexError):
+            get_rise_time_to_baseline(selection, 1e6)
+
+    def test_select(self):
+        selection = self.store.select('psnr', run_ids='run', samples=1)
+        self.assertEqual(len(selection), 3)
+        self.assertEqual(selection.to_array().shape, (3, 50))
+        selection = self.store.select('psnr', repeats=0)
+        # shorter history is padded with NaN
+        self.assertEqual(selection.to_array().shape, (3, 50))
+        self.assertTrue(np.all(np.isnan(selection.to_array()[2, 30:])))
+
+if __name__ == '__main__':
+    unittest.main()
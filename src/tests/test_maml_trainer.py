@@ -0,0 +1,45 @@
+import unittest
+import tempfile
+import torch
+from omegaconf import OmegaConf
+from pre_training import MetaTrainer
+
+class TestMetaUpdate(unittest.TestCase):
+    def setUp(self):
+        self.log_path = tempfile.TemporaryDirectory()
+        torch.manual_seed(1)
+        self.model = torch.nn.Sequential(
+                torch.nn.Conv2d(1, 4, 3, padding=1),
+                torch.nn.BatchNorm2d(4), torch.nn.ReLU(),
+                torch.nn.Conv2d(4, 1, 3, padding=1))
+        self.cfg = OmegaConf.create({
+                'log_path': self.log_path.name, 'async_logging': False,
+                'lr': 1e-3, 'weight_decay': 0.,
+                'meta_trainer': {'meta_update': 'second_order',
+                                 'num_inner_steps': 1, 'vmap_tasks': True,
+                                 'inner_loop_optim': {'lr': 1e-5}}})
+        self.task_batches = [(torch.rand(2, 1, 8, 8), torch.rand(2, 1, 8, 8))
+                             for _ in range(3)]
+
+    def tearDown(self):
+        self.log_path.cleanup()
+
+    def test_vmap_tasks_batch_norm(self):
+        trainer = MetaTrainer(self.model, self.cfg)
+        trainer.init_optimizer()
+        batch_norm = trainer.func_model_with_input.stateless_model[1]
+        running_mean = batch_norm.running_mean.clone()
+        init_params = [p.detach().clone() for p in trainer.func_params]
+        loss, task_outputs = trainer.meta_update(
+                self.task_batches, torch.nn.MSELoss())
+        self.assertEqual(len(task_outputs), 3)
+        self.assertTrue(torch.isfinite(loss).all())
+        self.assertTrue(any(not torch.equal(p, p_init) for p, p_init in
+                            zip(trainer.func_params, init_params)))
+        # running statistics are restored and not updated
+        self.assertTrue(batch_norm.track_running_stats)
+        self.assertTrue(torch.equal(batch_norm.running_mean, running_mean))
+        trainer.writer.close()
+
+if __name__ == '__main__':
+    unittest.main()
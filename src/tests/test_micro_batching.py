@@ -0,0 +1,56 @@
+import unittest
+import torch
+from pre_training.micro_batching import (
+        forward_backward_micro_batches, find_micro_batch_size)
+
+class TestMicroBatching(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(1)
+        self.model = torch.nn.Sequential(
+                torch.nn.Conv2d(1, 4, 3, padding=1), torch.nn.ReLU(),
+                torch.nn.Conv2d(4, 1, 3, padding=1))
+        self.inputs = torch.rand(10, 1, 8, 8)
+        self.targets = torch.rand(10, 1, 8, 8)
+        self.criterion = torch.nn.MSELoss()
+
+    def get_grads(self, inputs, micro_batch_size):
+        self.model.zero_grad()
+        outputs, loss = forward_backward_micro_batches(
+                self.model, inputs, self.targets, self.criterion,
+                micro_batch_size)
+        grads = [p.grad.clone() for p in self.model.parameters()]
+        return outputs, loss, grads
+
+    def test_same_as_full_batch(self):
+        outputs, loss, grads = self.get_grads(self.inputs, 10)
+        for micro_batch_size in [1, 3, 5]:
+            outputs_, loss_, grads_ = self.get_grads(self.inputs,
+                                                     micro_batch_size)
+            self.assertTrue(torch.allclose(outputs, outputs_))
+            self.assertTrue(torch.allclose(loss, loss_))
+            for g, g_ in zip(grads, grads_):
+                self.assertTrue(torch.allclose(g, g_, atol=1e-6))
+
+    def test_input_gradient(self):
+        input_grads = []
+        for micro_batch_size in [10, 3]:
+            leaf = self.inputs.clone().requires_grad_(True)
+            self.get_grads(2. * leaf, micro_batch_size)
+            input_grads.append(leaf.grad)
+        self.assertTrue(torch.allclose(*input_grads, atol=1e-6))
+
+    def test_no_grad(self):
+        self.model.zero_grad()
+        with torch.no_grad():
+            outputs, loss = forward_backward_micro_batches(
+                    self.model, self.inputs, self.targets, self.criterion, 3)
+        self.assertEqual(outputs.shape, self.targets.shape)
+        self.assertTrue(all(p.grad is None for p in self.model.parameters()))
+
+    def test_find_micro_batch_size_cpu(self):
+        with self.assertRaises(ValueError):
+            find_micro_batch_size(
+                    self.model, (1, 8, 8), 32, torch.device('cpu'))
+
+if __name__ == '__main__':
+    unittest.main()
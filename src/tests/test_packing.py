@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+from argparse import Namespace
+from util.packing import PackingScheduler, get_available_cores
+from run_packed import get_overrides_list, split_sweep_values
+
+REPORT_JOB = (
+        'import os, sys, json; '
+        'cores = sorted(os.sched_getaffinity(0)) '
+        'if hasattr(os, "sched_getaffinity") else None; '
+        'json.dump({"threads": os.environ["OMP_NUM_THREADS"], '
+        '"cores": cores}, open(sys.argv[1], "w"))')
+
+class TestPackingScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_path.cleanup()
+
+    def test_run(self):
+        num_cores = min(2, len(get_available_cores()))
+        jobs = [{'name': str(i),
+                 'args': [sys.executable, '-c', REPORT_JOB,
+                          os.path.join(self.tmp_path.name,
+                                       'job_{:d}.json'.format(i))]}
+                for i in range(4)]
+        jobs.append({'name': 'fail',
+                     'args': [sys.executable, '-c', 'raise SystemExit(3)']})
+        summary_filename = os.path.join(self.tmp_path.name, 'status.json')
+        scheduler = PackingScheduler(
+                jobs, num_cores=num_cores, concurrency=num_cores,
+                adaptive=False, summary_filename=summary_filename,
+                log_path=os.path.join(self.tmp_path.name, 'logs'),
+                poll_interval=0.01)
+        summary = scheduler.run()
+        self.assertEqual(summary['num_completed'], 4)
+        self.assertEqual(summary['num_failed'], 1)
+        self.assertEqual(summary['jobs']['fail']['returncode'], 3)
+        self.assertGreater(summary['reconstructions_per_hour'], 0.)
+        with open(summary_filename, 'r') as f:
+            self.assertEqual(json.load(f)['num_completed'], 4)
+        for i in range(4):
+            with open(os.path.join(self.tmp_path.name,
+                                   'job_{:d}.json'.format(i)), 'r') as f:
+                report = json.load(f)
+            self.assertEqual(report['threads'], '1')
+            if report['cores'] is not None:
+                self.assertEqual(report['cores'],
+                                 summary['jobs'][str(i)]['cores'])
+
+    def test_adapt(self):
+        scheduler = PackingScheduler([], num_cores=1, max_concurrency=4,
+                                     num_threads_per_job=1)
+        def complete(duration, count):
+            for _ in range(count):
+                scheduler.jobs.append({
+                        'status': 'completed', 'work': 1.,
+                        'concurrency': scheduler.concurrency,
+                        'duration': duration})
+            scheduler._adapt()
+        complete(1., 1)  # throughput 1
+        self.assertEqual(scheduler.concurrency, 2)
+        complete(1.2, 2)  # throughput 1.67
+        self.assertEqual(scheduler.concurrency, 3)
+        complete(3., 3)  # throughput 1
+        self.assertEqual(scheduler.concurrency, 2)
+        self.assertEqual(scheduler.best_concurrency, 2)
+        complete(0.1, 2)  # no further adaptation
+        self.assertEqual(scheduler.concurrency, 2)
+
+class TestSweep(unittest.TestCase):
+    def test_split_sweep_values(self):
+        self.assertEqual(split_sweep_values('1e-4,2e-4'), ['1e-4', '2e-4'])
+        self.assertEqual(split_sweep_values('[1e-4,2e-4]'), ['[1e-4,2e-4]'])
+        self.assertEqual(split_sweep_values('[1,[2,3]],{a:1,b:2}'),
+                         ['[1,[2,3]]', '{a:1,b:2}'])
+        self.assertEqual(split_sweep_values('"a,b",\'[c\',d'),
+                         ['"a,b"', '\'[c\'', 'd'])
+
+    def test_get_overrides_list(self):
+        args = Namespace(jobs_file=None, sweep=[
+                'mdl.optim.gamma_sweep=[1e-4,2e-4],[1e-3,2e-3]',
+                'mdl.optim.iterations=10,20'])
+        overrides_list = get_overrides_list(args)
+        self.assertEqual(len(overrides_list), 4)
+        self.assertEqual(overrides_list[0], [
+                'mdl.optim.gamma_sweep=[1e-4,2e-4]',
+                'mdl.optim.iterations=10'])
+        self.assertEqual(overrides_list[3], [
+                'mdl.optim.gamma_sweep=[1e-3,2e-3]',
+                'mdl.optim.iterations=20'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+from evaluation.history_store import HistoryStore
+from util.reco_cache import ReconstructionCache, get_reconstruction_key
+from util.parallel_reconstruction import (
+        reconstruct_sample, reconstruct_samples, get_sample_seed,
+        sample_sub_path)
+
+class SeedRecordingReconstructor():
+    """
+    Returns the fbp as the reconstruction and a PSNR history depending on the
+    seed in the config.
+    """
+    def __init__(self, cfg):
+        self.cfg = cfg
+
+    def reconstruct(self, noisy_obs, fbp, gt, return_histories=False,
+                    return_iterates=False, return_iterates_params=False,
+                    warm_start=False):
+        if self.cfg.torch_manual_seed:
+            torch.manual_seed(self.cfg.torch_manual_seed)
+        histories = {'psnr': torch.rand(5).tolist(), 'loss': [1.] * 5}
+        return fbp[0, 0].numpy(), histories
+
+class WarmStartRecordingReconstructor(SeedRecordingReconstructor):
+    """
+    Records whether each reconstruction was warm started from a previous
+    state.
+    """
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.warm_start_state = None
+        self.warm_started = []
+
+    def reconstruct(self, noisy_obs, fbp, gt, warm_start=False, **kwargs):
+        self.warm_started.append(
+                warm_start and self.warm_start_state is not None)
+        out = super().reconstruct(noisy_obs, fbp, gt, **kwargs)
+        self.warm_start_state = {'seed': self.cfg.torch_manual_seed}
+        return out
+
+class TestReconstructSample(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+        self.cfg = OmegaConf.create({
+                'mdl': {'torch_manual_seed': 10},
+                'data': {'name': 'dummy'},
+                'save_histories_path': os.path.join(self.tmp_path.name,
+                                                    'histories'),
+                'save_iterates_path': None,
+                'save_iterates_params_path': None,
+                'reconstruction_seed_per_sample': True})
+
+    def tearDown(self):
+        self.tmp_path.cleanup()
+
+    def test_get_sample_seed(self):
+        self.assertEqual(get_sample_seed(self.cfg, 3), 13)
+        self.cfg.reconstruction_seed_per_sample = False
+        self.assertEqual(get_sample_seed(self.cfg, 3), 10)
+
+    def test_per_sample_results(self):
+        history_store = HistoryStore(
+                os.path.join(self.tmp_path.name, 'histories.h5'))
+        reconstructor = SeedRecordingReconstructor(self.cfg.mdl.copy())
+        samples = [(torch.rand(1, 1, 6), torch.rand(1, 1, 4, 4))
+                   for _ in range(2)]
+        psnr_histories = []
+        # reconstruct in reverse order, results must not depend on the order
+        for i in reversed(range(2)):
+            noisy_obs, fbp = samples[i]
+            reco = reconstruct_sample(
+                    self.cfg, reconstructor, noisy_obs, fbp, None, i,
+                    sub_path=sample_sub_path(i), history_store=history_store)
+            self.assertTrue(np.array_equal(reco, fbp[0, 0].numpy()))
+        for i in range(2):
+            histories = np.load(os.path.join(
+                    self.cfg.save_histories_path, sample_sub_path(i),
+                    'histories.npz'))
+            torch.manual_seed(10 + i)
+            self.assertTrue(np.allclose(histories['psnr'], torch.rand(5)))
+            psnr_histories.append(histories['psnr'])
+            self.assertTrue(np.array_equal(
+                    history_store.get_histories(os.getcwd(), sample=i)['psnr'],
+                    histories['psnr']))
+        self.assertFalse(np.array_equal(*psnr_histories))
+        self.assertEqual(self.cfg.mdl.torch_manual_seed, 10)
+
+    def test_warm_start_bypasses_cache(self):
+        self.cfg.mdl.load_pretrain_model = False
+        reco_cache = ReconstructionCache(
+                os.path.join(self.tmp_path.name, 'cache'))
+        reconstructor = WarmStartRecordingReconstructor(self.cfg.mdl.copy())
+        samples = [(torch.rand(1, 1, 6), torch.rand(1, 1, 4, 4))
+                   for _ in range(2)]
+        # sample 0 would be a cache hit
+        cfg_mdl = self.cfg.mdl.copy()
+        cfg_mdl.torch_manual_seed = get_sample_seed(self.cfg, 0)
+        cache_key = get_reconstruction_key(
+                cfg_mdl, *samples[0], None,
+                extra={'data': OmegaConf.to_container(self.cfg.data)})
+        reco_cache.put(cache_key, np.zeros((4, 4)),
+                       histories={'psnr': np.zeros(5)})
+        recos = np.zeros((2, 4, 4))
+        reconstruct_samples(self.cfg, reconstructor, samples, recos,
+                            reco_cache=reco_cache, warm_start=True)
+        self.assertEqual(reconstructor.warm_started, [False, True])
+        for i in range(2):
+            self.assertTrue(np.array_equal(recos[i], samples[i][1][0, 0]))
+        # without warm starts, sample 0 is served from the cache
+        reconstructor = WarmStartRecordingReconstructor(self.cfg.mdl.copy())
+        reconstruct_samples(self.cfg, reconstructor, samples[:1], recos,
+                            reco_cache=reco_cache)
+        self.assertEqual(reconstructor.warm_started, [])
+        self.assertTrue(np.array_equal(recos[0], np.zeros((4, 4))))
+
+    def test_no_cache_without_seed(self):
+        self.cfg.mdl.torch_manual_seed = None
+        self.cfg.mdl.load_pretrain_model = False
+        reco_cache = ReconstructionCache(
+                os.path.join(self.tmp_path.name, 'cache'))
+        reconstructor = WarmStartRecordingReconstructor(self.cfg.mdl.copy())
+        noisy_obs, fbp = torch.rand(1, 1, 6), torch.rand(1, 1, 4, 4)
+        for _ in range(2):
+            reconstruct_sample(self.cfg, reconstructor, noisy_obs, fbp, None,
+                               0, reco_cache=reco_cache)
+        # not served from the cache, and nothing stored
+        self.assertEqual(len(reconstructor.warm_started), 2)
+        self.assertEqual(reco_cache.size, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import random
+import unittest
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+from pre_training.prefetch import DevicePrefetcher
+from pre_training.checkpoint import set_rng_states
+
+def add_noise(batch):
+    x, y = batch
+    return x + torch.rand(1).to(x.device), y
+
+def add_noise_all_generators(batch):
+    x, y = batch
+    return x + (torch.rand(1).to(x.device) + np.random.rand() +
+                random.random()), y
+
+class TestDevicePrefetcher(unittest.TestCase):
+    def setUp(self):
+        self.x = torch.arange(20.).view(10, 2)
+        self.y = -self.x
+        self.data_loader = DataLoader(TensorDataset(self.x, self.y),
+                                      batch_size=3, pin_memory=False)
+
+    def check_prefetcher(self, device, use_side_stream):
+        torch.manual_seed(1)
+        expected = []
+        for x, y in self.data_loader:
+            expected.append(add_noise((x.to(device), y.to(device))))
+        torch.manual_seed(1)
+        prefetcher = DevicePrefetcher(self.data_loader, device,
+                                      transform=add_noise,
+                                      use_side_stream=use_side_stream)
+        batches = list(prefetcher)
+        self.assertEqual(len(batches), len(expected))
+        for (x, y), (x_expected, y_expected) in zip(batches, expected):
+            self.assertEqual(x.device, torch.device(device))
+            self.assertTrue(torch.equal(x, x_expected))
+            self.assertTrue(torch.equal(y, y_expected))
+        self.assertEqual(prefetcher.num_pending, 0)
+
+    def test_cpu(self):
+        self.check_prefetcher('cpu', use_side_stream=True)
+
+    @unittest.skipUnless(torch.cuda.is_available(), 'requires cuda')
+    def test_cuda(self):
+        self.check_prefetcher('cuda:0', use_side_stream=True)
+        self.check_prefetcher('cuda:0', use_side_stream=False)
+
+    @unittest.skipUnless(torch.cuda.is_available(), 'requires cuda')
+    def test_pending_rng_states(self):
+        torch.manual_seed(1)
+        prefetcher = DevicePrefetcher(self.data_loader, 'cuda:0',
+                                      transform=add_noise_all_generators)
+        self.assertEqual(prefetcher.num_pending, 1)
+        next(prefetcher)
+        # restoring the states repeats the transform of the pending batch
+        states = prefetcher.pending_rng_states
+        x_pending = prefetcher._pending_batch[0].clone()
+        set_rng_states(states)
+        x, _ = add_noise_all_generators((self.x[3:6].to('cuda:0'), None))
+        self.assertTrue(torch.equal(x, x_pending))
+
+if __name__ == '__main__':
+    unittest.main()
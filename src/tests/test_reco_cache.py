@@ -0,0 +1,96 @@
+import os
+import time
+import tempfile
+import unittest
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+from util.reco_cache import (
+        ReconstructionCache, get_reconstruction_key, is_cacheable)
+
+class TestReconstructionKey(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+        self.cfg_mdl = OmegaConf.create({
+                'load_pretrain_model': False, 'learned_params_path': None,
+                'log_path': 'logs/a', 'torch_manual_seed': 10,
+                'optim': {'lr': 1e-4, 'iterations': 100}})
+        self.noisy_obs = torch.rand(1, 1, 4, 5)
+        self.fbp = torch.rand(1, 1, 3, 3)
+
+    def tearDown(self):
+        self.tmp_path.cleanup()
+
+    def test_key(self):
+        key = get_reconstruction_key(self.cfg_mdl, self.noisy_obs, self.fbp)
+        cfg_mdl = self.cfg_mdl.copy()
+        cfg_mdl.log_path = 'logs/b'
+        # logging path and leading singleton dimensions are ignored
+        self.assertEqual(key, get_reconstruction_key(
+                cfg_mdl, self.noisy_obs[0], self.fbp[0]))
+        cfg_mdl.torch_manual_seed = 11
+        self.assertNotEqual(key, get_reconstruction_key(
+                cfg_mdl, self.noisy_obs, self.fbp))
+        self.assertNotEqual(key, get_reconstruction_key(
+                self.cfg_mdl, self.noisy_obs + 1., self.fbp))
+        self.assertNotEqual(key, get_reconstruction_key(
+                self.cfg_mdl, self.noisy_obs, self.fbp, extra={'a': 1}))
+
+    def test_key_checkpoint_contents(self):
+        filenames = [os.path.join(self.tmp_path.name, name)
+                     for name in ['a.pt', 'b.pt', 'c.pt']]
+        for filename, value in zip(filenames, [1., 1., 2.]):
+            torch.save({'w': torch.tensor([value])}, filename)
+        keys = []
+        for filename in filenames:
+            cfg_mdl = self.cfg_mdl.copy()
+            cfg_mdl.load_pretrain_model = True
+            cfg_mdl.learned_params_path = filename[:-len('.pt')]
+            keys.append(get_reconstruction_key(cfg_mdl, self.noisy_obs))
+        self.assertEqual(keys[0], keys[1])
+        self.assertNotEqual(keys[0], keys[2])
+
+    def test_is_cacheable(self):
+        self.assertTrue(is_cacheable(self.cfg_mdl))
+        for seed in [None, 0]:
+            cfg_mdl = self.cfg_mdl.copy()
+            cfg_mdl.torch_manual_seed = seed
+            self.assertFalse(is_cacheable(cfg_mdl))
+
+class TestReconstructionCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+        self.cache = ReconstructionCache(self.tmp_path.name)
+
+    def tearDown(self):
+        self.tmp_path.cleanup()
+
+    def test_get_put(self):
+        self.assertIsNone(self.cache.get('ab12'))
+        reco = np.random.rand(8, 8).astype(np.float32)
+        self.cache.put('ab12', reco, histories={'psnr': [1., 2.],
+                                                'loss': [3., 2.]})
+        entry = self.cache.get('ab12')
+        self.assertTrue(np.array_equal(entry['reco'], reco))
+        self.assertEqual(entry['histories']['psnr'].tolist(), [1., 2.])
+        self.assertEqual(sorted(entry['histories']), ['loss', 'psnr'])
+        self.assertIsNone(self.cache.get('ab12', require_iterates=True))
+        self.cache.put('ab12', reco, histories={'psnr': [1., 2.]},
+                       iterates=[reco], iterates_iters=[0])
+        entry = self.cache.get('ab12', require_iterates=True)
+        self.assertEqual(entry['iterates'].shape, (1, 8, 8))
+
+    def test_evict(self):
+        reco = np.zeros((32, 32), dtype=np.float32)
+        for key in ['aa01', 'bb02', 'cc03']:
+            self.cache.put(key, reco)
+            time.sleep(0.01)  # ensure different modification times
+        self.cache.get('aa01')  # most recently used now
+        entry_size = self.cache.size // 3
+        self.cache.evict(2 * entry_size)
+        self.assertIsNotNone(self.cache.get('aa01'))
+        self.assertIsNone(self.cache.get('bb02'))
+        self.assertIsNotNone(self.cache.get('cc03'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from omegaconf import OmegaConf
+from deep_image_prior.rise_time import RiseTimeTracker
+from validation import get_validation_info
+
+class TestRiseTimeTracker(unittest.TestCase):
+    def test_rise_time_to_baseline(self):
+        tracker = RiseTimeTracker(30., remaining_psnr=0.5, window=3)
+        for psnr in [20., 29.6, 28., 29.7, 29.8]:
+            tracker.update(psnr)
+        self.assertEqual(tracker.rise_time_to_baseline, 1)
+        self.assertFalse(tracker.risen)
+        tracker.update(31.)
+        self.assertTrue(tracker.risen)
+        self.assertFalse(tracker.should_stop)  # early_stop=False
+
+    def test_steady_estimate(self):
+        tracker = RiseTimeTracker(30., steady_window=3,
+                                  rise_time_remaining_psnr=0.5)
+        self.assertIsNone(tracker.psnr_steady)
+        self.assertIsNone(tracker.rise_time)
+        for psnr in [10., 20., 25., 25.2, 25.1]:
+            tracker.update(psnr)
+        self.assertAlmostEqual(tracker.psnr_steady, 25.1)
+        self.assertEqual(tracker.rise_time, 2)
+        self.assertIsNone(tracker.rise_time_to_baseline)
+
+    def test_should_stop(self):
+        tracker = RiseTimeTracker(30., remaining_psnr=0.1, window=2,
+                                  early_stop=True)
+        stopped_at = None
+        for i, psnr in enumerate([29., 30., 29.5, 30., 30.1, 30.2]):
+            tracker.update(psnr)
+            if tracker.should_stop:
+                stopped_at = i
+                break
+        self.assertEqual(stopped_at, 4)
+        self.assertEqual(tracker.rise_time_to_baseline, 1)
+
+    def test_validation_info_early_stopped(self):
+        cfg = OmegaConf.create({'val': {
+                'psnr_steady_start': -2, 'psnr_steady_stop': None,
+                'rise_time_remaining_psnr': 0.1,
+                'rise_time_to_baseline_remaining_psnr': 0.1}})
+        psnr_histories = [[[20., 25., 30., 30., 30.], [20., 30., 30.]],
+                          [[20., 22., 30., 30., 30.], [20., 30., 30.]]]
+        info = get_validation_info(psnr_histories, 30., cfg, iterations=5)
+        self.assertEqual(info['num_early_stopped'], 2)
+        self.assertEqual(info['rise_time'], 2)
+        self.assertEqual(info['rise_time_to_baseline'], 2)
+        self.assertEqual(info['PSNR_steady'], 30.)
+        info = get_validation_info(psnr_histories, 30., cfg)
+        self.assertNotIn('num_early_stopped', info)
+
+    def test_validation_info_all_early_stopped(self):
+        # the steady window covers the second half of the iterations
+        cfg = OmegaConf.create({'val': {
+                'psnr_steady_start': -5, 'psnr_steady_stop': None,
+                'rise_time_remaining_psnr': 0.1,
+                'rise_time_to_baseline_remaining_psnr': 0.1}})
+        psnr_histories = [[[20., 25., 30.95, 31.], [20., 24., 30.95, 31.]]]
+        info = get_validation_info(psnr_histories, 31., cfg, iterations=10)
+        self.assertEqual(info['num_early_stopped'], 2)
+        # not biased by the rising part of the histories
+        self.assertEqual(info['PSNR_steady'], 31.)
+        self.assertEqual(info['rise_time'], 2)
+        self.assertEqual(info['rise_time_to_baseline'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
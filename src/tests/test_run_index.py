@@ -0,0 +1,91 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import yaml
+from omegaconf import OmegaConf
+from evaluation import run_index as run_index_module
+from evaluation.run_index import RunIndex, get_run_index
+
+class TestRunIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.tmp_path.name, 'multirun')
+        for i, gamma in enumerate([1e-4, 2e-4]):
+            self.create_run(os.path.join(self.base_path, str(i)), gamma)
+        self.run_index = RunIndex(
+                os.path.join(self.tmp_path.name, 'run_index.sqlite'))
+
+    def tearDown(self):
+        self.run_index.close()
+        self.tmp_path.cleanup()
+
+    def create_run(self, run_path, gamma):
+        os.makedirs(os.path.join(run_path, '.hydra'))
+        os.makedirs(os.path.join(run_path, 'results'))
+        cfg = OmegaConf.create({
+                'mdl': {'optim': {'gamma': gamma}},
+                'save_reconstruction_path': 'results',
+                'save_histories_path': 'results',
+                'save_iterates_path': None})
+        OmegaConf.save(cfg, os.path.join(run_path, '.hydra', 'config.yaml'))
+        with open(os.path.join(run_path, '.hydra', 'overrides.yaml'),
+                  'w') as f:
+            yaml.dump(['+experiment=no_pretrain'], f)
+        for filename in ['model_best.pt', 'model_swa.pt']:
+            open(os.path.join(run_path, filename), 'w').close()
+        open(os.path.join(run_path, 'results', 'histories.npz'), 'w').close()
+
+    def test_query(self):
+        self.run_index.refresh(self.base_path)
+        run_paths = [os.path.join(self.base_path, str(i)) for i in range(2)]
+        self.assertEqual(self.run_index.find_runs(self.base_path), run_paths)
+        self.assertEqual(
+                self.run_index.find_runs(self.base_path,
+                                         filters={'mdl.optim.gamma': 2e-4}),
+                run_paths[1:])
+        self.assertEqual(
+                self.run_index.get_cfg(run_paths[0]).mdl.optim.gamma, 1e-4)
+        self.assertEqual(self.run_index.get_experiment_name(run_paths[0]),
+                         'no_pretrain')
+        artifacts = self.run_index.get_artifacts(run_paths[0])
+        self.assertEqual(artifacts['histories'], os.path.join(
+                run_paths[0], 'results', 'histories.npz'))
+        self.assertNotIn('recos', artifacts)
+        self.assertEqual(len(artifacts['checkpoints']), 2)
+        self.assertEqual(
+                self.run_index.get_checkpoints(self.base_path,
+                                               exclude_re='.*_swa\\.pt'),
+                {run_path: ['model_best.pt'] for run_path in run_paths})
+
+    def test_incremental_refresh(self):
+        self.run_index.refresh(self.base_path)
+        with mock.patch.object(run_index_module.OmegaConf, 'load',
+                               wraps=OmegaConf.load) as load:
+            self.run_index.refresh(self.base_path)
+            load.assert_not_called()
+            time.sleep(0.01)  # ensure a different modification time
+            self.create_run(os.path.join(self.base_path, '2'), 4e-4)
+            self.run_index.refresh(self.base_path)
+            self.assertEqual(load.call_count, 1)
+        self.assertEqual(len(self.run_index.find_runs(self.base_path)), 3)
+        shutil.rmtree(os.path.join(self.base_path, '0'))
+        self.run_index.refresh(self.base_path)
+        self.assertEqual(self.run_index.find_runs(self.base_path),
+                         [os.path.join(self.base_path, str(i))
+                          for i in [1, 2]])
+        self.assertNotIn(os.path.join(self.base_path, '0'),
+                         self.run_index.get_checkpoints(self.base_path))
+
+    def test_get_run_index(self):
+        filename = os.path.join(self.tmp_path.name, 'index', 'runs.sqlite')
+        with mock.patch.dict(os.environ, {'RUN_INDEX_FILENAME': filename}):
+            run_index = get_run_index()
+        self.assertEqual(run_index.filename, filename)
+        self.assertTrue(os.path.isfile(filename))
+        run_index.close()
+
+if __name__ == '__main__':
+    unittest.main()
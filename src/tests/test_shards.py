@@ -0,0 +1,85 @@
+import unittest
+import tempfile
+import numpy as np
+import odl
+import torch
+from torch.utils.data import DataLoader
+from dataset.dataset import Dataset
+from dataset.shards import export_shards, load_shard, ShardedDataset
+
+class CountingDataset(Dataset):
+    """
+    Dataset yielding pairs ``(i * ones, -i * ones)``.
+    """
+    def __init__(self, train_len=50, validation_len=7, shape=(4, 3)):
+        self.train_len = train_len
+        self.validation_len = validation_len
+        space = (odl.tensor_space(shape, dtype='float32'),
+                 odl.tensor_space(shape, dtype='float32'))
+        super().__init__(space=space)
+
+    def generator(self, fold='train'):
+        for i in range(self.get_len(fold)):
+            x = np.full(self.space[0].shape, i, dtype=np.float32)
+            yield (x, -x)
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dataset = CountingDataset()
+        for fold in ['train', 'validation']:
+            export_shards(self.dataset, self.tmp_dir.name, fold=fold,
+                          shard_size=8, show_pbar=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_ids(self, torch_dataset, **loader_kwargs):
+        ids = []
+        for x, y in DataLoader(torch_dataset, batch_size=5, **loader_kwargs):
+            self.assertTrue(torch.equal(x, -y))
+            ids += x[:, 0, 0].int().tolist()
+        return ids
+
+    def test_generator_order(self):
+        sharded_dataset = ShardedDataset(self.tmp_dir.name)
+        self.assertEqual(sharded_dataset.get_len('train'), 50)
+        self.assertEqual(sharded_dataset.get_len('validation'), 7)
+        ids = [int(x[0, 0]) for x, _ in sharded_dataset.generator('train')]
+        self.assertEqual(ids, list(range(50)))
+
+    def test_load_shard(self):
+        sharded_dataset = ShardedDataset(self.tmp_dir.name)
+        shard_path = sharded_dataset.get_shard_paths('train')[1]
+        x, y = load_shard(shard_path, 2, start=2, stop=5)
+        self.assertEqual(x.shape, (3, 4, 3))
+        self.assertEqual(x[:, 0, 0].tolist(), [10., 11., 12.])
+        self.assertTrue(np.array_equal(x, -y))
+
+    def test_shuffled_epoch_covers_fold(self):
+        sharded_dataset = ShardedDataset(
+                self.tmp_dir.name, shuffle_buffer_size=16)
+        torch_dataset = sharded_dataset.create_torch_dataset('train')
+        torch_dataset.set_epoch(0)
+        ids_0 = self.get_ids(torch_dataset)
+        torch_dataset.set_epoch(1)
+        ids_1 = self.get_ids(torch_dataset)
+        self.assertEqual(sorted(ids_0), list(range(50)))
+        self.assertEqual(sorted(ids_1), list(range(50)))
+        self.assertNotEqual(ids_0, ids_1)
+
+    def test_split_across_ranks_and_workers(self):
+        sharded_dataset = ShardedDataset(self.tmp_dir.name)
+        ids_per_rank = []
+        for rank in range(2):
+            torch_dataset = sharded_dataset.create_torch_dataset(
+                    'train', num_shards=2, shard_index=rank)
+            torch_dataset.set_epoch(0)
+            self.assertEqual(len(torch_dataset), 25)
+            ids = self.get_ids(torch_dataset, num_workers=2)
+            self.assertEqual(len(ids), 25)
+            ids_per_rank.append(set(ids))
+        self.assertFalse(ids_per_rank[0] & ids_per_rank[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+import numpy as np
+from validation.successive_halving import (
+        get_successive_halving_score, select_survivors)
+
+class TestSuccessiveHalving(unittest.TestCase):
+    def test_get_successive_halving_score(self):
+        # 2 repeats, 3 samples, 4 iterations
+        psnr_histories = np.array([
+                [[20., 22., 23., 22.5]] * 3,
+                [[20., 21., 24., 23.]] * 3]).tolist()
+        score = get_successive_halving_score(psnr_histories)
+        self.assertAlmostEqual(score, 23.5)
+
+    def test_select_survivors_tolerated_diff(self):
+        scores = {'a': 30., 'b': 29.5, 'c': 28., 'd': 29.1}
+        survivors = select_survivors(scores, tolerated_diff=1.)
+        self.assertEqual(survivors, ['a', 'b', 'd'])
+
+    def test_select_survivors_eta(self):
+        scores = {'a': 29., 'b': 30., 'c': 28., 'd': 29.5, 'e': 29.8}
+        survivors = select_survivors(scores, tolerated_diff=10., eta=2)
+        self.assertEqual(survivors, ['b', 'd', 'e'])
+        survivors = select_survivors(scores, tolerated_diff=0.4, eta=2)
+        self.assertEqual(survivors, ['b', 'e'])
+        survivors = select_survivors({'a': 1., 'b': 2.},
+                                     tolerated_diff=10., eta=4)
+        self.assertEqual(survivors, ['b'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import odl
+import torch
+from omegaconf import OmegaConf
+from dataset.dataset import Dataset
+from pre_training import Trainer
+from pre_training.distributed import spawn
+
+class RandomPairDataset(Dataset):
+    """
+    Dataset yielding reproducible random pairs ``(obs, fbp, gt)``.
+    """
+    def __init__(self, train_len=16, validation_len=8, shape=(8, 8)):
+        self.train_len = train_len
+        self.validation_len = validation_len
+        space = (odl.tensor_space(shape, dtype='float32'),
+                 odl.tensor_space(shape, dtype='float32'))
+        super().__init__(space=space)
+        self.num_elements_per_sample = 3
+
+    def generator(self, fold='train'):
+        rng = np.random.default_rng(0 if fold == 'train' else 1)
+        for _ in range(self.get_len(fold)):
+            gt = rng.random(self.space[1].shape).astype(np.float32)
+            fbp = gt + 0.1 * rng.standard_normal(
+                    self.space[1].shape).astype(np.float32)
+            yield (fbp, fbp, gt)
+
+def get_cfg(tmp_path, distributed):
+    return OmegaConf.create({
+        'epochs': 3, 'batch_size': 4, 'train_len': 16,
+        'lr': 1e-3, 'lr_min': 1e-4, 'max_lr': 1e-3, 'weight_decay': 0.,
+        'scheduler': 'onecyclelr',
+        'perform_swa': True,
+        'swa': {'start_epoch': 1, 'anneal_strategy': 'cos',
+                'anneal_epochs': 1, 'swa_lr': 1e-3},
+        'use_adversarial_attacks': False,
+        'torch_manual_seed': 1, 'num_data_loader_workers': 0,
+        'use_mixed': False, 'show_pbar': False, 'add_randn_mask': False,
+        'log_path': os.path.join(tmp_path, 'logs'),
+        'save_best_learned_params_path': os.path.join(tmp_path, 'best'),
+        'save_swa_learned_params_path': os.path.join(tmp_path, 'swa'),
+        'distributed': distributed, 'distributed_backend': 'gloo'})
+
+def train_rank(rank, tmp_path):
+    torch.manual_seed(rank)  # different init, synchronized by DDP
+    model = torch.nn.Conv2d(1, 1, 3, padding=1)
+    trainer = Trainer(model=model, ray_trafos={},
+                      cfg=get_cfg(tmp_path, distributed=True))
+    trainer.train(RandomPairDataset())
+    torch.save(trainer.model.state_dict(),
+               os.path.join(tmp_path, 'rank{:d}.pt'.format(rank)))
+
+class TestTrainerDistributed(unittest.TestCase):
+    def test_two_ranks_cpu(self):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            spawn(train_rank, 2, args=(tmp_path,), backend='gloo')
+            state_dicts = [
+                    torch.load(os.path.join(tmp_path, 'rank{:d}.pt'.format(r)))
+                    for r in range(2)]
+            for k in state_dicts[0]:
+                self.assertTrue(torch.equal(state_dicts[0][k],
+                                            state_dicts[1][k]))
+            # written by rank 0 only
+            self.assertTrue(os.path.isfile(os.path.join(tmp_path, 'best.pt')))
+            self.assertTrue(os.path.isfile(os.path.join(tmp_path, 'swa.pt')))
+            self.assertEqual(len(os.listdir(os.path.join(tmp_path, 'logs'))),
+                             1)
+
+    def test_single_process_unchanged(self):
+        with tempfile.TemporaryDirectory() as tmp_path:
+            model = torch.nn.Conv2d(1, 1, 3, padding=1)
+            trainer = Trainer(model=model, ray_trafos={},
+                              cfg=get_cfg(tmp_path, distributed=False))
+            self.assertEqual((trainer.rank, trainer.world_size), (0, 1))
+            trainer.train(RandomPairDataset())
+            self.assertTrue(os.path.isfile(os.path.join(tmp_path, 'best.pt')))
+
+if __name__ == '__main__':
+    unittest.main()
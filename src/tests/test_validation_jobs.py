@@ -0,0 +1,106 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+from omegaconf import OmegaConf
+import validation.parallel as parallel_module
+from validation import ValidationJobScheduler, val_sub_sub_path
+
+def fake_validation_job(job):
+    return [float(job['i']), float(job['i_sample'])]
+
+class TestValidationJobScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmp_path = tempfile.TemporaryDirectory()
+        self.jobs_filename = os.path.join(self.tmp_path.name, 'val_jobs.jsonl')
+        self.cfg = OmegaConf.create({'val': {'num_repeats': 2}})
+        self.cfg_mdl_val = OmegaConf.create({})
+        self.models = [('a.pt', 'a'), ('b.pt', 'b')]
+        self.run_jobs = []
+        def run_validation_job(job):
+            self.run_jobs.append(job['key'])
+            return fake_validation_job(job)
+        patchers = [
+                mock.patch.object(parallel_module, 'init_worker_state'),
+                mock.patch.object(parallel_module, 'run_validation_job',
+                                  side_effect=run_validation_job)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_path.cleanup()
+
+    def get_scheduler(self, resume=False):
+        return ValidationJobScheduler(
+                self.cfg, self.cfg_mdl_val, num_samples=3,
+                jobs_filename=self.jobs_filename, num_workers=0,
+                resume=resume)
+
+    def load_jobs(self):
+        with open(self.jobs_filename, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def test_run_sequentially(self):
+        scheduler = self.get_scheduler()
+        results = list(scheduler.run(self.models, seed=1, log_path_base=''))
+        self.assertEqual([model_path for model_path, _ in results],
+                         ['a.pt', 'b.pt'])
+        for _, psnr_histories in results:
+            self.assertEqual(psnr_histories,
+                             [[[float(i), float(i_sample)]
+                               for i_sample in range(3)] for i in range(2)])
+        self.assertEqual(len(self.run_jobs), 12)
+        jobs = self.load_jobs()
+        self.assertEqual(len(jobs), 12)
+        self.assertEqual(jobs[0], {
+                'key': os.path.join(os.path.abspath('a.pt'),
+                                    val_sub_sub_path(i=0, i_sample=0)),
+                'psnr_history': [0., 0.]})
+
+    def test_resume(self):
+        # model 'a' completed, model 'b' partially completed
+        scheduler = self.get_scheduler()
+        for jobs in [scheduler._get_jobs('a.pt', 'a', 1, ''),
+                     scheduler._get_jobs('b.pt', 'b', 1, '')[:4]]:
+            for job in jobs:
+                scheduler._complete(job, fake_validation_job(job))
+        scheduler = self.get_scheduler(resume=True)
+        results = scheduler.run(self.models, seed=1, log_path_base='')
+        # the completed model is yielded before running any job
+        model_path, psnr_histories = next(results)
+        self.assertEqual(model_path, 'a.pt')
+        self.assertEqual(self.run_jobs, [])
+        self.assertEqual(psnr_histories[1][2], [1., 2.])
+        model_path, psnr_histories = next(results)
+        self.assertEqual(model_path, 'b.pt')
+        self.assertEqual(self.run_jobs, [
+                os.path.join(os.path.abspath('b.pt'),
+                             val_sub_sub_path(i=1, i_sample=i_sample))
+                for i_sample in [1, 2]])
+        self.assertEqual(psnr_histories,
+                         [[[float(i), float(i_sample)]
+                           for i_sample in range(3)] for i in range(2)])
+        self.assertEqual(list(results), [])
+        self.assertEqual(len(self.load_jobs()), 12)
+        # without resume, the jobs file is cleared
+        self.get_scheduler()
+        self.assertEqual(self.load_jobs(), [])
+
+    def test_resume_changed_models(self):
+        # previously, 'b.pt' was the first model (with sub path 'a')
+        scheduler = self.get_scheduler()
+        for job in scheduler._get_jobs('b.pt', 'a', 1, ''):
+            scheduler._complete(job, [99.])
+        scheduler = self.get_scheduler(resume=True)
+        results = dict(scheduler.run(self.models, seed=1, log_path_base=''))
+        # the results of 'b.pt' are not attributed to 'a.pt'
+        self.assertEqual(len(self.run_jobs), 6)
+        self.assertTrue(all(key.startswith(os.path.abspath('a.pt'))
+                            for key in self.run_jobs))
+        self.assertEqual(results['a.pt'][1][2], [1., 2.])
+        self.assertEqual(results['b.pt'], [[[99.]] * 3] * 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import tempfile
+import numpy as np
+from deep_image_prior import DeepImagePriorReconstructor
+from deep_image_prior.deep_image_prior import LRPolicy
+from dip_test_utils import get_test_cfg, get_test_problem
+
+class TestWarmStart(unittest.TestCase):
+    def setUp(self):
+        self.log_path = tempfile.TemporaryDirectory()
+        self.cfg = get_test_cfg(self.log_path.name, {
+                'optim': {'warm_start': {'enabled': True,
+                                         'restore_optimizer_state': True,
+                                         'init_lr': 1e-5,
+                                         'num_warmup_iter': 5,
+                                         'iterations': 10}}})
+        problem = get_test_problem()
+        self.ray_trafo_module = problem.ray_trafo_module
+        self.reco_space = problem.reco_space
+        self.gt = problem.gt
+        self.noisy_obs = problem.noisy_obs
+
+    def tearDown(self):
+        self.log_path.cleanup()
+
+    def test_lr_policy_restart_num_warmup_iter(self):
+        lr_policy = LRPolicy(init_lr=1e-7, lr=1e-3, num_warmup_iter=10,
+                             num_iterations=20)
+        lr_policy.restart(5, 1e-5, 1e-3, preserve_initial_warmup=False,
+                          num_warmup_iter=3)
+        self.assertAlmostEqual(lr_policy(5), 1e-2)
+        self.assertAlmostEqual(lr_policy(7), 1.)
+        self.assertTrue(np.all(lr_policy.lambda_fct[7:] == 1.))
+
+    def test_warm_start(self):
+        reconstructor = DeepImagePriorReconstructor(
+                self.ray_trafo_module, reco_space=self.reco_space,
+                observation_space=None, cfg=self.cfg)
+        self.assertIsNone(reconstructor.warm_start_state)
+        # without a previous state, warm_start=True falls back to the usual
+        # initialization
+        _, histories_cold = reconstructor.reconstruct(
+                self.noisy_obs, fbp=self.gt, ground_truth=self.gt,
+                return_histories=True, warm_start=True)
+        self.assertEqual(len(histories_cold['loss']), 20)
+        self.assertIn('optimizer', reconstructor.warm_start_state)
+        _, histories_warm = reconstructor.reconstruct(
+                self.noisy_obs, fbp=self.gt, ground_truth=self.gt,
+                return_histories=True, warm_start=True)
+        self.assertEqual(len(histories_warm['loss']), 10)
+        self.assertAlmostEqual(histories_warm['lr_encoder'][0], 1e-5)
+        self.assertAlmostEqual(histories_warm['lr_decoder'][-1], 1e-3)
+        self.assertLess(histories_warm['loss'][0],
+                        histories_cold['loss'][0])
+        # the Adam state is continued
+        state = reconstructor.optimizer.state_dict()['state']
+        self.assertEqual(float(next(iter(state.values()))['step']), 30.)
+
+if __name__ == '__main__':
+    unittest.main()
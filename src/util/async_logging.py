@@ -0,0 +1,176 @@
+"""
+Provides :class:`LoggingService`, a tensorboard writer that moves writing and
+figure rendering off the training loop.
+"""
+import threading
+import queue
+import numpy as np
+import torch
+import tensorboardX
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+def to_numpy_snapshot(x):
+    """
+    Return a detached CPU copy of tensors (also inside dicts, lists and
+    tuples), so that it can be processed while training continues.
+    """
+    if isinstance(x, torch.Tensor):
+        return x.detach().cpu().numpy().copy()
+    if isinstance(x, dict):
+        return {k: to_numpy_snapshot(v) for k, v in x.items()}
+    if isinstance(x, (list, tuple)):
+        return type(x)(to_numpy_snapshot(v) for v in x)
+    return x
+
+
+def render_figure(render_func, data, figsize=None):
+    """
+    Render a figure to an RGB image array of shape ``H x W x 3``.
+
+    Uses the object-oriented matplotlib API (no :mod:`matplotlib.pyplot`),
+    so it is safe to call from a background thread.
+
+    Parameters
+    ----------
+    render_func : callable
+        Called as ``render_func(fig, **data)`` to draw on a
+        :class:`matplotlib.figure.Figure`.
+    data : dict
+        Keyword arguments for `render_func`.
+    figsize : 2-tuple of float, optional
+        Figure size in inches.
+    """
+    fig = Figure(figsize=figsize)
+    canvas = FigureCanvasAgg(fig)
+    render_func(fig, **data)
+    canvas.draw()
+    image = np.asarray(canvas.buffer_rgba())[..., :3].copy()
+    return image
+
+
+class LoggingService():
+    """
+    Wrapper of :class:`tensorboardX.SummaryWriter` processing the log
+    requests in a background thread.
+
+    Scalars are buffered and written in batches every `flush_interval`
+    seconds. If more than `max_pending_scalars` values of a tag are pending,
+    further values are aggregated into the last pending value (logging their
+    mean at the latest step). Images and figures are passed through a bounded
+    queue of size `max_queue_size`; if it is full, the request is dropped
+    (the number of dropped requests is logged as ``'logging/num_dropped'``
+    when closing). Thus, logging never blocks the caller.
+
+    Figures are specified by a render function and a data snapshot (see
+    :meth:`add_figure`), and are rendered in the background thread.
+
+    With ``asynchronous=False``, all requests are processed immediately by
+    the calling thread (like using the tensorboard writer directly).
+    """
+    def __init__(self, logdir, asynchronous=True, max_queue_size=64,
+                 max_pending_scalars=1000, flush_interval=1.):
+        self.writer = tensorboardX.SummaryWriter(logdir=logdir)
+        self.asynchronous = asynchronous
+        self.max_pending_scalars = max_pending_scalars
+        self.flush_interval = flush_interval
+        self.num_dropped = 0
+        self._scalars = {}  # tag -> list of [value_sum, count, step]
+        self._scalars_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = threading.Event()
+        self._thread = None
+        if self.asynchronous:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def add_scalar(self, tag, value, step):
+        """
+        Log a scalar, see :meth:`tensorboardX.SummaryWriter.add_scalar`.
+        `value` should be a python number (e.g. from ``loss.item()``).
+        """
+        if not self.asynchronous:
+            self.writer.add_scalar(tag, value, step)
+            return
+        with self._scalars_lock:
+            pending = self._scalars.setdefault(tag, [])
+            if len(pending) < self.max_pending_scalars:
+                pending.append([value, 1, step])
+            else:
+                pending[-1][0] += value
+                pending[-1][1] += 1
+                pending[-1][2] = step
+
+    def add_image(self, tag, img, step, dataformats='CHW'):
+        """
+        Log an image, see :meth:`tensorboardX.SummaryWriter.add_image`.
+        Tensors are copied to CPU before queuing.
+        """
+        self._submit(('image', tag, to_numpy_snapshot(img), step,
+                      dataformats))
+
+    def add_figure(self, tag, render_func, data, step, figsize=None):
+        """
+        Log a figure rendered by ``render_func(fig, **data)`` (see
+        :func:`render_figure`). Tensors in `data` are copied to CPU before
+        queuing, so the figure shows the state at the time of this call.
+        """
+        self._submit(('figure', tag, render_func, to_numpy_snapshot(data),
+                      step, figsize))
+
+    def _submit(self, item):
+        if not self.asynchronous:
+            self._process(item)
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.num_dropped += 1
+
+    def _process(self, item):
+        if item[0] == 'image':
+            _, tag, img, step, dataformats = item
+            self.writer.add_image(tag, img, step, dataformats=dataformats)
+        elif item[0] == 'figure':
+            _, tag, render_func, data, step, figsize = item
+            image = render_figure(render_func, data, figsize=figsize)
+            self.writer.add_image(tag, image, step, dataformats='HWC')
+
+    def _write_scalars(self):
+        with self._scalars_lock:
+            scalars, self._scalars = self._scalars, {}
+        for tag, pending in scalars.items():
+            for value_sum, count, step in pending:
+                self.writer.add_scalar(tag, value_sum / count, step)
+
+    def _run(self):
+        while True:
+            closed = self._closed.wait(timeout=self.flush_interval)
+            self._write_scalars()
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._process(item)
+            self.writer.flush()
+            if closed:
+                break
+
+    def flush(self):
+        if not self.asynchronous:
+            self.writer.flush()
+        # the background thread flushes every `flush_interval` seconds
+
+    def close(self):
+        """
+        Process all pending requests and close the writer.
+        """
+        if self._thread is not None:
+            self._closed.set()
+            self._thread.join()
+            self._thread = None
+        if self.num_dropped:
+            self.writer.add_scalar('logging/num_dropped', self.num_dropped)
+        self.writer.close()
@@ -1,6 +1,7 @@
 import torch
 from odl.contrib.torch import OperatorModule
 from .fbp import get_fbp_filter_op
+from .fbp_torch import FBPFilterModule
 
 class FBPModule(torch.nn.Module):
     """
@@ -30,6 +31,51 @@ class FBPModule(torch.nn.Module):
         return x
 
 
-def get_matrix_fbp_module(adjoint_func, proj_space, **kwards):
+class TorchFBPModule(torch.nn.Module):
+    """
+    Module for filtered back-projection applying a :class:`FBPFilterModule`,
+    followed by calling a specified adjoint.
+
+    In contrast to :class:`FBPModule`, the filter is precomputed and applied by
+    torch operations, so the whole module runs batch-wise on the device of the
+    input (no round trip through numpy via :class:`OperatorModule`).
+    """
+    def __init__(self, adjoint_func, proj_space, scaling_factor=1.,
+                 padding=True, filter_type='Ram-Lak', frequency_scaling=1.0):
+        """
+        Parameters
+        ----------
+        adjoint_func : callable
+            Callable module calculating the adjoint of the ray transform.
+            Receives a projection of shape ``B x C x angles x det_pixels`` and
+            returns an image.
+        proj_space : :class:`odl.DiscretizedSpace` or 2-sequence of int
+            Projection space or shape, see :func:`get_fbp_filter_op`.
+
+        Other Parameters
+        ----------------
+        See documentation of :func:`get_fbp_filter_op`.
+        """
+        super().__init__()
+        self.adjoint_func = adjoint_func
+        self.filter_mod = FBPFilterModule(
+                proj_space, padding=padding, filter_type=filter_type,
+                frequency_scaling=frequency_scaling,
+                scaling_factor=scaling_factor)
+
+    def forward(self, y):
+        """
+        Apply the filtered back-projection.
+        """
+        y = self.filter_mod(y)
+        x = self.adjoint_func(y)
+        return x
+
+
+def get_matrix_fbp_module(adjoint_func, proj_space, torch_filter=False,
+                          **kwards):
+
+    if torch_filter:
+        return TorchFBPModule(adjoint_func, proj_space, **kwards)
 
     return FBPModule(adjoint_func, proj_space, **kwards)
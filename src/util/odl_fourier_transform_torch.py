@@ -1,6 +1,32 @@
 import numpy as np
 import torch
 from odl.trafos.util import reciprocal_space
+try:
+    import torch.fft
+    _USE_TORCH_FFT_MODULE = True
+except ImportError:  # torch < 1.7
+    _USE_TORCH_FFT_MODULE = False
+
+
+def _rfft(x):
+    """
+    One-sided FFT along the last axis, returning real and imaginary parts
+    stacked in the last dimension (like the removed ``torch.rfft(x, 1)``).
+    """
+    if _USE_TORCH_FFT_MODULE:
+        return torch.view_as_real(torch.fft.rfft(x, dim=-1))
+    return torch.rfft(x, 1)
+
+
+def _irfft(y, n):
+    """
+    Inverse of :func:`_rfft` for signals of length `n` (like the removed
+    ``torch.irfft(y, 1, signal_sizes=(n,))``).
+    """
+    if _USE_TORCH_FFT_MODULE:
+        return torch.fft.irfft(
+                torch.view_as_complex(y.contiguous()), n=n, dim=-1)
+    return torch.irfft(y, 1, signal_sizes=(n,))
 
 
 def _get_signal_factor(signal_domain):
@@ -57,7 +83,7 @@ class FourierTransformModule(torch.nn.Module):
 
     def forward(self, x):
         x_preproc = self.preprocess(x)
-        y_nonpostproc = torch.rfft(x_preproc, 1)
+        y_nonpostproc = _rfft(x_preproc)
         y = self.postprocess(y_nonpostproc)
         return y
 
@@ -89,7 +115,6 @@ class FourierTransformInverseModule(torch.nn.Module):
 
     def forward(self, y):
         y_preproc = self.preprocess(y)
-        x_nonpostproc = torch.irfft(
-            y_preproc, 1, signal_sizes=(self.signal_domain.shape[-1],))
+        x_nonpostproc = _irfft(y_preproc, self.signal_domain.shape[-1])
         x = self.postprocess(x_nonpostproc)
         return x
@@ -0,0 +1,239 @@
+"""
+Provides :class:`PackingScheduler`, running many small jobs (e.g. 2D DIP
+reconstructions by ``coordinator.py``) as concurrent processes on a single
+node, with a limited number of threads and a fixed CPU affinity per job.
+"""
+import os
+import json
+import time
+import subprocess
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS',
+                   'OPENBLAS_NUM_THREADS']
+
+def get_available_cores():
+    """
+    Return the sorted ids of the cores the current process may run on.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+class PackingScheduler():
+    """
+    Scheduler running jobs (commands) as up to `concurrency` concurrent
+    processes.
+
+    Each job is assigned ``num_cores // concurrency`` (or
+    `num_threads_per_job`) cores exclusively: the thread environment
+    variables (`THREAD_ENV_VARS`, from which torch determines its number of
+    intra-op threads) are set accordingly, and the process is pinned to the
+    cores (if supported by the platform).
+
+    If `adaptive` is `True`, the concurrency is tuned by hill climbing: the
+    throughput (work per second, the work of a job being e.g. its number of
+    DIP iterations) is measured from the jobs started at the current
+    concurrency, and the concurrency is increased as long as the throughput
+    improves by at least `min_gain`, otherwise it is set back to the best
+    one.
+
+    The status of all jobs and the throughput (also in reconstructions per
+    hour) are written to the json file `summary_filename` whenever a job
+    starts or finishes.
+    """
+    def __init__(self, jobs, num_cores=None, concurrency=1,
+                 max_concurrency=None, num_threads_per_job=None,
+                 adaptive=True, min_gain=0.05, summary_filename=None,
+                 log_path=None, poll_interval=1.):
+        """
+        Parameters
+        ----------
+        jobs : list of dict
+            Jobs with the entries `'name'` (str), `'args'` (command, list of
+            str), and optionally `'work'` (scalar, the default is ``1``) and
+            `'num_reconstructions'` (int, the default is ``1``).
+        num_cores : int, optional
+            Number of cores to use (the first ones of
+            :func:`get_available_cores`). By default, all available cores are
+            used.
+        concurrency : int, optional
+            (Initial) number of concurrent jobs. The default is ``1``.
+        max_concurrency : int, optional
+            Maximum number of concurrent jobs for the adaptation. The default
+            is the number of cores (divided by `num_threads_per_job`).
+        num_threads_per_job : int, optional
+            Number of threads (and cores) per job. By default,
+            ``num_cores // concurrency`` is used.
+        adaptive : bool, optional
+            Whether to adapt the concurrency. The default is `True`.
+        min_gain : float, optional
+            Minimum relative throughput gain for increasing the concurrency.
+            The default is ``0.05``.
+        summary_filename : str, optional
+            Json file for the status summary.
+        log_path : str, optional
+            Directory for the output of the jobs (``<name>.log``). By default,
+            the output is not redirected.
+        poll_interval : float, optional
+            Interval in seconds for polling the processes.
+        """
+        self.jobs = [dict(job) for job in jobs]
+        self.cores = get_available_cores()
+        if num_cores is not None:
+            self.cores = self.cores[:num_cores]
+        if num_threads_per_job is not None and (
+                num_threads_per_job > len(self.cores)):
+            raise ValueError('num_threads_per_job ({:d}) exceeds the number '
+                             'of cores ({:d})'.format(num_threads_per_job,
+                                                      len(self.cores)))
+        self.num_threads_per_job = num_threads_per_job
+        self.max_concurrency = max_concurrency or (
+                len(self.cores) // (num_threads_per_job or 1))
+        self.concurrency = max(1, min(concurrency, self.max_concurrency))
+        self.adaptive = adaptive
+        self.min_gain = min_gain
+        self.summary_filename = summary_filename
+        self.log_path = log_path
+        self.poll_interval = poll_interval
+        self.throughputs = {}  # concurrency -> measured work per second
+        self.best_concurrency = None
+        self.start_time = None
+        for job in self.jobs:
+            job.setdefault('work', 1)
+            job.setdefault('num_reconstructions', 1)
+            job['status'] = 'pending'
+
+    @property
+    def threads_per_job(self):
+        return self.num_threads_per_job or max(
+                1, len(self.cores) // self.concurrency)
+
+    def _start(self, job, cores):
+        env = os.environ.copy()
+        for var in THREAD_ENV_VARS:
+            env[var] = str(len(cores))
+        preexec_fn = None
+        if hasattr(os, 'sched_setaffinity'):
+            preexec_fn = lambda: os.sched_setaffinity(0, cores)
+        stdout = None
+        if self.log_path is not None:
+            os.makedirs(self.log_path, exist_ok=True)
+            job['log'] = os.path.join(self.log_path, job['name'] + '.log')
+            stdout = open(job['log'], 'w')
+        job['process'] = subprocess.Popen(
+                job['args'], env=env, preexec_fn=preexec_fn,
+                stdout=stdout, stderr=subprocess.STDOUT if stdout else None)
+        if stdout is not None:
+            stdout.close()  # the child process keeps its copy
+        job.update({'status': 'running', 'cores': cores,
+                    'concurrency': self.concurrency,
+                    'start': time.time()})
+
+    def _finish(self, job, returncode):
+        job.pop('process')
+        job.update({'status': 'completed' if returncode == 0 else 'failed',
+                    'returncode': returncode, 'end': time.time()})
+        job['duration'] = job['end'] - job['start']
+
+    def _adapt(self):
+        if not self.adaptive or self.best_concurrency == self.concurrency:
+            return
+        # measure with the completed jobs started at the current concurrency
+        measured = [job for job in self.jobs
+                    if job['status'] == 'completed' and
+                    job['concurrency'] == self.concurrency]
+        if len(measured) < self.concurrency:
+            return
+        work_per_second = sum(job['work'] / job['duration']
+                              for job in measured) / len(measured)
+        self.throughputs[self.concurrency] = (
+                self.concurrency * work_per_second)
+        best = max(self.throughputs, key=self.throughputs.get)
+        if (best == self.concurrency and
+                self.concurrency < self.max_concurrency and
+                (len(self.throughputs) == 1 or
+                 self.throughputs[best] >= (1. + self.min_gain) * max(
+                        v for k, v in self.throughputs.items() if k != best))):
+            self.concurrency += 1
+        else:
+            self.best_concurrency = best
+            self.concurrency = best
+
+    def get_summary(self):
+        """
+        Return the status summary (as written to `summary_filename`).
+        """
+        completed = [job for job in self.jobs if job['status'] == 'completed']
+        elapsed = time.time() - self.start_time if self.start_time else 0.
+        num_reconstructions = sum(job['num_reconstructions']
+                                  for job in completed)
+        return {
+            'elapsed': elapsed,
+            'concurrency': self.concurrency,
+            'threads_per_job': self.threads_per_job,
+            'best_concurrency': self.best_concurrency,
+            'work_per_second_per_concurrency': {
+                    str(k): v for k, v in self.throughputs.items()},
+            'num_jobs': len(self.jobs),
+            'num_pending': sum(job['status'] == 'pending'
+                               for job in self.jobs),
+            'num_running': sum(job['status'] == 'running'
+                               for job in self.jobs),
+            'num_completed': len(completed),
+            'num_failed': sum(job['status'] == 'failed' for job in self.jobs),
+            'reconstructions_per_hour': (
+                    3600. * num_reconstructions / elapsed if elapsed else 0.),
+            'jobs': {job['name']: {k: v for k, v in job.items()
+                                   if k not in ('name', 'process')}
+                     for job in self.jobs},
+        }
+
+    def _write_summary(self):
+        if self.summary_filename is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.summary_filename)),
+                    exist_ok=True)
+        tmp_filename = self.summary_filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.get_summary(), f, indent=1)
+        os.replace(tmp_filename, self.summary_filename)
+
+    def run(self):
+        """
+        Run all jobs and return the summary.
+        """
+        self.start_time = time.time()
+        free_cores = list(self.cores)
+        pending = list(self.jobs)
+        running = []
+        self._write_summary()
+        try:
+            while pending or running:
+                changed = False
+                for job in list(running):
+                    returncode = job['process'].poll()
+                    if returncode is not None:
+                        running.remove(job)
+                        free_cores = sorted(free_cores + job['cores'])
+                        self._finish(job, returncode)
+                        self._adapt()
+                        changed = True
+                while (pending and len(running) < self.concurrency and
+                       len(free_cores) >= self.threads_per_job):
+                    job = pending.pop(0)
+                    cores = free_cores[:self.threads_per_job]
+                    free_cores = free_cores[self.threads_per_job:]
+                    self._start(job, cores)
+                    running.append(job)
+                    changed = True
+                if changed:
+                    self._write_summary()
+                if running:
+                    time.sleep(self.poll_interval)
+        finally:
+            for job in running:
+                job['process'].terminate()
+                job['process'].wait()
+                self._finish(job, job['process'].returncode)
+        self._write_summary()
+        return self.get_summary()
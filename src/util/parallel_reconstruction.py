@@ -0,0 +1,248 @@
+"""
+Provides the reconstruction of a single test sample as done by
+``coordinator.py`` (:func:`reconstruct_sample`), and the reconstruction of
+all test samples sequentially (:func:`reconstruct_samples`, optionally with
+warm starts) or in a pool of worker processes
+(:func:`reconstruct_samples_parallel`).
+"""
+import os
+from concurrent.futures import FIRST_COMPLETED, wait
+from copy import deepcopy
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+from dataset import get_standard_dataset
+from deep_image_prior import DeepImagePriorReconstructor
+from evaluation.history_store import HistoryStore
+from .reco_cache import (
+        get_reconstruction_cache, get_reconstruction_key, is_cacheable)
+from .process_pool import worker_state, get_worker_pool
+
+def sample_sub_path(i):
+    return 'sample_{:d}'.format(i)
+
+def get_sample_seed(cfg, i):
+    """
+    Return the model seed for test sample `i`, which is
+    ``cfg.mdl.torch_manual_seed + i`` if ``cfg.reconstruction_seed_per_sample``
+    is `True`, and ``cfg.mdl.torch_manual_seed`` otherwise.
+    """
+    seed = cfg.mdl.torch_manual_seed
+    if cfg.get('reconstruction_seed_per_sample', False) and seed is not None:
+        seed = seed + i
+    return seed
+
+def reconstruct_sample(cfg, reconstructor, noisy_obs, fbp, gt, i,
+                       sub_path='', reco_cache=None, history_store=None,
+                       warm_start=False):
+    """
+    Reconstruct test sample `i` and save its histories, iterates and iterate
+    parameters (as configured in `cfg`) in `sub_path` below the respective
+    paths. The histories are also appended to `history_store` (under the run
+    id ``os.getcwd()`` and ``sample=i``).
+
+    ``reconstructor.cfg.torch_manual_seed`` is set to
+    ``get_sample_seed(cfg, i)``, so `reconstructor` should not share its
+    config with `cfg`.
+
+    If `warm_start` is `True`, the reconstruction is initialized from the
+    final state of the previous reconstruction of `reconstructor` (see
+    :meth:`deep_image_prior.DeepImagePriorReconstructor.reconstruct`), and
+    `reco_cache` is not used. It is neither used if no seed is specified
+    (see :func:`util.reco_cache.is_cacheable`).
+
+    Returns
+    -------
+    reco : :class:`numpy.ndarray`
+        The reconstruction.
+    """
+    reconstructor.cfg.torch_manual_seed = get_sample_seed(cfg, i)
+    save_iterates = cfg.save_iterates_path is not None
+    save_iterates_params = cfg.save_iterates_params_path is not None
+    entry = None
+    use_cache = (reco_cache is not None and not warm_start and
+                 not save_iterates_params and  # iterates params are not cached
+                 is_cacheable(reconstructor.cfg))
+    if use_cache:
+        cache_key = get_reconstruction_key(
+                reconstructor.cfg, noisy_obs, fbp, gt,
+                extra={'data': OmegaConf.to_container(cfg.data, resolve=True)})
+        entry = reco_cache.get(cache_key, require_iterates=save_iterates)
+    if entry is not None:
+        reco = entry['reco']
+        optional_out = [entry['histories']]
+        if save_iterates:
+            optional_out += [entry['iterates'], entry['iterates_iters']]
+    else:
+        reco, *optional_out = reconstructor.reconstruct(
+                noisy_obs.float(), fbp, gt,
+                return_histories=True,
+                return_iterates=save_iterates,
+                return_iterates_params=save_iterates_params,
+                warm_start=warm_start)
+        if use_cache:
+            reco_cache.put(
+                    cache_key, reco, histories=optional_out[0],
+                    iterates=optional_out[1] if save_iterates else None,
+                    iterates_iters=optional_out[2] if save_iterates else None)
+    histories = optional_out.pop(0)
+    if cfg.save_histories_path is not None or history_store is not None:
+        histories = {k: np.array(v, dtype=np.float32)
+                     for k, v in histories.items()}
+        if cfg.save_histories_path is not None:
+            save_histories_path = os.path.join(cfg.save_histories_path,
+                                               sub_path)
+            os.makedirs(save_histories_path, exist_ok=True)
+            np.savez(os.path.join(save_histories_path, 'histories.npz'),
+                     **histories)
+        if history_store is not None:
+            history_store.append(os.getcwd(), histories, sample=i)
+    if save_iterates:
+        iterates = optional_out.pop(0)
+        iterates_iters = optional_out.pop(0)
+        save_iterates_path = os.path.join(cfg.save_iterates_path, sub_path)
+        os.makedirs(save_iterates_path, exist_ok=True)
+        np.savez_compressed(
+                os.path.join(save_iterates_path, 'iterates.npz'),
+                iterates=np.asarray(iterates),
+                iterates_iters=iterates_iters)
+    if save_iterates_params:
+        iterates_params = optional_out.pop(0)
+        iterates_params_iters = optional_out.pop(0)
+        save_iterates_params_path = os.path.join(
+                cfg.save_iterates_params_path, sub_path)
+        os.makedirs(save_iterates_params_path, exist_ok=True)
+        for params, iters in zip(iterates_params, iterates_params_iters):
+            torch.save(params,
+                       os.path.join(save_iterates_params_path,
+                                    'params_iters{:d}.pt'.format(iters)))
+    return reco
+
+def reconstruct_samples(cfg, reconstructor, samples, recos_dataset,
+                        reco_cache=None, history_store=None,
+                        warm_start=False):
+    """
+    Reconstruct test samples one after another, writing the reconstruction
+    of sample `i` to ``recos_dataset[i]``.
+
+    If `warm_start` is `True`, each sample (but the first) is initialized from
+    the final state of the previous one, and the results are saved in the sub
+    paths ``sample_sub_path(i)`` (see :func:`reconstruct_sample`). In this
+    mode, `reco_cache` is not used for any sample: the warm start chain
+    depends on the state of the reconstruction of the first sample, which is
+    not restored from the cache.
+
+    Parameters
+    ----------
+    cfg : :class:`omegaconf.OmegaConf`
+        Full configuration of the run.
+    reconstructor : :class:`deep_image_prior.DeepImagePriorReconstructor`
+        Reconstructor (not sharing its config with `cfg`).
+    samples : iterable
+        Samples ``(noisy_obs, fbp, *gt)`` (with batch dimension), e.g. a
+        :class:`torch.utils.data.DataLoader`.
+    recos_dataset : :class:`h5py.Dataset`
+        Dataset with one slot per sample.
+    reco_cache : :class:`util.reco_cache.ReconstructionCache`, optional
+        Reconstruction cache (ignored if `warm_start` is `True`).
+    history_store : :class:`evaluation.history_store.HistoryStore`, optional
+        Store to which the histories are appended.
+    warm_start : bool, optional
+        Whether to warm start from the previous sample.
+    """
+    if warm_start:
+        reco_cache = None
+    for i, (noisy_obs, fbp, *gt) in enumerate(samples):
+        gt = gt[0] if gt else None
+        recos_dataset[i] = reconstruct_sample(
+                cfg, reconstructor, noisy_obs, fbp, gt, i,
+                sub_path=sample_sub_path(i) if warm_start else '',
+                reco_cache=reco_cache, history_store=history_store,
+                warm_start=warm_start and i > 0)
+
+def _get_worker_state(cfg):
+    dataset, ray_trafos = get_standard_dataset(cfg.data.name, cfg.data)
+    reconstructor = DeepImagePriorReconstructor(
+            ray_trafo_module=ray_trafos['ray_trafo_module'],
+            reco_space=dataset.space[1], observation_space=dataset.space[0],
+            cfg=deepcopy(cfg.mdl))
+    history_store = (
+            HistoryStore(cfg.save_histories_store_filename)
+            if cfg.get('save_histories_store_filename') is not None else None)
+    return {'cfg': cfg, 'reconstructor': reconstructor,
+            'reco_cache': get_reconstruction_cache(cfg),
+            'history_store': history_store}
+
+def run_reconstruction_job(job):
+    """
+    Reconstruct a test sample (in a worker of the pool created by
+    :func:`reconstruct_samples_parallel`).
+
+    Parameters
+    ----------
+    job : tuple
+        ``(i, noisy_obs, fbp, gt)``, with the sample index `i` and the
+        sample tensors (including the batch dimension).
+
+    Returns
+    -------
+    i : int
+        The sample index.
+    reco : :class:`numpy.ndarray`
+        The reconstruction.
+    """
+    i, noisy_obs, fbp, gt = job
+    reco = reconstruct_sample(
+            worker_state['cfg'], worker_state['reconstructor'],
+            noisy_obs, fbp, gt, i, sub_path=sample_sub_path(i),
+            reco_cache=worker_state['reco_cache'],
+            history_store=worker_state['history_store'])
+    return i, reco
+
+def reconstruct_samples_parallel(cfg, samples, recos_dataset, num_workers,
+                                 num_threads_per_worker=None):
+    """
+    Reconstruct test samples in a pool of `num_workers` processes.
+
+    The samples are passed to the workers, which save the results of sample
+    `i` in the sub path ``sample_sub_path(i)`` (see :func:`reconstruct_sample`)
+    and return the reconstruction, which is written to ``recos_dataset[i]``
+    by the calling process (so only one process writes to the HDF5 file).
+
+    Paths in `cfg` (``cfg.save_histories_store_filename`` and
+    ``cfg.reconstruction_cache_path``) must be absolute or relative to the
+    current working directory, see :func:`util.process_pool.get_worker_pool`.
+
+    Parameters
+    ----------
+    cfg : :class:`omegaconf.OmegaConf`
+        Full configuration of the run.
+    samples : iterable
+        Samples ``(noisy_obs, fbp, *gt)`` (without batch dimension), e.g. a
+        torch dataset.
+    recos_dataset : :class:`h5py.Dataset`
+        Dataset with one slot per sample.
+    num_workers : int
+        Number of worker processes.
+    num_threads_per_worker : int, optional
+        Number of torch threads per worker. By default, the torch default is
+        used.
+    """
+    with get_worker_pool(
+            num_workers, _get_worker_state, initargs=(cfg,),
+            num_threads_per_worker=num_threads_per_worker) as executor:
+        futures = set()
+        for i, (noisy_obs, fbp, *gt) in enumerate(samples):
+            gt = gt[0].unsqueeze(dim=0) if gt else None
+            futures.add(executor.submit(
+                    run_reconstruction_job,
+                    (i, noisy_obs.unsqueeze(dim=0), fbp.unsqueeze(dim=0), gt)))
+            # keep the number of samples in memory bounded
+            while len(futures) >= 2 * num_workers:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i_done, reco = future.result()
+                    recos_dataset[i_done] = reco
+        for future in futures:
+            i_done, reco = future.result()
+            recos_dataset[i_done] = reco
@@ -0,0 +1,64 @@
+"""
+Provides a process pool whose workers set up their state (e.g. the dataset
+and a reconstructor) once, shared by ``util.parallel_reconstruction`` and
+``validation.parallel``.
+
+The state is created by an initializer returning a dict, which is stored in
+:data:`worker_state` of each worker process (see :func:`get_worker_pool`).
+For running jobs sequentially in the calling process instead,
+:func:`init_worker_state` can be called directly.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import torch
+from hydra.utils import to_absolute_path
+
+# state of the current (worker) process, set by `init_worker_state`
+worker_state = {}
+
+def init_worker_state(initializer, initargs=(), num_threads=None):
+    """
+    Set :data:`worker_state` to ``initializer(*initargs)``.
+
+    Parameters
+    ----------
+    initializer : callable
+        Function returning the state dict (must be picklable, i.e. defined
+        at module level).
+    initargs : tuple, optional
+        Arguments passed to `initializer`.
+    num_threads : int, optional
+        Number of torch threads. By default, the torch default is used.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    worker_state.clear()
+    worker_state.update(initializer(*initargs))
+
+def get_worker_pool(num_workers, initializer, initargs=(),
+                    num_threads_per_worker=None):
+    """
+    Return a :class:`concurrent.futures.ProcessPoolExecutor` with
+    `num_workers` spawned processes, each initialized by
+    :func:`init_worker_state`.
+
+    Paths passed to the workers must be absolute or relative to the current
+    working directory (which the workers inherit), see
+    :func:`make_paths_absolute`.
+    """
+    return ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker_state,
+            initargs=(initializer, initargs, num_threads_per_worker))
+
+def make_paths_absolute(cfg, keys):
+    """
+    Replace the paths ``cfg[key]`` (if specified) by absolute paths, resolved
+    relative to the original working directory of the hydra run, so that
+    they are valid independent of the working directory, e.g. in worker
+    processes.
+    """
+    for key in keys:
+        if cfg.get(key) is not None:
+            cfg[key] = to_absolute_path(cfg[key])
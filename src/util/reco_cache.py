@@ -0,0 +1,240 @@
+"""
+Provides :class:`ReconstructionCache`, a content-addressed cache of DIP
+reconstruction results (reconstruction, histories and optionally iterates),
+which is shared by ``coordinator.py``, ``validation.py`` and
+``validation_baseline.py``.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import torch
+from omegaconf import OmegaConf
+
+# `cfg.mdl` entries that do not affect the results
+IGNORED_MDL_KEYS = ['log_path', 'learned_params_path', 'show_pbar',
+                    'async_logging']
+
+# (path, size, mtime) -> sha256 of the file contents
+_file_hashes = {}
+
+def get_file_hash(path):
+    """
+    Return the sha256 hex digest of the contents of a file (remembered for
+    unchanged files).
+    """
+    stat = os.stat(path)
+    file_key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if file_key not in _file_hashes:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _file_hashes[file_key] = h.hexdigest()
+    return _file_hashes[file_key]
+
+def _update_with_array(h, x):
+    if x is None:
+        h.update(b'None')
+        return
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().numpy()
+    # leading singleton (batch and channel) dimensions are irrelevant
+    x = np.ascontiguousarray(np.squeeze(x), dtype=np.float32)
+    h.update(json.dumps(x.shape).encode())
+    h.update(x.tobytes())
+
+def is_cacheable(cfg_mdl):
+    """
+    Return whether the reconstruction with the model configuration `cfg_mdl`
+    is deterministic and may be cached, i.e. whether a seed is specified
+    (``cfg_mdl.torch_manual_seed``, which is only applied if truthy, see
+    :class:`deep_image_prior.DeepImagePriorReconstructor`).
+    """
+    return bool(cfg_mdl.get('torch_manual_seed'))
+
+def get_reconstruction_key(cfg_mdl, noisy_observation, fbp=None,
+                           ground_truth=None, extra=None):
+    """
+    Return the cache key of a DIP reconstruction.
+
+    Parameters
+    ----------
+    cfg_mdl : :class:`omegaconf.OmegaConf`
+        Effective configuration of the model (including the seed
+        ``cfg_mdl.torch_manual_seed``, which should be set, see
+        :func:`is_cacheable`). The entries in `IGNORED_MDL_KEYS` are
+        ignored; if ``cfg_mdl.load_pretrain_model`` is `True`, the contents of
+        the checkpoint ``cfg_mdl.learned_params_path`` are hashed instead of
+        its path.
+    noisy_observation, fbp, ground_truth : :class:`torch.Tensor`
+        Input data.
+    extra : dict, optional
+        Further json serializable values affecting the result, e.g. the data
+        configuration (determining the ray transform).
+
+    Returns
+    -------
+    key : str
+        sha256 hex digest.
+    """
+    params_hash = None
+    if cfg_mdl.load_pretrain_model:
+        path = cfg_mdl.learned_params_path
+        params_hash = get_file_hash(
+                path if path.endswith('.pt') else path + '.pt')
+    cfg_mdl = OmegaConf.to_container(cfg_mdl, resolve=True)
+    for k in IGNORED_MDL_KEYS:
+        cfg_mdl.pop(k, None)
+    h = hashlib.sha256()
+    h.update(json.dumps({'mdl': cfg_mdl, 'params_hash': params_hash,
+                         'extra': extra}, sort_keys=True, default=str).encode())
+    for x in [noisy_observation, fbp, ground_truth]:
+        _update_with_array(h, x)
+    return h.hexdigest()
+
+class ReconstructionCache():
+    """
+    Content-addressed cache of reconstruction results, see
+    :func:`get_reconstruction_key`.
+
+    Each entry is a ``.npz`` file ``<path>/<key[:2]>/<key>.npz`` with the
+    arrays `'reco'`, ``'histories.<name>'`` and optionally `'iterates'` and
+    `'iterates_iters'`. Entries are written atomically, so the cache can be
+    shared by concurrent processes.
+
+    If `max_size` is specified, the least recently used entries (by
+    modification time, which is updated on each hit) are removed after
+    adding an entry until the total size is at most `max_size` bytes.
+    """
+    def __init__(self, path, max_size=None):
+        """
+        Parameters
+        ----------
+        path : str
+            Cache directory.
+        max_size : int, optional
+            Maximum total size of the entries in bytes. By default, no
+            entries are removed.
+        """
+        self.path = path
+        self.max_size = max_size
+
+    def _get_filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.npz')
+
+    def get(self, key, require_iterates=False):
+        """
+        Return the entry `key`, or `None` if it is not cached (or does not
+        contain the iterates while `require_iterates` is `True`).
+
+        Returns
+        -------
+        entry : dict or None
+            Entry with the keys `'reco'` (:class:`numpy.ndarray`) and
+            `'histories'` (dict of :class:`numpy.ndarray`), and if stored,
+            `'iterates'` and `'iterates_iters'`.
+        """
+        filename = self._get_filename(key)
+        try:
+            with np.load(filename) as data:
+                if require_iterates and 'iterates' not in data:
+                    return None
+                entry = {'histories': {}}
+                for name in data.files:
+                    if name.startswith('histories.'):
+                        entry['histories'][name[len('histories.'):]] = (
+                                data[name])
+                    else:
+                        entry[name] = data[name]
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(filename)
+        except FileNotFoundError:  # removed concurrently
+            pass
+        return entry
+
+    def put(self, key, reco, histories=None, iterates=None,
+            iterates_iters=None):
+        """
+        Store (or replace) the entry `key` and remove the least recently used
+        entries if the cache exceeds `max_size`.
+        """
+        arrays = {'reco': np.asarray(reco)}
+        for name, history in (histories or {}).items():
+            arrays['histories.' + name] = np.asarray(history,
+                                                     dtype=np.float32)
+        if iterates is not None:
+            arrays['iterates'] = np.asarray(iterates)
+            arrays['iterates_iters'] = np.asarray(iterates_iters)
+        filename = self._get_filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(
+                dir=os.path.dirname(filename), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.remove(tmp_filename)
+            raise
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def _list_entries(self):
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        with os.scandir(self.path) as it:
+            subdirs = [entry.path for entry in it if entry.is_dir()]
+        for subdir in subdirs:
+            with os.scandir(subdir) as it:
+                for entry in it:
+                    if entry.name.endswith('.npz'):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append(
+                                (stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    @property
+    def size(self):
+        """
+        Total size of the entries in bytes.
+        """
+        return sum(size for _, size, _ in self._list_entries())
+
+    def evict(self, max_size):
+        """
+        Remove the least recently used entries until the total size is at
+        most `max_size` bytes.
+        """
+        entries = sorted(self._list_entries())
+        size = sum(size for _, size, _ in entries)
+        for _, entry_size, filename in entries:
+            if size <= max_size:
+                break
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+def get_reconstruction_cache(cfg):
+    """
+    Return the :class:`ReconstructionCache` configured by
+    ``cfg.reconstruction_cache_path`` and
+    ``cfg.reconstruction_cache_max_size_gb``, or `None` if no path is
+    specified.
+    """
+    if cfg.get('reconstruction_cache_path') is None:
+        return None
+    max_size_gb = cfg.get('reconstruction_cache_max_size_gb')
+    return ReconstructionCache(
+            cfg.reconstruction_cache_path,
+            max_size=(int(max_size_gb * 1e9) if max_size_gb is not None
+                      else None))
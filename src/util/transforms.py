@@ -40,7 +40,8 @@ def random_brightness_contrast(images,
 
     for image in images:
 
-        image_out = image * contrast_factor + brightness_shift
+        image_out = (image * contrast_factor.to(image.device) +
+                     brightness_shift.to(image.device))
 
         if clip_range is not None:
             image_out = torch.clip(image_out,
@@ -3,9 +3,17 @@ import os
 import os.path
 import re
 import json
+import shutil
+from warnings import warn
+from hydra.utils import to_absolute_path
 from omegaconf import DictConfig, OmegaConf
 from dataset import get_validation_data, get_standard_dataset
-from validation import validate_model, val_sub_sub_path
+from validation import (
+        validate_model, get_validation_info, val_sub_sub_path,
+        ValidationJobScheduler, get_successive_halving_score,
+        select_survivors)
+from evaluation.run_index import RunIndex
+from util.process_pool import make_paths_absolute
 from copy import deepcopy
 import difflib
 
@@ -15,12 +23,16 @@ def print_dct(dct):
         for value in values:
             print(value)
 
-def collect_runs_paths(base_paths, exclude_re=None):
+def collect_runs_paths(base_paths, exclude_re=None, run_index=None):
     paths = {}
     if isinstance(base_paths, str):
         base_paths = [base_paths]
-    for base_path in base_paths:
-        path = os.path.join(os.getcwd().partition('src')[0], base_path)
+    base_paths = [os.path.join(os.getcwd().partition('src')[0], base_path)
+                  for base_path in base_paths]
+    if run_index is not None:
+        run_index.refresh(base_paths)
+        return run_index.get_checkpoints(base_paths, exclude_re=exclude_re)
+    for path in base_paths:
         for dirpath, dirnames, filenames in os.walk(path):
             paths[dirpath] = sorted(
                     [f for f in filenames if f.endswith(".pt") and (
@@ -29,6 +41,40 @@ def collect_runs_paths(base_paths, exclude_re=None):
     paths = {k:v for k, v in sorted(paths.items()) if v}
     return paths
 
+def get_round_jobs_filename(jobs_filename, r):
+    root, ext = os.path.splitext(jobs_filename)
+    return '{}_round_{:d}{}'.format(root, r, ext)
+
+def prepare_resume(cfg, jobs_filename):
+    """
+    Prepare resuming from the results and jobs files of a previous run.
+
+    The files are looked up relative to the current (hydra run) directory,
+    so either ``hydra.run.dir`` must be set to the previous run directory, or
+    ``cfg.val.resume_run_path`` must specify it (the files are then copied
+    from there). A warning is issued if no file is found.
+    """
+    filenames = [cfg.val.results_filename, jobs_filename]
+    sh_cfg = cfg.val.get('successive_halving')
+    if sh_cfg is not None and sh_cfg.enabled:
+        filenames += [get_round_jobs_filename(jobs_filename, r)
+                      for r in range(len(sh_cfg.iterations))]
+    resume_run_path = cfg.val.get('resume_run_path')
+    if resume_run_path is not None:
+        resume_run_path = to_absolute_path(resume_run_path)
+        for filename in filenames:
+            src = os.path.join(resume_run_path, filename)
+            if (os.path.isfile(src) and
+                    os.path.abspath(src) != os.path.abspath(filename)):
+                os.makedirs(os.path.dirname(os.path.abspath(filename)),
+                            exist_ok=True)
+                shutil.copyfile(src, filename)
+    if not any(os.path.isfile(filename) for filename in filenames):
+        warn('val.resume is True, but no results or jobs files of a previous '
+             'run were found in \'{}\' (set val.resume_run_path or '
+             'hydra.run.dir to the previous run directory), starting over'
+             .format(os.getcwd()))
+
 def val_sub_path_ckpt(i_run, i_ckpt):
     sub_path_ckpt = os.path.join('run_{:d}'.format(i_run),
                                  'ckpt_{:d}'.format(i_ckpt))
@@ -45,8 +91,14 @@ def coordinator(cfg : DictConfig) -> None:
     assert cfg.mdl.load_pretrain_model, \
     'load_pretrain_model is False, assertion failed'
 
+    run_index = (RunIndex(to_absolute_path(cfg.val.run_index_filename))
+                 if cfg.val.get('run_index_filename') is not None else None)
+    make_paths_absolute(cfg, ['save_histories_store_filename',
+                              'reconstruction_cache_path'])
+
     runs = collect_runs_paths(cfg.val.multirun_base_paths,
-                              exclude_re=cfg.val.get('exclude_re'))
+                              exclude_re=cfg.val.get('exclude_re'),
+                              run_index=run_index)
     print_dct(runs) # visualise runs and models checkpoints
 
     if cfg.val.load_histories_from_run_path is not None:
@@ -98,24 +150,112 @@ def coordinator(cfg : DictConfig) -> None:
 
     os.makedirs(os.path.dirname(os.path.abspath(cfg.val.results_filename)), exist_ok=True)
 
+    # when resuming, keep the infos of the models validated already
+    resume = cfg.val.get('resume', False)
+    jobs_filename = cfg.val.get('jobs_filename', 'val_jobs.jsonl')
+    if resume:
+        prepare_resume(cfg, jobs_filename)
+    if resume and os.path.isfile(cfg.val.results_filename):
+        with open(cfg.val.results_filename, 'r') as f:
+            infos.update({k: v for k, v in json.load(f).items()
+                          if k != 'baseline'})
+
     with open(cfg.val.results_filename, 'w') as f:
         json.dump(infos, f, indent=1)
 
     # validate pretrained models
     for k, v in cfg.val.mdl_overrides.items():
         OmegaConf.update(cfg_mdl_val, k, v, merge=False)
-    for i_run, (directory_path, checkpoints_paths) in enumerate(runs.items()):
-        for i_ckpt, filename in enumerate(checkpoints_paths):
-            print('model:\n{}\nfrom path:\n{}'.format(filename, directory_path))
-            cfg_mdl_val.learned_params_path = os.path.join(directory_path, filename)
+    models = [(os.path.join(directory_path, filename),
+               val_sub_path_ckpt(i_run=i_run, i_ckpt=i_ckpt))
+              for i_run, (directory_path, checkpoints_paths) in enumerate(runs.items())
+              for i_ckpt, filename in enumerate(checkpoints_paths)]
+    if cfg.val.load_histories_from_run_path is not None:
+        models = [(model_path, val_sub_path_mdl) for model_path, val_sub_path_mdl in models
+                  if model_path not in infos]
+        for model_path, val_sub_path_mdl in models:
+            print('model:\n{}'.format(model_path))
+            cfg_mdl_val.learned_params_path = model_path
             _, info = validate_model(
                     val_dataset=val_dataset, ray_trafo=ray_trafo,
-                    val_sub_path_mdl=val_sub_path_ckpt(i_run=i_run, i_ckpt=i_ckpt),
+                    val_sub_path_mdl=val_sub_path_mdl,
                     baseline_psnr_steady=baseline_psnr_steady, seed=seed,
                     log_path_base=log_path_base,
                     cfg=cfg, cfg_mdl_val=cfg_mdl_val)
 
-            infos[os.path.join(directory_path, filename)] = info
+            infos[model_path] = info
+
+            with open(cfg.val.results_filename, 'w') as f:
+                json.dump(infos, f, indent=1)
+    else:
+        # run the (model, repetition, sample) reconstructions as jobs in a
+        # process pool, storing completed jobs for resuming
+        def get_scheduler(cfg_run, cfg_mdl_run, jobs_filename):
+            return ValidationJobScheduler(
+                    cfg_run, cfg_mdl_run, num_samples=len(val_dataset),
+                    jobs_filename=jobs_filename,
+                    num_workers=cfg.val.get('num_workers', 0),
+                    num_threads_per_worker=cfg.val.get('num_threads_per_worker'),
+                    resume=resume)
+
+        sh_cfg = cfg.val.get('successive_halving')
+        if sh_cfg is not None and sh_cfg.enabled:
+            # prune the models in rounds with small budgets, only the
+            # survivors are validated with the full budget
+            sh_results = {}
+            for r, (iterations, num_repeats) in enumerate(
+                    zip(sh_cfg.iterations, sh_cfg.num_repeats)):
+                round_sub_path = 'successive_halving_round_{:d}'.format(r)
+                cfg_round = deepcopy(cfg)
+                cfg_round.val.num_repeats = num_repeats
+                cfg_mdl_round = deepcopy(cfg_mdl_val)
+                cfg_mdl_round.optim.iterations = iterations
+                scheduler = get_scheduler(
+                        cfg_round, cfg_mdl_round,
+                        get_round_jobs_filename(jobs_filename, r))
+                scores = {}
+                for model_path, psnr_histories in scheduler.run(
+                        [(model_path, os.path.join(round_sub_path, val_sub_path_mdl))
+                         for model_path, val_sub_path_mdl in models],
+                        seed=seed, log_path_base=log_path_base):
+                    scores[model_path] = get_successive_halving_score(
+                            psnr_histories)
+                scores = {model_path: scores[model_path]
+                          for model_path, _ in models}
+                survivors = select_survivors(
+                        scores,
+                        cfg.val.tolerated_diff_to_max_psnr_steady + sh_cfg.psnr_margin,
+                        eta=sh_cfg.get('eta'))
+                for model_path, score in scores.items():
+                    sh_results.setdefault(model_path, []).append({
+                            'round': r, 'iterations': iterations,
+                            'num_repeats': num_repeats,
+                            'max_median_PSNR': score,
+                            'kept': model_path in survivors})
+                print('successive halving round {:d} ({:d} iterations, {:d} '
+                      'repeats): keeping {:d} of {:d} models'.format(
+                              r, iterations, num_repeats, len(survivors),
+                              len(scores)))
+                os.makedirs(os.path.dirname(os.path.abspath(sh_cfg.results_filename)), exist_ok=True)
+                with open(sh_cfg.results_filename, 'w') as f:
+                    json.dump(sh_results, f, indent=1)
+                models = [(model_path, val_sub_path_mdl)
+                          for model_path, val_sub_path_mdl in models
+                          if model_path in survivors]
+            # infos of pruned models (from a previous run) are not comparable
+            infos = {k: v for k, v in infos.items()
+                     if k == 'baseline' or k in dict(models)}
+
+        models = [(model_path, val_sub_path_mdl) for model_path, val_sub_path_mdl in models
+                  if model_path not in infos]
+        scheduler = get_scheduler(cfg, cfg_mdl_val, jobs_filename)
+        for model_path, psnr_histories in scheduler.run(
+                models, seed=seed, log_path_base=log_path_base,
+                baseline_psnr_steady=baseline_psnr_steady):
+            print('validated model:\n{}'.format(model_path))
+            infos[model_path] = get_validation_info(
+                    psnr_histories, baseline_psnr_steady, cfg,
+                    iterations=cfg_mdl_val.optim.iterations)
 
             with open(cfg.val.results_filename, 'w') as f:
                 json.dump(infos, f, indent=1)
@@ -1 +1,3 @@
-from .validation import validate_model, val_sub_sub_path
+from .validation import validate_model, get_validation_info, val_sub_sub_path
+from .parallel import ValidationJobScheduler
+from .successive_halving import get_successive_halving_score, select_survivors
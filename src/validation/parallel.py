@@ -0,0 +1,216 @@
+"""
+Provides :class:`ValidationJobScheduler`, running the DIP reconstructions for
+validating multiple models (checkpoints) as independent jobs in a process
+pool.
+"""
+import os
+import json
+from concurrent.futures import FIRST_COMPLETED, wait
+from copy import deepcopy
+from dataset import get_validation_data, get_standard_dataset
+from util.process_pool import (
+        worker_state, init_worker_state, get_worker_pool)
+from .validation import reconstruct, val_sub_sub_path
+
+def _get_worker_state(cfg, cfg_mdl_val):
+    dataset, ray_trafos = get_standard_dataset(cfg.data.name, cfg.data)
+    ray_trafo = {'ray_trafo_module': ray_trafos['ray_trafo_module'],
+                 'reco_space': dataset.space[1],
+                 'observation_space': dataset.space[0]}
+    return {'cfg': cfg, 'cfg_mdl_val': cfg_mdl_val, 'ray_trafo': ray_trafo,
+            'val_dataset': get_validation_data(cfg.data.name, cfg.data)}
+
+def run_validation_job(job):
+    """
+    Run the reconstruction of a validation job (in a worker of the pool of
+    :class:`ValidationJobScheduler`, or in the calling process after
+    ``init_worker_state(_get_worker_state, ...)``) and return its PSNR
+    history.
+
+    Parameters
+    ----------
+    job : dict
+        Job specification with the entries `'learned_params_path'`,
+        `'val_sub_path_mdl'`, `'i'` (repetition), `'i_sample'` and `'seed'`
+        (model seed ``seed + i``), `'log_path_base'` and
+        `'baseline_psnr_steady'` (for stopping early, see
+        :func:`validation.reconstruct`).
+    """
+    cfg = worker_state['cfg']
+    cfg_mdl_val = deepcopy(worker_state['cfg_mdl_val'])
+    noisy_obs, fbp, *gt = worker_state['val_dataset'][job['i_sample']]
+    gt = gt[0] if gt else None
+    save_val_sub_path = os.path.join(
+            job['val_sub_path_mdl'],
+            val_sub_sub_path(i=job['i'], i_sample=job['i_sample']))
+    cfg_mdl_val.learned_params_path = job['learned_params_path']
+    cfg_mdl_val.torch_manual_seed = job['seed'] + job['i']
+    cfg_mdl_val.log_path = os.path.join(job['log_path_base'],
+                                        save_val_sub_path)
+    _, psnr_history = reconstruct(
+            noisy_obs=noisy_obs.float().unsqueeze(dim=0),
+            fbp=fbp.unsqueeze(dim=0), gt=gt.unsqueeze(dim=0),
+            ray_trafo=worker_state['ray_trafo'],
+            save_val_sub_path=save_val_sub_path,
+            cfg=cfg, cfg_mdl_val=cfg_mdl_val,
+            history_store_key=(
+                    os.path.join(os.getcwd(), job['val_sub_path_mdl']),
+                    job['i'], job['i_sample']),
+            baseline_psnr_steady=job.get('baseline_psnr_steady'))
+    return psnr_history
+
+class ValidationJobScheduler():
+    """
+    Scheduler for the validation reconstructions of multiple models.
+
+    Each (model, repetition, sample) reconstruction is a job, which is run by
+    a pool of `num_workers` processes, each using `num_threads_per_worker`
+    threads for torch intra-op parallelism (with ``num_workers=0``, the jobs
+    are run sequentially in the calling process).
+
+    Completed jobs are appended to the json lines file `jobs_filename`
+    (one ``{"key": ..., "psnr_history": [...]}`` per line), from which they
+    are loaded when resuming instead of being run again. The key of a job
+    consists of the absolute path of the model and the repetition and sample
+    indices, so results are not attributed to another model if the list of
+    models changed in between.
+    """
+    def __init__(self, cfg, cfg_mdl_val, num_samples, jobs_filename,
+                 num_workers=0, num_threads_per_worker=None, resume=False):
+        """
+        Parameters
+        ----------
+        cfg : :class:`omegaconf.OmegaConf`
+            Full configuration of the run.
+        cfg_mdl_val : :class:`omegaconf.OmegaConf`
+            Configuration of the model (see
+            :func:`validation.validate_model`).
+        num_samples : int
+            Number of validation samples.
+        jobs_filename : str
+            File storing the results of completed jobs.
+        num_workers : int, optional
+            Number of worker processes. The default is ``0``.
+        num_threads_per_worker : int, optional
+            Number of torch threads per worker. By default, the torch default
+            is used.
+        resume : bool, optional
+            Whether to load the completed jobs from `jobs_filename`.
+            Otherwise, the file is cleared.
+        """
+        self.cfg = cfg
+        self.cfg_mdl_val = cfg_mdl_val
+        self.num_samples = num_samples
+        self.jobs_filename = jobs_filename
+        self.num_workers = num_workers
+        self.num_threads_per_worker = num_threads_per_worker
+        self.completed = {}
+        if resume and os.path.isfile(jobs_filename):
+            with open(jobs_filename, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        result = json.loads(line)
+                        self.completed[result['key']] = result['psnr_history']
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(jobs_filename)),
+                        exist_ok=True)
+            open(jobs_filename, 'w').close()
+
+    def _get_jobs(self, model_path, val_sub_path_mdl, seed, log_path_base,
+                  baseline_psnr_steady=None):
+        jobs = []
+        for i in range(self.cfg.val.num_repeats):
+            for i_sample in range(self.num_samples):
+                key = os.path.join(os.path.abspath(model_path),
+                                   val_sub_sub_path(i=i, i_sample=i_sample))
+                jobs.append({'key': key, 'model_path': model_path,
+                             'learned_params_path': model_path,
+                             'val_sub_path_mdl': val_sub_path_mdl,
+                             'i': i, 'i_sample': i_sample, 'seed': seed,
+                             'log_path_base': log_path_base,
+                             'baseline_psnr_steady': baseline_psnr_steady})
+        return jobs
+
+    def _complete(self, job, psnr_history):
+        self.completed[job['key']] = psnr_history
+        with open(self.jobs_filename, 'a') as f:
+            f.write(json.dumps({'key': job['key'],
+                                'psnr_history': psnr_history}) + '\n')
+
+    def run(self, models, seed, log_path_base, baseline_psnr_steady=None):
+        """
+        Run the validation jobs of the models and yield the PSNR histories of
+        each model as soon as all of its jobs are completed.
+
+        Parameters
+        ----------
+        models : list of 2-tuple of str
+            Pairs ``(model_path, val_sub_path_mdl)``, see
+            :func:`validation.validate_model`.
+        seed : int
+            Initial seed for the model, see
+            :func:`validation.validate_model`.
+        log_path_base : str
+            Base path under which to save the tensorboard logs.
+        baseline_psnr_steady : float, optional
+            Steady PSNR of a baseline, used for stopping the reconstructions
+            early if ``cfg.val.early_stop_at_rise_time`` is `True`.
+
+        Yields
+        ------
+        model_path : str
+            Path of the model.
+        psnr_histories : list of lists of lists of scalar values
+            PSNR histories of all runs, indexed like
+            ``psnr_histories[i][i_sample]``.
+        """
+        jobs_per_model = {
+                model_path: self._get_jobs(model_path, val_sub_path_mdl, seed,
+                                           log_path_base,
+                                           baseline_psnr_steady)
+                for model_path, val_sub_path_mdl in models}
+
+        def get_histories(model_path):
+            jobs = jobs_per_model[model_path]
+            return [[self.completed[job['key']] for job in jobs
+                     if job['i'] == i]
+                    for i in range(self.cfg.val.num_repeats)]
+
+        remaining = {model_path: [job for job in jobs
+                                  if job['key'] not in self.completed]
+                     for model_path, jobs in jobs_per_model.items()}
+        for model_path, jobs in remaining.items():
+            if not jobs:
+                yield model_path, get_histories(model_path)
+
+        if self.num_workers == 0:
+            init_worker_state(_get_worker_state,
+                              (self.cfg, self.cfg_mdl_val),
+                              num_threads=self.num_threads_per_worker)
+            for model_path, jobs in remaining.items():
+                for job in jobs:
+                    self._complete(job, run_validation_job(job))
+                if jobs:
+                    yield model_path, get_histories(model_path)
+            return
+
+        num_pending = {model_path: len(jobs)
+                       for model_path, jobs in remaining.items()}
+        with get_worker_pool(
+                self.num_workers, _get_worker_state,
+                initargs=(self.cfg, self.cfg_mdl_val),
+                num_threads_per_worker=self.num_threads_per_worker
+                ) as executor:
+            # submitted in the order of the models, so the first models are
+            # completed first
+            futures = {executor.submit(run_validation_job, job): job
+                       for jobs in remaining.values() for job in jobs}
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = futures.pop(future)
+                    self._complete(job, future.result())
+                    num_pending[job['model_path']] -= 1
+                    if num_pending[job['model_path']] == 0:
+                        yield job['model_path'], get_histories(
+                                job['model_path'])
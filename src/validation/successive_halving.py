@@ -0,0 +1,58 @@
+"""
+Provides the pruning rule for selecting checkpoints by successive halving:
+all checkpoints are validated with a small budget (iterations and
+repetitions), and only the promising ones are validated with larger budgets.
+"""
+from math import ceil
+import numpy as np
+
+def get_successive_halving_score(psnr_histories):
+    """
+    Return the highest PSNR reached by the median PSNR history (w.r.t. all
+    repetitions and validation samples) of a pruning round.
+
+    Parameters
+    ----------
+    psnr_histories : list of lists of lists of scalar values
+        PSNR histories of all runs, indexed like
+        ``psnr_histories[i][i_sample]``.
+    """
+    return float(np.max(np.median(psnr_histories, axis=(0, 1))))
+
+def select_survivors(scores, tolerated_diff, eta=None, min_num_survivors=1):
+    """
+    Select the models to keep after a pruning round.
+
+    A model is dropped if its score is less than the maximum score minus
+    `tolerated_diff`. If `eta` is specified, at most
+    ``max(min_num_survivors, ceil(len(scores) / eta))`` models with the
+    highest scores are kept.
+
+    Parameters
+    ----------
+    scores : dict
+        Scores of the models (e.g. from
+        :func:`get_successive_halving_score`), with the model paths as keys.
+    tolerated_diff : float
+        Tolerated difference to the maximum score.
+    eta : float, optional
+        Reduction factor of the number of models.
+    min_num_survivors : int, optional
+        Minimum number of models kept by the `eta` rule.
+        The default is ``1``.
+
+    Returns
+    -------
+    survivors : list of str
+        Paths of the models to keep, in the order of `scores`.
+    """
+    max_score = max(scores.values())
+    survivors = [model_path for model_path, score in scores.items()
+                 if score >= max_score - tolerated_diff]
+    if eta is not None:
+        num_survivors = max(min_num_survivors, ceil(len(scores) / eta))
+        best = set(sorted(survivors, key=lambda model_path: scores[model_path],
+                          reverse=True)[:num_survivors])
+        survivors = [model_path for model_path in survivors
+                     if model_path in best]
+    return survivors
@@ -1,7 +1,11 @@
 # -*- coding: utf-8 -*-
 import os
 import numpy as np
-from deep_image_prior import DeepImagePriorReconstructor
+from deep_image_prior import DeepImagePriorReconstructor, RiseTimeTracker
+from evaluation.history_store import HistoryStore
+from util.reco_cache import (
+        get_reconstruction_cache, get_reconstruction_key, is_cacheable)
+from omegaconf import OmegaConf
 from copy import deepcopy
 
 def val_sub_sub_path(i, i_sample):
@@ -9,7 +13,8 @@ def val_sub_sub_path(i, i_sample):
                                        'sample_{:d}'.format(i_sample))
     return sub_sub_path_sample
 
-def reconstruct(noisy_obs, fbp, gt, ray_trafo, save_val_sub_path, cfg, cfg_mdl_val):
+def reconstruct(noisy_obs, fbp, gt, ray_trafo, save_val_sub_path, cfg, cfg_mdl_val,
+                history_store_key=None, baseline_psnr_steady=None):
     """
     Run a DIP validation reconstruction.
 
@@ -42,20 +47,69 @@ def reconstruct(noisy_obs, fbp, gt, ray_trafo, save_val_sub_path, cfg, cfg_mdl_v
         instead `cfg_mdl_val` is used as the model configuration.
     cfg_mdl_val : :class:`omegaconf.OmegaConf`
         Configuration of the model.
+    history_store_key : 3-tuple, optional
+        Key ``(run_id, repeat, sample)`` under which the histories are
+        appended to the store ``cfg.save_histories_store_filename`` (if it is
+        specified).
+    baseline_psnr_steady : float, optional
+        Steady PSNR of a baseline. If specified and
+        ``cfg.val.early_stop_at_rise_time`` is `True`, the reconstruction is
+        stopped once the PSNR stayed above
+        ``baseline_psnr_steady - cfg.val.rise_time_to_baseline_remaining_psnr``
+        for ``cfg.val.early_stop_window`` iterations, see
+        :class:`deep_image_prior.RiseTimeTracker`.
+
+    If ``cfg.reconstruction_cache_path`` is specified (and the model seed is
+    set, see :func:`util.reco_cache.is_cacheable`), the result is loaded from
+    the reconstruction cache if available (see
+    :class:`util.reco_cache.ReconstructionCache`), and stored otherwise.
 
     Returns
     -------
     reco :  :class:`numpy.ndarray`
         The reconstruction.
     psnr_history : list of scalar values
-        PSNR history.
+        PSNR history. It is shorter than ``cfg_mdl_val.optim.iterations`` if
+        the reconstruction was stopped early.
     """
-    reconstructor = DeepImagePriorReconstructor(**ray_trafo, cfg=cfg_mdl_val)
-    reco, *optional_out = reconstructor.reconstruct(
-            noisy_obs, fbp, gt,
-            return_histories=True,
-            return_iterates=cfg.save_iterates_path is not None)
-    psnr_history = optional_out[0]['psnr']
+    rise_time_tracker = None
+    if (cfg.val.get('early_stop_at_rise_time', False) and
+            baseline_psnr_steady not in (None, 'own_PSNR_steady')):
+        rise_time_tracker = RiseTimeTracker(
+                baseline_psnr_steady,
+                remaining_psnr=cfg.val.rise_time_to_baseline_remaining_psnr,
+                window=cfg.val.early_stop_window,
+                rise_time_remaining_psnr=cfg.val.rise_time_remaining_psnr,
+                early_stop=True)
+    return_iterates = cfg.save_iterates_path is not None
+    reco_cache = (get_reconstruction_cache(cfg)
+                  if is_cacheable(cfg_mdl_val) else None)
+    entry = None
+    if reco_cache is not None:
+        extra = {'data': OmegaConf.to_container(cfg.data, resolve=True)}
+        if rise_time_tracker is not None:
+            extra['early_stop'] = [rise_time_tracker.threshold,
+                                   rise_time_tracker.window]
+        cache_key = get_reconstruction_key(
+                cfg_mdl_val, noisy_obs, fbp, gt, extra=extra)
+        entry = reco_cache.get(cache_key, require_iterates=return_iterates)
+    if entry is not None:
+        reco = entry['reco']
+        optional_out = [entry['histories']]
+        if return_iterates:
+            optional_out += [entry['iterates'], entry['iterates_iters']]
+    else:
+        reconstructor = DeepImagePriorReconstructor(**ray_trafo, cfg=cfg_mdl_val)
+        reco, *optional_out = reconstructor.reconstruct(
+                noisy_obs, fbp, gt,
+                return_histories=True,
+                return_iterates=return_iterates,
+                rise_time_tracker=rise_time_tracker)
+        if reco_cache is not None:
+            reco_cache.put(cache_key, reco, histories=optional_out[0],
+                           iterates=optional_out[1] if return_iterates else None,
+                           iterates_iters=optional_out[2] if return_iterates else None)
+    psnr_history = [float(psnr) for psnr in optional_out[0]['psnr']]
 
     if cfg.save_histories_path is not None:
         histories = {k: np.array(v, dtype=np.float32)
@@ -65,6 +119,11 @@ def reconstruct(noisy_obs, fbp, gt, ray_trafo, save_val_sub_path, cfg, cfg_mdl_v
         os.makedirs(save_histories_path, exist_ok=True)
         np.savez(os.path.join(save_histories_path, 'histories.npz'),
                  **histories)
+    if (cfg.get('save_histories_store_filename') is not None and
+            history_store_key is not None):
+        run_id, repeat, sample = history_store_key
+        HistoryStore(cfg.save_histories_store_filename).append(
+                run_id, optional_out[0], repeat=repeat, sample=sample)
     if cfg.save_iterates_path is not None:
         iterates = optional_out[1]
         iterates_iters = optional_out[2]
@@ -113,6 +172,8 @@ def validate_model(val_dataset, ray_trafo, seed, val_sub_path_mdl, baseline_psnr
         is determined. If it is `'own_PSNR_steady'`, then
         ``info['PSNR_steady']`` is used. If it is `None`, also
         ``info['rise_time_to_baseline']`` is set to `None`.
+        If ``cfg.val.early_stop_at_rise_time`` is `True` and a float is
+        passed, the repetitions are stopped early (see :func:`reconstruct`).
 
     log_path_base : str
         Base path under which to save the tensorboard logs.
@@ -149,6 +210,9 @@ def validate_model(val_dataset, ray_trafo, seed, val_sub_path_mdl, baseline_psnr
             `'PSNR_0'`: scalar
                 The initial median PSNR, i.e.
                 ``np.median(psnr_histories, axis=(0, 1))[0]``.
+            `'num_early_stopped'` : int
+                Number of runs that were stopped early (see
+                :func:`reconstruct`).
     """
     cfg_mdl_val = deepcopy(cfg_mdl_val)
     psnr_histories = []
@@ -178,12 +242,43 @@ def validate_model(val_dataset, ray_trafo, seed, val_sub_path_mdl, baseline_psnr
                         fbp=fbp.unsqueeze(dim=0), gt=gt.unsqueeze(dim=0),
                         ray_trafo=ray_trafo,
                         save_val_sub_path=save_val_sub_path,
-                        cfg=cfg, cfg_mdl_val=cfg_mdl_val)
+                        cfg=cfg, cfg_mdl_val=cfg_mdl_val,
+                        history_store_key=(
+                                os.path.join(os.getcwd(), val_sub_path_mdl),
+                                i, i_sample),
+                        baseline_psnr_steady=baseline_psnr_steady)
 
             psnr_histories_i.append(psnr_history)
 
         psnr_histories.append(psnr_histories_i)
 
+    info = get_validation_info(psnr_histories, baseline_psnr_steady, cfg,
+                               iterations=cfg_mdl_val.optim.iterations)
+
+    return psnr_histories, info
+
+def get_validation_info(psnr_histories, baseline_psnr_steady, cfg,
+                        iterations=None):
+    """
+    Return the validation info about a model from the PSNR histories of its
+    validation runs, see :func:`validate_model`.
+
+    Histories of early stopped runs are padded with their last value, i.e.
+    the PSNR is assumed to stay at the level that was reached. If
+    `iterations` (the configured number of iterations) is specified, the
+    histories are padded to this length (so that ``cfg.val.psnr_steady_start``
+    refers to the same iterations even if all runs stopped early), and
+    ``info['num_early_stopped']`` is set to the number of runs with shorter
+    histories.
+    """
+    lengths = [len(h) for psnr_histories_i in psnr_histories
+               for h in psnr_histories_i]
+    length = max(lengths + ([iterations] if iterations is not None else []))
+    if min(lengths) != length:
+        psnr_histories = [
+                [np.pad(h, (0, length - len(h)), mode='edge')
+                 for h in psnr_histories_i]
+                for psnr_histories_i in psnr_histories]
     median_psnr_output = np.median(psnr_histories, axis=(0, 1))
     psnr_steady = np.median(median_psnr_output[
             cfg.val.psnr_steady_start:cfg.val.psnr_steady_stop])
@@ -204,5 +299,8 @@ def validate_model(val_dataset, ray_trafo, seed, val_sub_path_mdl, baseline_psnr
             'rise_time_to_baseline': rise_time_to_baseline,
             'PSNR_steady': psnr_steady,
             'PSNR_0': median_psnr_output[0]}
+    if iterations is not None:
+        info['num_early_stopped'] = sum(
+                length < iterations for length in lengths)
 
-    return psnr_histories, info
+    return info
@@ -2,6 +2,7 @@ import hydra
 import os
 import os.path
 import json
+from hydra.utils import to_absolute_path
 from omegaconf import DictConfig, OmegaConf
 from dataset import get_validation_data, get_standard_dataset
 from validation import validate_model
@@ -19,6 +20,9 @@ def coordinator(cfg : DictConfig) -> None:
                  'observation_space': dataset.space[0]
                  }
     val_dataset = get_validation_data(cfg.data.name, cfg.data)
+    if cfg.get('reconstruction_cache_path') is not None:
+        cfg.reconstruction_cache_path = to_absolute_path(
+                cfg.reconstruction_cache_path)
 
     infos = {}
     log_path_base = cfg.mdl.log_path
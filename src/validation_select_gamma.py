@@ -3,7 +3,9 @@ import os
 import os.path
 import json
 import numpy as np
+from hydra.utils import to_absolute_path
 from omegaconf import DictConfig, OmegaConf
+from evaluation.run_index import RunIndex
 import copy
 import difflib
 
@@ -18,43 +20,57 @@ def sorted_dict(d):
     return {k: sorted_dict(v) if isinstance(v, dict) else v
             for k, v in sorted(d.items())}
 
-def collect_runs_paths_per_gamma(base_paths, raise_on_cfg_diff=True):
+def iter_run_cfgs(base_paths, run_index=None):
+    for base_path in base_paths:
+        path = os.path.join(os.getcwd().partition('src')[0], base_path)
+        if run_index is not None:
+            run_index.refresh(path)
+            for dirpath in run_index.find_runs(path):
+                yield dirpath, run_index.get_cfg(dirpath)
+        else:
+            for dirpath, dirnames, filenames in os.walk(path):
+                if '.hydra' in dirnames:
+                    yield dirpath, OmegaConf.load(
+                            os.path.join(dirpath, '.hydra', 'config.yaml'))
+
+def collect_runs_paths_per_gamma(base_paths, raise_on_cfg_diff=True,
+                                 run_index=None):
     paths = {}
     if isinstance(base_paths, str):
         base_paths = [base_paths]
     ref_cfg = None
     ignore_keys_in_cfg_diff = [
-            'mdl.optim.gamma', 'mdl.torch_manual_seed']
-    for base_path in base_paths:
-        path = os.path.join(os.getcwd().partition('src')[0], base_path)
-        for dirpath, dirnames, filenames in os.walk(path):
-            if '.hydra' in dirnames:
-                cfg = OmegaConf.load(
-                        os.path.join(dirpath, '.hydra', 'config.yaml'))
-                paths.setdefault(cfg.mdl.optim.gamma, []).append(dirpath)
-
-                if ref_cfg is None:
-                    ref_cfg = copy.deepcopy(cfg)
-                    for k in ignore_keys_in_cfg_diff:
-                        OmegaConf.update(ref_cfg, k, None)
-                    ref_cfg_yaml = OmegaConf.to_yaml(sorted_dict(OmegaConf.to_object(ref_cfg)))
-                    ref_dirpath = dirpath
-                else:
-                    cur_cfg = copy.deepcopy(cfg)
-                    for k in ignore_keys_in_cfg_diff:
-                        OmegaConf.update(cur_cfg, k, None)
-                    cur_cfg_yaml = OmegaConf.to_yaml(sorted_dict(OmegaConf.to_object(cur_cfg)))
-                    try:
-                        assert cur_cfg_yaml == ref_cfg_yaml
-                    except AssertionError:
-                        print('Diff between config at path {} and config at path {}'.format(ref_dirpath, dirpath))
-                        differ = difflib.Differ()
-                        diff = differ.compare(ref_cfg_yaml.splitlines(),
-                                              cur_cfg_yaml.splitlines())
-                        print('\n'.join(diff))
-                        # print('\n'.join([d for d in diff if d.startswith('-') or d.startswith('+')]))
-                        if raise_on_cfg_diff:
-                            raise
+            'mdl.optim.gamma', 'mdl.optim.gamma_sweep',
+            'mdl.torch_manual_seed']
+    for dirpath, cfg in iter_run_cfgs(base_paths, run_index=run_index):
+        if cfg.mdl.optim.get('gamma_sweep'):
+            # batched sweep (see coordinator.py), the runs per gamma
+            # are stored in sub-directories
+            continue
+        paths.setdefault(cfg.mdl.optim.gamma, []).append(dirpath)
+
+        if ref_cfg is None:
+            ref_cfg = copy.deepcopy(cfg)
+            for k in ignore_keys_in_cfg_diff:
+                OmegaConf.update(ref_cfg, k, None)
+            ref_cfg_yaml = OmegaConf.to_yaml(sorted_dict(OmegaConf.to_object(ref_cfg)))
+            ref_dirpath = dirpath
+        else:
+            cur_cfg = copy.deepcopy(cfg)
+            for k in ignore_keys_in_cfg_diff:
+                OmegaConf.update(cur_cfg, k, None)
+            cur_cfg_yaml = OmegaConf.to_yaml(sorted_dict(OmegaConf.to_object(cur_cfg)))
+            try:
+                assert cur_cfg_yaml == ref_cfg_yaml
+            except AssertionError:
+                print('Diff between config at path {} and config at path {}'.format(ref_dirpath, dirpath))
+                differ = difflib.Differ()
+                diff = differ.compare(ref_cfg_yaml.splitlines(),
+                                      cur_cfg_yaml.splitlines())
+                print('\n'.join(diff))
+                # print('\n'.join([d for d in diff if d.startswith('-') or d.startswith('+')]))
+                if raise_on_cfg_diff:
+                    raise
 
     paths = {k:sorted(v) for k, v in sorted(paths.items()) if v}
     return paths
@@ -67,10 +83,14 @@ def coordinator(cfg : DictConfig) -> None:
                          'which to load the PSNR histories for different '
                          'values of gamma; e.g., specify the path of a '
                          'multirun that was started like this:\n'
-                         '`python coordinator.py --multirun +experiment=no_pretrain data=standard_ellipses_lotus_20 \'mdl.optim.gamma=1e-5,2e-5,4e-5,6.5e-5,1e-4,2e-4,4e-4,6.5e-4,1e-3\' \'mdl.torch_manual_seed=range(10,15)\'`')
+                         '`python coordinator.py --multirun +experiment=no_pretrain data=standard_ellipses_lotus_20 \'mdl.optim.gamma=1e-5,2e-5,4e-5,6.5e-5,1e-4,2e-4,4e-4,6.5e-4,1e-3\' \'mdl.torch_manual_seed=range(10,15)\'`\n'
+                         'or, with one batched run per seed:\n'
+                         '`python coordinator.py --multirun +experiment=no_pretrain data=standard_ellipses_lotus_20 \'mdl.optim.gamma_sweep=[1e-5,2e-5,4e-5,6.5e-5,1e-4,2e-4,4e-4,6.5e-4,1e-3]\' \'mdl.torch_manual_seed=range(10,15)\'`')
 
+    run_index = (RunIndex(to_absolute_path(cfg.val.run_index_filename))
+                 if cfg.val.get('run_index_filename') is not None else None)
     runs = collect_runs_paths_per_gamma(
-            cfg.val.select_gamma_multirun_base_paths)  # , raise_on_cfg_diff=False)  # -> check diff output manually
+            cfg.val.select_gamma_multirun_base_paths, run_index=run_index)  # , raise_on_cfg_diff=False)  # -> check diff output manually
     print_dct(runs) # visualise runs and models checkpoints
 
     os.makedirs(os.path.dirname(os.path.abspath(cfg.val.select_gamma_run_paths_filename)), exist_ok=True)